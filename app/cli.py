@@ -0,0 +1,55 @@
+import argparse
+import json
+import sys
+from app.config import settings
+from app.utils.log import setup_logging
+
+
+def export_command(args):
+    from app.services.export_service import export_service
+
+    export_service.page_size = args.page_size
+    output = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+    try:
+        for chunk in export_service.iter_chunks(compress=args.gzip):
+            output.write(chunk)
+    finally:
+        if output is not sys.stdout.buffer:
+            output.close()
+
+
+def import_command(args):
+    from app.services.import_service import ImportService
+
+    importer = ImportService(chunk_size=args.chunk_size, workers=args.workers)
+    summary = importer.run(args.path, fmt=args.format, checkpoint_path=args.checkpoint)
+    print(json.dumps(summary, indent=2, ensure_ascii=False))
+    if summary["failed"]:
+        sys.exit(1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description="Herramientas del microservicio LDAP")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser("export", help="Exportar los subárboles gestionados en LDIF")
+    export_parser.add_argument("-o", "--output", default="-", help="Archivo de salida ('-' para stdout)")
+    export_parser.add_argument("--gzip", action="store_true", help="Comprimir la salida con gzip")
+    export_parser.add_argument("--page-size", type=int, default=settings.EXPORT_PAGE_SIZE)
+    export_parser.set_defaults(handler=export_command)
+
+    import_parser = commands.add_parser("import", help="Importar usuarios desde CSV o LDIF")
+    import_parser.add_argument("path", help="Archivo CSV (columnas del modelo User) o LDIF")
+    import_parser.add_argument("--format", choices=["csv", "ldif"], help="Por defecto según la extensión")
+    import_parser.add_argument("--checkpoint", help="Archivo de checkpoint (por defecto <path>.checkpoint.json)")
+    import_parser.add_argument("--chunk-size", type=int, default=settings.IMPORT_CHUNK_SIZE)
+    import_parser.add_argument("--workers", type=int, default=settings.IMPORT_WORKERS)
+    import_parser.set_defaults(handler=import_command)
+
+    args = parser.parse_args(argv)
+    setup_logging()
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
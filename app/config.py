@@ -8,9 +8,120 @@ class Settings:
     LDAP_PORT = int(os.getenv("LDAP_PORT", "389"))
     LDAP_BIND_DN = os.getenv("LDAP_BIND_DN")
     LDAP_PASSWORD = os.getenv("LDAP_PASSWORD")
+
+    # Shards por país: "ec=ldap://ldap-ec,pe=ldap://ldap-pe". Los países no listados quedan en LDAP_HOST
+    LDAP_SHARDS = {
+        country.strip().lower(): host.strip()
+        for country, _, host in (item.partition("=") for item in os.getenv("LDAP_SHARDS", "").split(","))
+        if country.strip() and host.strip()
+    }
+    LDAP_SHARD_POOL_SIZE = int(os.getenv("LDAP_SHARD_POOL_SIZE", "8"))
+
+    # Timeouts de socket, reintentos de operaciones idempotentes y circuit breaker por servidor
+    LDAP_CONNECT_TIMEOUT = float(os.getenv("LDAP_CONNECT_TIMEOUT", "5"))
+    LDAP_RECEIVE_TIMEOUT = float(os.getenv("LDAP_RECEIVE_TIMEOUT", "10"))
+    LDAP_RETRY_ATTEMPTS = int(os.getenv("LDAP_RETRY_ATTEMPTS", "3"))
+    LDAP_RETRY_BASE_DELAY = float(os.getenv("LDAP_RETRY_BASE_DELAY", "0.1"))
+    LDAP_RETRY_MAX_DELAY = float(os.getenv("LDAP_RETRY_MAX_DELAY", "1.0"))
+    LDAP_BREAKER_FAILURES = int(os.getenv("LDAP_BREAKER_FAILURES", "5"))
+    LDAP_BREAKER_RESET_SECONDS = float(os.getenv("LDAP_BREAKER_RESET_SECONDS", "10"))
+
+    # batch_modify: operaciones enviadas sin esperar respuesta por conexión ASYNC
+    LDAP_PIPELINE_WINDOW = int(os.getenv("LDAP_PIPELINE_WINDOW", "64"))
+
     BASE_DN = os.getenv("BASE_DN", "dc=test,dc=local")
     JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY")
 
+    # Jobs en segundo plano (vacío = almacenamiento en memoria)
+    JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+    JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", "86400"))
+    JOB_STORE_PATH = os.getenv("JOB_STORE_PATH", "")
+    # Con un JOB_STORE_PATH compartido cada proceso renueva el lease de sus jobs; uno vencido lo retoma otro proceso
+    JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+
+    # Idempotency-Key: ventana de repetición y espera máxima de duplicados concurrentes. Con CACHE_BACKEND=sqlite las claves
+    # se comparten entre workers en CACHE_PATH; una clave en curso se renueva mientras el request sigue y, si su worker murió, se libera tras IDEMPOTENCY_LEASE_SECONDS
+    IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "3600"))
+    IDEMPOTENCY_WAIT_SECONDS = int(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "60"))
+    IDEMPOTENCY_LEASE_SECONDS = int(os.getenv("IDEMPOTENCY_LEASE_SECONDS", "300"))
+
+    # ETag de usuarios: nº de validadores (email -> dn, entryCSN) que se guardan en memoria
+    USER_ETAG_CACHE_SIZE = int(os.getenv("USER_ETAG_CACHE_SIZE", "10000"))
+
+    # Caché de usuarios, DNs y membresías: memory = por proceso; sqlite = compartida entre workers (CACHE_PATH) con invalidaciones
+    CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory").lower()
+    CACHE_PATH = os.getenv("CACHE_PATH", "/tmp/ldap-microservice-cache.sqlite")
+    CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", "30"))
+    CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "50000"))
+    CACHE_INVALIDATION_POLL_SECONDS = float(os.getenv("CACHE_INVALIDATION_POLL_SECONDS", "0.5"))
+
+    # Operaciones masivas de ciclo de vida (desactivar/reactivar/eliminar): conexiones concurrentes
+    BULK_WORKERS = int(os.getenv("BULK_WORKERS", "8"))
+
+    EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "500"))
+    IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "200"))
+    IMPORT_WORKERS = int(os.getenv("IMPORT_WORKERS", "4"))
+
+    # Logging: nivel, salida JSON y muestreo de las líneas info de alto volumen (0.0 - 1.0)
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+    LOG_JSON = os.getenv("LOG_JSON", "false").lower() == "true"
+    LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+
+    # Exportación de spans en formato OTLP/JSON (archivo JSON-lines y/o collector, p.ej. http://collector:4318/v1/traces)
+    TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "ldap-microservice")
+    TRACE_EXPORT_FILE = os.getenv("TRACE_EXPORT_FILE", "")
+    TRACE_EXPORT_ENDPOINT = os.getenv("TRACE_EXPORT_ENDPOINT", "")
+
+    # Perfilador por muestreo bajo demanda (/debug/profile, requiere un JWT con exp y scope "debug"); duración máxima por captura
+    PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "false").lower() == "true"
+    PROFILER_MAX_SECONDS = float(os.getenv("PROFILER_MAX_SECONDS", "60"))
+
+    # Auditoría de escrituras en JSON-lines ("" = desactivada; {pid} = un archivo por worker), con rotación por tamaño
+    AUDIT_FILE = os.getenv("AUDIT_FILE", "")
+    AUDIT_MAX_BYTES = int(os.getenv("AUDIT_MAX_BYTES", str(50 * 1024 * 1024)))
+    AUDIT_BACKUPS = int(os.getenv("AUDIT_BACKUPS", "10"))
+    AUDIT_QUEUE_SIZE = int(os.getenv("AUDIT_QUEUE_SIZE", "10000"))
+    AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "500"))
+    AUDIT_FLUSH_SECONDS = float(os.getenv("AUDIT_FLUSH_SECONDS", "1.0"))
+    AUDIT_BLOCK_SECONDS = float(os.getenv("AUDIT_BLOCK_SECONDS", "0.05"))
+    AUDIT_MAX_VALUES = int(os.getenv("AUDIT_MAX_VALUES", "20"))
+
+    # Feed de cambios: registro en memoria o SQLite compartido (CHANGE_FEED_PATH) y sondeo por modifyTimestamp o entryCSN (0 = solo cambios propios)
+    CHANGE_FEED_PATH = os.getenv("CHANGE_FEED_PATH", "")
+    CHANGE_FEED_MAX_ENTRIES = int(os.getenv("CHANGE_FEED_MAX_ENTRIES", "100000"))
+    CHANGE_FEED_ATTRIBUTE = os.getenv("CHANGE_FEED_ATTRIBUTE", "modifyTimestamp")
+    CHANGE_FEED_POLL_SECONDS = float(os.getenv("CHANGE_FEED_POLL_SECONDS", "10"))
+    CHANGE_FEED_SKEW_SECONDS = float(os.getenv("CHANGE_FEED_SKEW_SECONDS", "5"))
+    CHANGE_FEED_STREAM_POLL_SECONDS = float(os.getenv("CHANGE_FEED_STREAM_POLL_SECONDS", "1"))
+    CHANGE_FEED_HEARTBEAT_SECONDS = float(os.getenv("CHANGE_FEED_HEARTBEAT_SECONDS", "15"))
+
+    # Deadline por request (cabecera X-Request-Timeout en segundos, hasta REQUEST_TIMEOUT_MAX_SECONDS; 0 = sin deadline).
+    # Las rutas bulk y de streaming no tienen deadline salvo que llegue la cabecera
+    REQUEST_TIMEOUT_SECONDS = float(os.getenv("REQUEST_TIMEOUT_SECONDS", "30"))
+    REQUEST_TIMEOUT_MAX_SECONDS = float(os.getenv("REQUEST_TIMEOUT_MAX_SECONDS", "300"))
+
+    # Admission control: clase=concurrencia:cola; las clases de menor prioridad no usan los slots reservados para auth
+    ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+    ADMISSION_LIMITS = os.getenv("ADMISSION_LIMITS", "auth=32:200,read=24:100,write=12:50,bulk=2:4")
+    ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", "32"))
+    ADMISSION_AUTH_RESERVED = int(os.getenv("ADMISSION_AUTH_RESERVED", "4"))
+    ADMISSION_QUEUE_TIMEOUT_SECONDS = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_SECONDS", "2"))
+
+    # Índice en memoria de la jerarquía organizacional (0 = sin reconstrucción periódica)
+    ORG_INDEX_REFRESH_SECONDS = float(os.getenv("ORG_INDEX_REFRESH_SECONDS", "300"))
+
+    # Índice email -> área/departamento; intervalo de reconciliación completa con LDAP
+    USER_INDEX_REFRESH_SECONDS = float(os.getenv("USER_INDEX_REFRESH_SECONDS", "600"))
+
+    # Health prober en segundo plano; HEALTH_PROBE_HOSTS separados por coma (por defecto LDAP_HOST y los shards)
+    HEALTH_PROBE_HOSTS = [
+        h.strip() for h in os.getenv("HEALTH_PROBE_HOSTS", ",".join(dict.fromkeys([LDAP_HOST, *LDAP_SHARDS.values()]))).split(",")
+        if h.strip()
+    ]
+    HEALTH_PROBE_INTERVAL_SECONDS = float(os.getenv("HEALTH_PROBE_INTERVAL_SECONDS", "10"))
+    HEALTH_PROBE_TIMEOUT_SECONDS = float(os.getenv("HEALTH_PROBE_TIMEOUT_SECONDS", "3"))
+    HEALTH_STALE_SECONDS = float(os.getenv("HEALTH_STALE_SECONDS", "30"))
+
 settings = Settings()
 
 
@@ -0,0 +1,20 @@
+from typing import Optional
+
+
+class LDAPServiceError(Exception):
+    """Error del directorio que debe llegar al cliente con su propio status HTTP."""
+    status_code = 500
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class LDAPUnavailableError(LDAPServiceError):
+    """LDAP no responde o el circuit breaker está abierto."""
+    status_code = 503
+
+
+class DeadlineExceededError(LDAPServiceError):
+    """Venció el deadline del request antes de que LDAP respondiera."""
+    status_code = 504
@@ -1,85 +1,527 @@
-from ldap3 import Server, Connection, ALL, MODIFY_ADD, MODIFY_DELETE, MODIFY_REPLACE
+import contextvars
+import functools
+import inspect
+import math
+import queue
+import socket
+import threading
+import time
+import weakref
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from ldap3 import Server, Connection, ALL, ASYNC, BASE, SUBTREE, NO_ATTRIBUTES, MODIFY_ADD, MODIFY_DELETE, MODIFY_REPLACE
+from ldap3.core.exceptions import LDAPCommunicationError, LDAPResponseTimeoutError
+from ldap3.utils.config import set_config_parameter
 from app.config import settings
+from app.exceptions import DeadlineExceededError, LDAPUnavailableError
+from app.utils.cache import directory_cache
+from app.utils.deadline import bounded_timeout, check_deadline, deadline_expired, search_time_limit, time_remaining
 from loguru import logger
+from app.utils.log import redact, sampled
+from app.utils.resilience import backoff_delay, circuit_breaker
+from app.utils.tracing import traced, span
+from ldap3.utils.ciDict import CaseInsensitiveDict
+from typing import Any, Callable, Optional, Dict, Iterable, List, Iterator, Tuple
+
+
+# Errores de red/socket: la conexión queda inservible y cuentan como fallo para el circuit breaker
+CONNECTION_ERRORS = (LDAPCommunicationError, LDAPResponseTimeoutError, socket.timeout, ConnectionError)
+
+
+def receive_timeout(seconds: float) -> int:
+    """Timeout de recepción para ldap3, que lo empaqueta como entero en SO_RCVTIMEO (con un float falla al abrir el socket)."""
+    return max(1, math.ceil(seconds))
+
+# Las esperas de ldap3 sin timeout explícito en conexiones ASYNC (p.ej. el bind) usan el timeout configurado, no sus 20 s
+set_config_parameter("RESPONSE_WAITING_TIMEOUT", receive_timeout(settings.LDAP_RECEIVE_TIMEOUT))
+
+
+def resilient(retry: bool = False):
+    """Pasa la operación por el circuit breaker; con retry=True (solo operaciones
+    idempotentes) reintenta los fallos de conexión con backoff y jitter."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            attempts = max(1, settings.LDAP_RETRY_ATTEMPTS) if retry else 1
+            for attempt in range(1, attempts + 1):
+                try:
+                    with self._guard():
+                        return func(self, *args, **kwargs)
+                except LDAPUnavailableError as e:
+                    if attempt >= attempts or self.breaker.is_open:
+                        raise
+                    delay = backoff_delay(attempt, settings.LDAP_RETRY_BASE_DELAY, settings.LDAP_RETRY_MAX_DELAY)
+                    remaining = time_remaining()
+                    if remaining is not None and remaining <= delay:
+                        raise DeadlineExceededError(f"Request deadline exceeded while retrying LDAP {func.__name__}") from e
+                    logger.warning("LDAP {} failed ({}), retry {}/{} in {:.2f}s", func.__name__, e, attempt, attempts - 1, delay)
+                    time.sleep(delay)
+        return wrapper
+    return decorator
+
+
+# Listeners de las escrituras (p.ej. la auditoría): reciben un dict por operación
+_mutation_listeners: List[Callable[[Dict[str, Any]], None]] = []
+
+
+def add_mutation_listener(listener: Callable[[Dict[str, Any]], None]):
+    if listener not in _mutation_listeners:
+        _mutation_listeners.append(listener)
+
+
+def _notify_mutation(operation: str, dn: str, changes: Any, result: str, success: bool, started: float, error: Optional[str] = None):
+    event = {
+        "operation": operation,
+        "dn": dn,
+        "changes": changes,
+        "result": result,
+        "success": success,
+        "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+    }
+    if error:
+        event["error"] = error
+    for listener in _mutation_listeners:
+        try:
+            listener(event)
+        except Exception as e:
+            logger.warning("Mutation listener {} failed: {}", getattr(listener, "__qualname__", listener), e)
+
+
+def mutation(operation: str):
+    """Notifica cada escritura a los listeners: DN (primer argumento), resto de
+    argumentos como cambios, resultado LDAP y duración. Va debajo de
+    @resilient para que una operación enviada a un shard se notifique una vez."""
+    def decorator(func):
+        signature = inspect.signature(func)
+        dn_param = list(signature.parameters)[1]
+
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            if not _mutation_listeners:
+                return func(self, *args, **kwargs)
+            started = time.perf_counter()
+            error = None
+            try:
+                return func(self, *args, **kwargs)
+            except Exception as e:
+                error = str(e)
+                raise
+            finally:
+                arguments = signature.bind(self, *args, **kwargs).arguments
+                dn = arguments.pop(dn_param)
+                arguments.pop("self", None)
+                # Un único argumento (changes, attrs) se registra tal cual
+                changes = next(iter(arguments.values())) if len(arguments) == 1 else arguments
+                result = (self.conn.result or {}).get("description", "")
+                _notify_mutation(operation, dn, changes, result, error is None, started, error)
+        return wrapper
+    return decorator
+
+
+def _normalize_dn(dn: str) -> str:
+    return ",".join(rdn.strip() for rdn in (dn or "").lower().split(","))
+
+
+def shard_country(dn: str) -> Optional[str]:
+    """País de un DN bajo ou=users (ou=<país>,ou=users,BASE_DN), o None si el DN no está en un país."""
+    suffix = _normalize_dn(f"ou=users,{settings.BASE_DN}")
+    dn = _normalize_dn(dn)
+    if not dn.endswith("," + suffix):
+        return None
+    country_rdn = dn[:-len(suffix) - 1].rsplit(",", 1)[-1]
+    attr, _, value = country_rdn.partition("=")
+    return value.strip() if attr.strip() == "ou" else None
+
+
+def _spans_shards(base_dn: str, scope) -> bool:
+    # Una búsqueda SUBTREE desde ou=users (o un ancestro) alcanza a todos los países
+    if str(scope).upper() != SUBTREE or not settings.LDAP_SHARDS:
+        return False
+    base = _normalize_dn(base_dn)
+    users_dn = _normalize_dn(f"ou=users,{settings.BASE_DN}")
+    return users_dn == base or users_dn.endswith("," + base)
+
+
+def _member_key(group_dn: str, member_dn: str) -> str:
+    return directory_cache.member_key(group_dn, member_dn)
+
+
+def _in_shard(dn: str) -> bool:
+    return shard_country(dn) in settings.LDAP_SHARDS
+
+
+def _merge_entries(results: List[list], arguments: Dict[str, Any]) -> list:
+    merged = [entry for part in results for entry in part]
+    size_limit = arguments.get("size_limit") or 0
+    return merged[:size_limit] if size_limit else merged
+
+
+def _merge_first(results: List[Any], arguments: Dict[str, Any]) -> Any:
+    return next((result for result in results if result is not None), None)
+
+
+def _entry_dn(entry) -> str:
+    # search() devuelve ldap3.Entry, search_raw() tuplas (dn, raw_attributes) y find_dn() el DN
+    if isinstance(entry, tuple):
+        return entry[0]
+    return getattr(entry, "entry_dn", entry)
+
+
+def sharded(scatter: Optional[Callable[[List[Any], Dict[str, Any]], Any]] = None):
+    """Envía la operación al backend del país del DN (primer argumento).
+
+    Con `scatter`, las búsquedas SUBTREE que abarcan ou=users completo se
+    ejecutan en el servidor principal y en todos los shards a la vez y se
+    combinan con esa función. Sin shards configurados no cambia nada.
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+        # Nombre del parámetro del DN (dn, base_dn, user_dn...): también se puede pasar por nombre
+        dn_param = list(signature.parameters)[1]
+
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            if not self.routed:
+                return func(self, *args, **kwargs)
+            dn = args[0] if args else kwargs[dn_param]
+            country = shard_country(dn)
+            if country in settings.LDAP_SHARDS:
+                with shard_pool(country).acquire() as shard:
+                    try:
+                        return getattr(shard, func.__name__)(*args, **kwargs)
+                    finally:
+                        self._last_result = shard.conn.result
+            self._last_result = None
+            if scatter is not None:
+                arguments = signature.bind(self, *args, **kwargs)
+                arguments.apply_defaults()
+                if _spans_shards(dn, arguments.arguments.get("search_scope", SUBTREE)):
+                    return self._scatter(func, scatter, args, kwargs, arguments.arguments)
+            return func(self, *args, **kwargs)
+        return wrapper
+    return decorator
 
 
 class LDAPClient:
-    def __init__(self):
-        logger.info(f"Connecting to LDAP in {settings.LDAP_HOST}:{settings.LDAP_PORT}")
-        self.server = Server(settings.LDAP_HOST, port=settings.LDAP_PORT, get_info=ALL)
-        self._connect()
+    """Cliente LDAP con una conexión.
+
+    Sin `host` es un cliente de enrutamiento: las operaciones sobre países
+    configurados en LDAP_SHARDS van al pool de su backend y el resto al
+    servidor principal (LDAP_HOST). Con `host` habla solo con ese backend.
+    """
+
+    def __init__(self, host: Optional[str] = None):
+        self.host = host or settings.LDAP_HOST
+        self.routed = host is None and bool(settings.LDAP_SHARDS)
+        self._last_result: Optional[dict] = None
+        # Conexiones ASYNC libres para batch_modify: cada lote toma una en exclusiva
+        # (jobs y requests comparten los clientes de los servicios) y la devuelve al terminar
+        self._async_conns: List[Connection] = []
+        self._async_lock = threading.Lock()
+        logger.info("Connecting to LDAP in {}:{}", self.host, settings.LDAP_PORT)
+        self.server = Server(self.host, port=settings.LDAP_PORT, get_info=ALL, connect_timeout=settings.LDAP_CONNECT_TIMEOUT)
+        self.breaker = circuit_breaker(self.host, settings.LDAP_PORT)
+        try:
+            self._connect()
+        except CONNECTION_ERRORS:
+            # Si LDAP no está disponible al arrancar, la conexión se reintenta en la primera operación
+            self.breaker.record_failure()
+            self.conn = self._new_connection()
+
 
+    def _new_connection(self, auto_bind: bool = False) -> Connection:
+        return Connection(
+            self.server,
+            user=settings.LDAP_BIND_DN,
+            password=settings.LDAP_PASSWORD,
+            auto_bind=auto_bind,
+            receive_timeout=receive_timeout(settings.LDAP_RECEIVE_TIMEOUT)
+        )
 
     def _connect(self):
         try:
-            self.conn = Connection(
-                self.server,
-                user=settings.LDAP_BIND_DN,
-                password=settings.LDAP_PASSWORD,
-                auto_bind=True
-            )
+            self.conn = self._new_connection(auto_bind=True)
             if self.conn.bound:
                 logger.success("Connected to LDAP successfully")
             else:
                 logger.error("Error connecting to LDAP")
                 raise Exception("Failed to bind to LDAP server")
         except Exception as e:
-            logger.error(f"LDAP connection error: {e}")
+            logger.error("LDAP connection error: {}", e)
             raise
     
 
     def ensure_connection(self):
         try:
-            if not self.conn.bound:
+            if self.conn.closed or not self.conn.bound:
                 logger.warning("LDAP connection lost, reconnecting...")
                 self._connect()
+                self._limit_socket(time_remaining())
         except Exception as e:
-            logger.error(f"LDAP reconnection error: {e}")
+            logger.error("LDAP reconnection error: {}", e)
             raise
 
+    def _discard_connection(self):
+        # Un socket roto no se reutiliza: ensure_connection abrirá uno nuevo
+        try:
+            self.conn.unbind()
+        except Exception:
+            pass
+
+    def _limit_socket(self, remaining: Optional[float]) -> bool:
+        # El socket espera como mucho lo que le queda al request (ldap3 solo fija el timeout al abrirlo)
+        sock = getattr(self.conn, "socket", None)
+        if remaining is None or sock is None or remaining >= settings.LDAP_RECEIVE_TIMEOUT:
+            return False
+        sock.settimeout(max(0.001, remaining))
+        return True
+
+    def _check_time_limit(self):
+        # Con timeLimit el servidor corta la búsqueda y devuelve resultados parciales: no se usan
+        if (self.conn.result or {}).get("description") == "timeLimitExceeded":
+            raise DeadlineExceededError("LDAP search exceeded the request deadline")
+
+    @contextmanager
+    def _guard(self):
+        remaining = check_deadline("operation")
+        self.breaker.before_call()
+        limited = self._limit_socket(remaining)
+        try:
+            yield
+        except CONNECTION_ERRORS as e:
+            self._discard_connection()
+            if deadline_expired():
+                # Venció el deadline del request, no el servidor: se cierra la conexión (el servidor abandona la operación)
+                self.breaker.release_trial()
+                logger.warning("LDAP operation abandoned at the request deadline: {}", e)
+                raise DeadlineExceededError("Request deadline exceeded waiting for LDAP") from e
+            self.breaker.record_failure()
+            raise LDAPUnavailableError(f"LDAP unavailable: {e}", retry_after=self.breaker.retry_after()) from e
+        except DeadlineExceededError:
+            self.breaker.release_trial()
+            raise
+        except Exception:
+            # El servidor respondió (aunque sea con error): no cuenta como caída
+            self.breaker.record_success()
+            raise
+        else:
+            self.breaker.record_success()
+        finally:
+            if limited and getattr(self.conn, "socket", None) is not None:
+                self.conn.socket.settimeout(settings.LDAP_RECEIVE_TIMEOUT)
+
+
+    @property
+    def result(self) -> Optional[dict]:
+        """Resultado de la última operación, aunque se haya ejecutado en un shard."""
+        return self._last_result if self._last_result is not None else self.conn.result
+
+    def _scatter(self, func, merge, args: tuple, kwargs: dict, arguments: Dict[str, Any]):
+        """Ejecuta la búsqueda en el servidor principal y en cada shard en paralelo y combina los resultados."""
+        def on_shard(country: str):
+            with shard_pool(country).acquire() as shard:
+                return getattr(shard, func.__name__)(*args, **kwargs)
+
+        futures = [
+            _scatter_executor().submit(contextvars.copy_context().run, on_shard, country)
+            for country in settings.LDAP_SHARDS
+        ]
+        # El servidor principal puede conservar copias de países ya movidos a un shard: se descartan
+        local = func(self, *args, **kwargs)
+        if isinstance(local, list):
+            local = [entry for entry in local if not _in_shard(_entry_dn(entry))]
+        elif local is not None and _in_shard(_entry_dn(local)):
+            local = None
+        return merge([local] + [future.result() for future in futures], arguments)
+
 
+    @sharded()
+    @traced("entry_exists")
+    @resilient(retry=True)
     def entry_exists(self, dn: str):
         try:
             self.ensure_connection()
-            self.conn.search(search_base=dn, search_filter='(objectClass=*)', search_scope='BASE')
+            self.conn.search(search_base=dn, search_filter='(objectClass=*)', search_scope='BASE', time_limit=search_time_limit())
+            self._check_time_limit()
             return len(self.conn.entries) > 0
         except Exception as e:
-            logger.error(f"LDAP search error for DN {dn}: {e}")
+            logger.error("LDAP search error for DN {}: {}", dn, e)
             raise
 
 
-    def search(self, base_dn: str, search_filter: str, search_scope='SUBTREE') -> list:
+    @sharded(scatter=_merge_entries)
+    @traced("search")
+    @resilient(retry=True)
+    def search(self, base_dn: str, search_filter: str, search_scope='SUBTREE', attributes: Optional[List[str]] = None) -> list:
         try:
             self.ensure_connection()
-            self.conn.search(search_base=base_dn, search_filter=search_filter, search_scope='SUBTREE', attributes=['*'])
+            self.conn.search(
+                search_base=base_dn,
+                search_filter=search_filter,
+                search_scope=search_scope,
+                attributes=attributes if attributes is not None else ['*'],
+                time_limit=search_time_limit()
+            )
+            self._check_time_limit()
             return self.conn.entries
         except Exception as e:
-            logger.error(f"LDAP search error: base={base_dn}, filter={search_filter}, error={e}")
+            logger.error("LDAP search error: base={}, filter={}, error={}", base_dn, search_filter, e)
+            raise
+
+
+    @sharded(scatter=_merge_first)
+    @traced("search")
+    @resilient(retry=True)
+    def find_dn(self, base_dn: str, search_filter: str) -> Optional[str]:
+        # Solo necesitamos el DN: no se piden atributos al servidor
+        try:
+            self.ensure_connection()
+            self.conn.search(search_base=base_dn, search_filter=search_filter, attributes=[NO_ATTRIBUTES], size_limit=1, time_limit=search_time_limit())
+            self._check_time_limit()
+            for item in self.conn.response or []:
+                if item.get('type') == 'searchResEntry':
+                    return item['dn']
+            return None
+        except Exception as e:
+            logger.error("LDAP DN lookup error: base={}, filter={}, error={}", base_dn, search_filter, e)
+            raise
+
+
+    @sharded()
+    @traced("read")
+    @resilient(retry=True)
+    def read_entry(self, dn: str, attributes: List[str]) -> Optional[Dict[str, list]]:
+        """Lee solo los atributos pedidos de una entrada conocida (búsqueda BASE).
+
+        Devuelve un dict atributo -> lista de valores, o None si la entrada no existe.
+        """
+        try:
+            self.ensure_connection()
+            self.conn.search(search_base=dn, search_filter='(objectClass=*)', search_scope=BASE, attributes=attributes, time_limit=search_time_limit())
+            self._check_time_limit()
+            for item in self.conn.response or []:
+                if item.get('type') != 'searchResEntry':
+                    continue
+                values = CaseInsensitiveDict()
+                for attr, value in item.get('attributes', {}).items():
+                    values[attr] = list(value) if isinstance(value, (list, tuple)) else [value]
+                return values
+            return None
+        except Exception as e:
+            logger.error("LDAP read error for DN {}: {}", dn, e)
             raise
 
 
+    @sharded(scatter=_merge_entries)
+    @traced("search")
+    @resilient(retry=True)
+    def search_raw(self, base_dn: str, search_filter: str, search_scope='SUBTREE', attributes: Optional[List[str]] = None, size_limit: int = 0) -> List[tuple]:
+        """Como search(), pero devuelve (dn, raw_attributes) sin construir objetos ldap3.Entry."""
+        try:
+            self.ensure_connection()
+            self.conn.search(
+                search_base=base_dn,
+                search_filter=search_filter,
+                search_scope=search_scope,
+                attributes=attributes if attributes is not None else ['*'],
+                size_limit=size_limit,
+                time_limit=search_time_limit()
+            )
+            self._check_time_limit()
+            return [
+                (item['dn'], item['raw_attributes'])
+                for item in self.conn.response or []
+                if item.get('type') == 'searchResEntry'
+            ]
+        except Exception as e:
+            logger.error("LDAP search error: base={}, filter={}, error={}", base_dn, search_filter, e)
+            raise
+
+
+    def read_raw(self, dn: str, attributes: List[str]) -> Optional[Dict[str, list]]:
+        """Lectura BASE de los atributos pedidos; devuelve raw_attributes o None si la entrada no existe."""
+        results = self.search_raw(dn, '(objectClass=*)', search_scope=BASE, attributes=attributes or [NO_ATTRIBUTES])
+        return results[0][1] if results else None
+
+
+    def paged_search(self, base_dn: str, search_filter: str, attributes: Optional[List[str]] = None, page_size: int = 500) -> Iterator[dict]:
+        """Recorre un subárbol página a página sin acumular las entradas en memoria.
+
+        Produce los dicts de respuesta de ldap3 (dn, attributes, raw_attributes).
+        """
+        if self.routed:
+            country = shard_country(base_dn)
+            if country in settings.LDAP_SHARDS:
+                with shard_pool(country).acquire() as shard:
+                    yield from shard.paged_search(base_dn, search_filter, attributes, page_size)
+                return
+            if _spans_shards(base_dn, SUBTREE):
+                # Los backends se recorren uno tras otro: el consumidor marca el ritmo de las páginas
+                for item in self._paged_search(base_dn, search_filter, attributes, page_size):
+                    if not _in_shard(item["dn"]):
+                        yield item
+                for country in settings.LDAP_SHARDS:
+                    with shard_pool(country).acquire() as shard:
+                        yield from shard.paged_search(base_dn, search_filter, attributes, page_size)
+                return
+        yield from self._paged_search(base_dn, search_filter, attributes, page_size)
+
+    def _paged_search(self, base_dn: str, search_filter: str, attributes: Optional[List[str]], page_size: int) -> Iterator[dict]:
+        logger.debug("Paged search: base={}, filter={}, page_size={}", base_dn, search_filter, page_size)
+        # El span cubre todo el recorrido (incluye el tiempo que el consumidor tarda entre páginas)
+        with self._guard(), span("ldap.paged_search", **{"ldap.operation": "paged_search", "ldap.base_dn": base_dn}) as current:
+            self.ensure_connection()
+            results = self.conn.extend.standard.paged_search(
+                search_base=base_dn,
+                search_filter=search_filter,
+                attributes=attributes if attributes is not None else ['*'],
+                paged_size=page_size,
+                time_limit=search_time_limit(),
+                generator=True
+            )
+            count = 0
+            for item in results:
+                if item.get('type') == 'searchResEntry':
+                    count += 1
+                    yield item
+                # Entre páginas no hay operación en vuelo: se corta aquí si venció el deadline
+                check_deadline("paged search")
+            self._check_time_limit()
+            current.set("ldap.entries", count)
+
+
+    @sharded()
+    @traced("add")
+    @resilient(retry=False)
+    @mutation("add")
     def add_entry(self, dn: str, object_classes: list, attributes: dict):
         try:
             self.ensure_connection()
-            logger.debug(f"Adding entry: {dn}")
-            logger.debug(f"Object classes: {object_classes}")
-            logger.debug(f"Attributes: {attributes}")
+            logger.debug("Adding entry: {}", dn)
+            logger.opt(lazy=True).debug("Object classes: {} Attributes: {}", lambda: object_classes, lambda: redact(attributes))
             
             self.conn.add(dn, object_classes, attributes)
             if not self.conn.result['description'] == 'success':
                 raise Exception(f"Error adding entry: {self.conn.result}")
-            logger.info(f"Entry added successfully: {dn}")
+            sampled.info("Entry added successfully: {}", dn)
         except Exception as e:
-            logger.error(f"Error adding entry {dn}: {e}")
+            logger.error("Error adding entry {}: {}", dn, e)
             raise
+        finally:
+            directory_cache.invalidate_entry(dn)
 
 
+    @sharded()
+    @traced("modify")
+    @resilient(retry=False)
+    @mutation("modify")
     def modify_entry(self, dn: str, changes: dict):
 
         try:
             self.ensure_connection()
-            logger.debug(f"Modifying entry: {dn}")
-            logger.debug(f"Changes: {changes}")
+            logger.debug("Modifying entry: {}", dn)
+            logger.opt(lazy=True).debug("Changes: {}", lambda: redact(changes))
             
 
             ldap_changes = {}
@@ -90,46 +532,65 @@ class LDAPClient:
             self.conn.modify(dn, ldap_changes)
             if not self.conn.result['description'] == 'success':
                 raise Exception(f"Error modifying entry: {self.conn.result}")
-            logger.info(f"Entry modified successfully: {dn}")
+            sampled.info("Entry modified successfully: {}", dn)
         except Exception as e:
-            logger.error(f"Error modifying entry {dn}: {e}")
+            logger.error("Error modifying entry {}: {}", dn, e)
             raise
+        finally:
+            # También si falló: un timeout no dice si el cambio se aplicó
+            directory_cache.invalidate_entry(dn)
 
 
+    @sharded()
+    @traced("delete")
+    @resilient(retry=False)
+    @mutation("delete")
     def delete_entry(self, dn: str):
         try:
             self.ensure_connection()
-            logger.debug(f"Deleting entry: {dn}")
+            logger.debug("Deleting entry: {}", dn)
             
             self.conn.delete(dn)
             if not self.conn.result['description'] == 'success':
                 raise Exception(f"Error deleting entry: {self.conn.result}")
-            logger.info(f"Entry deleted successfully: {dn}")
+            logger.info("Entry deleted successfully: {}", dn)
         except Exception as e:
-            logger.error(f"Error deleting entry {dn}: {e}")
+            logger.error("Error deleting entry {}: {}", dn, e)
             raise
+        finally:
+            directory_cache.invalidate_entry(dn, removed=True)
 
 
+    @sharded()
+    @traced("bind")
+    @resilient(retry=True)
     def bind_as_user(self, user_dn: str, password: str) -> bool:
         try:
-            logger.debug(f"Attempting bind as user: {user_dn}")
+            logger.debug("Attempting bind as user: {}", user_dn)
             
             # Crear conexión temporal para autenticación
-            user_conn = Connection(self.server, user=user_dn, password=password, auto_bind=True)
+            user_conn = Connection(self.server, user=user_dn, password=password, auto_bind=True, receive_timeout=receive_timeout(bounded_timeout(settings.LDAP_RECEIVE_TIMEOUT)))
             is_authenticated = user_conn.bound
             
             if is_authenticated:
-                logger.debug(f"Bind successful for: {user_dn}")
+                logger.debug("Bind successful for: {}", user_dn)
                 user_conn.unbind()  # Cerrar la conexión temporal
             else:
-                logger.debug(f"Bind failed for: {user_dn}")
+                logger.debug("Bind failed for: {}", user_dn)
             
             return is_authenticated
+        except CONNECTION_ERRORS:
+            # Un fallo de red no es una credencial inválida
+            raise
         except Exception as e:
-            logger.debug(f"Bind error for user {user_dn}: {e}")
+            logger.debug("Bind error for user {}: {}", user_dn, e)
             return False
 
 
+    @sharded()
+    @traced("add")
+    @resilient(retry=False)
+    @mutation("add_ou")
     def create_ou(self, ou_dn: str):
         try:
             self.ensure_connection()
@@ -137,25 +598,154 @@ class LDAPClient:
             self.conn.add(ou_dn, ['organizationalUnit', 'top'], {'ou': ou_name})
             if not self.conn.result['description'] == 'success':
                 raise Exception(f"Error creating OU: {self.conn.result}")
-            logger.info(f"OU created successfully: {ou_dn}")
+            logger.info("OU created successfully: {}", ou_dn)
         except Exception as e:
-            logger.error(f"LDAP error creating OU {ou_dn}: {e}")
+            logger.error("LDAP error creating OU {}: {}", ou_dn, e)
             raise
         
 
+    @sharded()
+    @traced("add")
+    @resilient(retry=False)
+    @mutation("add")
     def create_entry(self, user_dn: str, attrs: dict):
         try:
             self.ensure_connection()
-            logger.debug(f"Creating user: {user_dn}")
-            logger.debug(f"Attributes: {attrs}")
+            logger.debug("Creating user: {}", user_dn)
+            logger.opt(lazy=True).debug("Attributes: {}", lambda: redact(attrs))
             
             self.conn.add(user_dn, attrs['objectClass'], attrs)
             if not self.conn.result['description'] == 'success':
                 raise Exception(f"Error creating user: {self.conn.result}")
-            logger.success(f"User created successfully: {user_dn}")
+            logger.success("User created successfully: {}", user_dn)
         except Exception as e:
-            logger.error(f"Error creating user {user_dn}: {e}")
+            logger.error("Error creating user {}: {}", user_dn, e)
             raise
+        finally:
+            directory_cache.invalidate_entry(user_dn)
+
+        
+    def batch_modify(self, operations: Iterable[Tuple[str, dict]], window: Optional[int] = None, tolerate: Iterable[str] = ()) -> Iterator[Dict[str, Any]]:
+        """Aplica muchos modify enviándolos seguidos por una conexión ASYNC (pipelining).
+
+        `operations` son pares (dn, cambios en formato ldap3, p.ej.
+        {"businessCategory": [(MODIFY_DELETE, ["x"])]}). Se mantienen hasta
+        `window` operaciones en vuelo (LDAP_PIPELINE_WINDOW) y las respuestas se
+        recogen por message ID en el orden de envío. Produce un dict por
+        operación con dn, success, result y message; los códigos de `tolerate`
+        (p.ej. noSuchAttribute) cuentan como éxito.
+        """
+        window = max(1, window or settings.LDAP_PIPELINE_WINDOW)
+        if not self.routed:
+            yield from self._pipeline_modify(operations, window, set(tolerate))
+            return
+        # Cada backend recibe su propio lote
+        batches: Dict[Optional[str], List[Tuple[str, dict]]] = {}
+        for dn, changes in operations:
+            country = shard_country(dn)
+            batches.setdefault(country if country in settings.LDAP_SHARDS else None, []).append((dn, changes))
+        for country, batch in batches.items():
+            if country is None:
+                yield from self._pipeline_modify(batch, window, set(tolerate))
+            else:
+                with shard_pool(country).acquire() as shard:
+                    yield from shard.batch_modify(batch, window, tolerate)
+
+    def _pipeline_modify(self, operations: Iterable[Tuple[str, dict]], window: int, tolerate: set) -> Iterator[Dict[str, Any]]:
+        # (message ID, dn, cambios, inicio) de cada operación enviada y aún sin respuesta
+        in_flight: "deque[Tuple[int, str, dict, float]]" = deque()
+        completed = False
+        conn: Optional[Connection] = None
+        with self._guard(), span("ldap.batch_modify", **{"ldap.operation": "batch_modify", "ldap.window": window}) as current:
+            try:
+                conn = self._acquire_async_connection()
+                count = 0
+                for dn, changes in operations:
+                    if len(in_flight) >= window:
+                        yield self._collect_modify(conn, in_flight, tolerate)
+                    check_deadline("batch_modify")
+                    in_flight.append((conn.modify(dn, changes), dn, changes, time.perf_counter()))
+                    count += 1
+                while in_flight:
+                    yield self._collect_modify(conn, in_flight, tolerate)
+                completed = True
+                current.set("ldap.entries", count)
+            except (DeadlineExceededError, *CONNECTION_ERRORS):
+                if deadline_expired():
+                    # Se pide al servidor que abandone las que siguen en vuelo antes de cerrar la conexión
+                    for message_id, *_ in in_flight:
+                        try:
+                            conn.abandon(message_id)
+                        except Exception:
+                            pass
+                # Las operaciones sin respuesta quedan sin confirmar: el llamador no las marca como hechas
+                for _, dn, changes, started in in_flight:
+                    directory_cache.invalidate_entry(dn)
+                    if _mutation_listeners:
+                        _notify_mutation("modify", dn, changes, "", False, started, "connection lost before the response")
+                raise
+            finally:
+                if conn is not None:
+                    # Tras un error o un consumidor que abandonó el generador quedan respuestas
+                    # pendientes en la conexión: se cierra en lugar de devolverla
+                    self._release_async_connection(conn, reuse=completed)
+
+    def _collect_modify(self, conn: Connection, in_flight: "deque[Tuple[int, str, dict, float]]", tolerate: set) -> Dict[str, Any]:
+        message_id, dn, changes, started = in_flight[0]
+        _, result = conn.get_response(message_id, timeout=bounded_timeout(settings.LDAP_RECEIVE_TIMEOUT))
+        in_flight.popleft()
+        directory_cache.invalidate_entry(dn)
+        result = result or {}
+        description = result.get("description", "")
+        success = description == "success" or description in tolerate
+        if _mutation_listeners:
+            _notify_mutation("modify", dn, changes, description, success, started, None if success else result.get("message") or description)
+        return {
+            "dn": dn,
+            "success": success,
+            "result": description,
+            "message": result.get("message", ""),
+        }
+
+    def _acquire_async_connection(self) -> Connection:
+        with self._async_lock:
+            while self._async_conns:
+                conn = self._async_conns.pop()
+                if not conn.closed and conn.bound:
+                    return conn
+        check_deadline("batch_modify")
+        return Connection(
+            self.server,
+            user=settings.LDAP_BIND_DN,
+            password=settings.LDAP_PASSWORD,
+            auto_bind=True,
+            client_strategy=ASYNC,
+            receive_timeout=receive_timeout(settings.LDAP_RECEIVE_TIMEOUT)
+        )
+
+    def _release_async_connection(self, conn: Connection, reuse: bool = True):
+        if reuse and not conn.closed and conn.bound:
+            with self._async_lock:
+                self._async_conns.append(conn)
+            return
+        try:
+            conn.unbind()
+        except Exception:
+            pass
+
+    def _close_async_connections(self):
+        with self._async_lock:
+            conns, self._async_conns = self._async_conns, []
+        for conn in conns:
+            self._release_async_connection(conn, reuse=False)
+
+    def close(self):
+        try:
+            if self.conn.bound:
+                self.conn.unbind()
+        except Exception as e:
+            logger.warning("Error closing LDAP connection: {}", e)
+        self._close_async_connections()
 
         
     def test_connection(self):
@@ -163,43 +753,292 @@ class LDAPClient:
             self.ensure_connection()
             return self.conn.bound
         except Exception as e:
-            logger.error(f"LDAP connection test error: {e}")
+            logger.error("LDAP connection test error: {}", e)
             return False
     
 
 
 
+    @sharded()
+    @traced("compare")
+    @resilient(retry=True)
+    def compare(self, dn: str, attribute: str, value: str) -> bool:
+        self.ensure_connection()
+        matched = self.conn.compare(dn, attribute, value)
+        if self.conn.result['description'] not in ('compareTrue', 'compareFalse'):
+            raise Exception(f"Error comparing {attribute} on {dn}: {self.conn.result}")
+        return bool(matched)
+
+    def is_group_member(self, group_dn: str, member_dn: str) -> bool:
+        # Compare evalúa la pertenencia en el servidor sin transferir la lista de miembros
+        return directory_cache.get_or_load(
+            "member", _member_key(group_dn, member_dn),
+            lambda: self.compare(group_dn, "member", member_dn)
+        )
+
+    def iter_group_members(self, group_dn: str, range_size: int = 1000) -> Iterator[str]:
+        """Recorre los miembros de un grupo por rangos (member;range=a-b).
+
+        Si el servidor no soporta recuperación por rangos se hace una sola lectura de `member`.
+        """
+        with self._guard():
+            self.ensure_connection()
+            start = 0
+            while True:
+                with span("ldap.read", **{"ldap.operation": "read_members", "ldap.base_dn": group_dn}):
+                    self.conn.search(group_dn, '(objectClass=*)', search_scope=BASE, attributes=[f"member;range={start}-{start + range_size - 1}"], time_limit=search_time_limit())
+                self._check_time_limit()
+                raw = self._first_raw_attributes()
+                # ldap3 devuelve los atributos pedidos y ausentes como listas vacías
+                ranged = next((attr for attr in raw if attr.lower().startswith("member;range=") and raw[attr]), None)
+
+                if ranged is None:
+                    if start == 0:
+                        with span("ldap.read", **{"ldap.operation": "read_members", "ldap.base_dn": group_dn}):
+                            self.conn.search(group_dn, '(objectClass=*)', search_scope=BASE, attributes=["member"], time_limit=search_time_limit())
+                        self._check_time_limit()
+                        for value in self._first_raw_attributes().get("member", []):
+                            if value:
+                                yield value.decode("utf-8")
+                    return
+
+                for value in raw[ranged]:
+                    yield value.decode("utf-8")
+                end = ranged.rsplit("-", 1)[1]
+                if end == "*":
+                    return
+                start = int(end) + 1
+
+    def count_group_members(self, group_dn: str, limit: Optional[int] = None) -> int:
+        """Cuenta miembros sin construir la lista; con `limit` deja de leer al alcanzarlo.
+
+        Primero comprueba con (member=*) si hay algún miembro, sin transferir
+        valores: 0 y limit=1 se resuelven ahí. Para límites mayores se recorren
+        los rangos de member; en servidores sin recuperación por rangos
+        (OpenLDAP) eso es una lectura completa del atributo, porque LDAP no
+        permite pedir solo los N primeros valores.
+        """
+        with self._guard():
+            self.ensure_connection()
+            with span("ldap.read", **{"ldap.operation": "count_members", "ldap.base_dn": group_dn}):
+                self.conn.search(group_dn, '(member=*)', search_scope=BASE, attributes=[NO_ATTRIBUTES], time_limit=search_time_limit())
+            self._check_time_limit()
+            if not any(item.get('type') == 'searchResEntry' for item in self.conn.response or []):
+                return 0
+        if limit == 1:
+            return 1
+        range_size = min(limit, 1000) if limit else 1000
+        count = 0
+        for _ in self.iter_group_members(group_dn, range_size=range_size):
+            count += 1
+            if limit and count >= limit:
+                break
+        return count
+
+    def _first_raw_attributes(self) -> dict:
+        for item in self.conn.response or []:
+            if item.get('type') == 'searchResEntry':
+                return item.get('raw_attributes', {})
+        return {}
+
+    @traced("modify")
+    @resilient(retry=False)
+    @mutation("add_member")
     def add_group_member(self, group_dn: str, member_dn: str):
         self.ensure_connection()
-        logger.debug(f"Adding member {member_dn} to group {group_dn}")
+        logger.debug("Adding member {} to group {}", member_dn, group_dn)
         self.conn.modify(group_dn, {"member": [(MODIFY_ADD, [member_dn])]})
-        logger.debug(f"LDAP modify result: {self.conn.result}")
+        directory_cache.invalidate("member", _member_key(group_dn, member_dn))
+        logger.debug("LDAP modify result: {}", self.conn.result)
         if not self.conn.result['description'] == 'success':
             raise Exception(f"Error adding member: {self.conn.result}")
 
+    @traced("modify")
+    @resilient(retry=False)
+    @mutation("remove_member")
     def remove_group_member(self, group_dn: str, member_dn: str):
         self.ensure_connection()
-        logger.debug(f"Removing member {member_dn} from group {group_dn}")
+        logger.debug("Removing member {} from group {}", member_dn, group_dn)
         self.conn.modify(group_dn, {"member": [(MODIFY_DELETE, [member_dn])]})
-        logger.debug(f"LDAP modify result: {self.conn.result}")
+        directory_cache.invalidate("member", _member_key(group_dn, member_dn))
+        logger.debug("LDAP modify result: {}", self.conn.result)
         if not self.conn.result['description'] == 'success':
             raise Exception(f"Error removing member: {self.conn.result}")
 
+    @traced("modify")
+    @resilient(retry=False)
+    @mutation("modify_members")
+    def modify_group_members(self, group_dn: str, add: list, remove: list):
+        # Altas y bajas en una sola operación modify
+        self.ensure_connection()
+        logger.debug("Modifying members of group {}: +{} -{}", group_dn, len(add), len(remove))
+        changes = []
+        if add:
+            changes.append((MODIFY_ADD, list(add)))
+        if remove:
+            changes.append((MODIFY_DELETE, list(remove)))
+        if not changes:
+            return
+        self.conn.modify(group_dn, {"member": changes})
+        directory_cache.invalidate("member", f"{group_dn.lower()}|", prefix=True)
+        logger.debug("LDAP modify result: {}", self.conn.result)
+        if not self.conn.result['description'] == 'success':
+            raise Exception(f"Error modifying members: {self.conn.result}")
+
+    @sharded()
+    @traced("modify")
+    @resilient(retry=False)
+    @mutation("add_value")
+    def add_attribute_value(self, dn: str, attribute: str, value: str) -> bool:
+        """Agrega un valor sin leer la entrada. Devuelve False si el valor ya existía."""
+        self.ensure_connection()
+        self.conn.modify(dn, {attribute: [(MODIFY_ADD, [value])]})
+        directory_cache.invalidate_entry(dn)
+        if self.conn.result['description'] == 'attributeOrValueExists':
+            return False
+        if not self.conn.result['description'] == 'success':
+            raise Exception(f"Error adding {attribute} value: {self.conn.result}")
+        return True
+
+    @sharded()
+    @traced("modify")
+    @resilient(retry=False)
+    @mutation("remove_value")
+    def remove_attribute_value(self, dn: str, attribute: str, value: str) -> bool:
+        """Quita un valor sin leer la entrada. Devuelve False si el valor no existía."""
+        self.ensure_connection()
+        self.conn.modify(dn, {attribute: [(MODIFY_DELETE, [value])]})
+        directory_cache.invalidate_entry(dn)
+        if self.conn.result['description'] == 'noSuchAttribute':
+            return False
+        if not self.conn.result['description'] == 'success':
+            raise Exception(f"Error removing {attribute} value: {self.conn.result}")
+        return True
+
+    @traced("modify")
+    @resilient(retry=False)
+    @mutation("replace_members")
     def replace_group_members(self, group_dn: str, members: list):
         self.ensure_connection()
-        logger.debug(f"Replacing members in group {group_dn} with {members}")
+        logger.debug("Replacing members in group {} with {} members", group_dn, len(members))
         self.conn.modify(group_dn, {"member": [(MODIFY_REPLACE, members)]})
-        logger.debug(f"LDAP modify result: {self.conn.result}")
+        directory_cache.invalidate("member", f"{group_dn.lower()}|", prefix=True)
+        logger.debug("LDAP modify result: {}", self.conn.result)
         if not self.conn.result['description'] == 'success':
             raise Exception(f"Error replacing members: {self.conn.result}")
 
+    @traced("modify")
+    @resilient(retry=False)
+    @mutation("clear_members")
     def clear_group_members(self, group_dn: str):
         self.ensure_connection()
-        logger.debug(f"Clearing all members from group {group_dn}")
+        logger.debug("Clearing all members from group {}", group_dn)
         self.conn.modify(group_dn, {"member": [(MODIFY_DELETE, [])]})
-        logger.debug(f"LDAP modify result: {self.conn.result}")
+        directory_cache.invalidate("member", f"{group_dn.lower()}|", prefix=True)
+        logger.debug("LDAP modify result: {}", self.conn.result)
         if not self.conn.result['description'] == 'success':
             raise Exception(f"Error clearing members: {self.conn.result}")
 
 
+class LDAPClientPool:
+    """Pool de LDAPClient (una conexión cada uno) para trabajo concurrente.
+
+    Las conexiones se abren bajo demanda hasta `size`; acquire() bloquea si todas están en uso.
+    """
+
+    def __init__(self, size: int, name: str = "ldap", host: Optional[str] = None):
+        self.size = size
+        self.name = name
+        self.host = host
+        self._idle: "queue.Queue[LDAPClient]" = queue.Queue()
+        self._created = 0
+        self._in_use = 0
+        self._lock = threading.Lock()
+        _pools.add(self)
+
+    @property
+    def in_use(self) -> int:
+        return self._in_use
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "name": self.name,
+            "size": self.size,
+            "open": self._created,
+            "in_use": self._in_use,
+            "utilisation": round(self._in_use / self.size, 3) if self.size else 0.0,
+        }
+
+    @contextmanager
+    def acquire(self, timeout: Optional[float] = None):
+        with self._lock:
+            if self._idle.empty() and self._created < self.size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+        remaining = None if create else check_deadline("pool acquire")
+        if remaining is not None:
+            timeout = remaining if timeout is None else min(timeout, remaining)
+        try:
+            client = LDAPClient(self.host) if create else self._idle.get(timeout=timeout)
+        except queue.Empty:
+            if deadline_expired():
+                raise DeadlineExceededError(f"Request deadline exceeded waiting for a connection from pool {self.name}")
+            raise
+        except Exception:
+            if create:
+                with self._lock:
+                    self._created -= 1
+            raise
+
+        with self._lock:
+            self._in_use += 1
+        try:
+            yield client
+        finally:
+            with self._lock:
+                self._in_use -= 1
+            self._idle.put(client)
+
+    def close(self):
+        while not self._idle.empty():
+            self._idle.get_nowait().close()
+        with self._lock:
+            self._created = 0
+
+
+# Pools vivos del proceso, para reportar su uso en /health sin mantenerlos referenciados
+_pools: "weakref.WeakSet[LDAPClientPool]" = weakref.WeakSet()
+
+
+def pool_stats() -> List[Dict[str, object]]:
+    return [pool.stats() for pool in list(_pools)]
+
+
+_shard_pools: Dict[str, LDAPClientPool] = {}
+_shard_lock = threading.Lock()
+_scatter_pool: Optional[ThreadPoolExecutor] = None
+
+
+def shard_pool(country: str) -> LDAPClientPool:
+    """Pool de conexiones al backend de un país (uno por servidor, compartido por todo el proceso)."""
+    host = settings.LDAP_SHARDS[country]
+    with _shard_lock:
+        pool = _shard_pools.get(host)
+        if pool is None:
+            pool = LDAPClientPool(settings.LDAP_SHARD_POOL_SIZE, name=f"shard:{host}", host=host)
+            _shard_pools[host] = pool
+        return pool
+
+
+def _scatter_executor() -> ThreadPoolExecutor:
+    global _scatter_pool
+    with _shard_lock:
+        if _scatter_pool is None:
+            workers = max(1, len(set(settings.LDAP_SHARDS.values()))) * settings.LDAP_SHARD_POOL_SIZE
+            _scatter_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ldap-scatter")
+        return _scatter_pool
+
+
 ldap_client = LDAPClient()
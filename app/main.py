@@ -1,8 +1,32 @@
-from fastapi import FastAPI
+import math
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from loguru import logger
+from app.exceptions import LDAPServiceError
+from app.utils.log import setup_logging
+
+# Configurar logging antes de importar las rutas: los servicios se conectan a LDAP al importarse
+setup_logging()
+
 from app.routes.users import router as users_router
 from app.routes.roles import router as roles_router
 from app.routes.organizational_group import router as organizational_groups_router
+from app.routes.jobs import router as jobs_router
+from app.routes.export import router as export_router
+from app.routes.health import router as health_router
+from app.routes.changes import router as changes_router
+from app.routes.debug import router as debug_router
+from app.services.job_service import job_service
+from app.services.health_service import health_service
+from app.services.change_feed_service import change_feed
+from app.services.org_hierarchy_service import org_hierarchy_index
+from app.services.user_index_service import user_directory_index
+from app.utils.cache import directory_cache
+from app.utils.audit import audit_writer
+from app.ldap_client import add_mutation_listener
 from app.middleware.jwt_middleware import decrypt_jwt_middleware
+from app.middleware.request_context import request_context_middleware
+from app.middleware.admission import admission_middleware
 
 app = FastAPI(
     title="Microservicio de sincnización a LDAP",
@@ -13,12 +37,74 @@ app = FastAPI(
 
 
 
+# El último registrado es el más externo: el contexto del request envuelve a la admisión
+app.middleware("http")(admission_middleware)
+app.middleware("http")(request_context_middleware)
+
+
+@app.exception_handler(LDAPServiceError)
+async def ldap_service_error_handler(request: Request, exc: LDAPServiceError):
+    headers = {"Retry-After": str(max(1, math.ceil(exc.retry_after)))} if exc.retry_after is not None else None
+    return JSONResponse(status_code=exc.status_code, content={"detail": str(exc)}, headers=headers)
 
 
 app.include_router(users_router, prefix="/api/v2/ldap", tags=["Users"])
 app.include_router(roles_router, prefix="/api/v2/ldap", tags=["Roles"])
 
 app.include_router(organizational_groups_router, prefix="/api/v2/ldap", tags=["Organizational Groups"])  # NUEVO
+app.include_router(jobs_router, prefix="/api/v2/ldap", tags=["Jobs"])
+app.include_router(export_router, prefix="/api/v2/ldap", tags=["Export"])
+app.include_router(health_router, prefix="/api/v2/ldap", tags=["Health"])
+app.include_router(changes_router, prefix="/api/v2/ldap", tags=["Changes"])
+app.include_router(debug_router, prefix="/api/v2/ldap", tags=["Debug"])
+
+
+@app.on_event("startup")
+def start_background_jobs():
+    # Arranca los workers y retoma los jobs pendientes del store persistente
+    job_service.start()
+
+
+@app.on_event("startup")
+def start_health_prober():
+    health_service.start()
+
+
+@app.on_event("startup")
+def start_directory_indexes():
+    # Primera construcción y reconstrucción periódica en segundo plano
+    org_hierarchy_index.start()
+    user_directory_index.start()
+
+
+@app.on_event("startup")
+def start_cache_invalidations():
+    # Solo con la caché compartida: aplica las invalidaciones publicadas por los otros workers
+    directory_cache.start()
+
+
+@app.on_event("startup")
+def start_audit_trail():
+    # Cada escritura en LDAP se encola para el registro de auditoría (AUDIT_FILE)
+    if audit_writer.enabled:
+        add_mutation_listener(audit_writer.record)
+        audit_writer.start()
+
+
+@app.on_event("startup")
+def start_change_feed():
+    # Escrituras propias al registro de cambios y sondeo del directorio para las ajenas
+    add_mutation_listener(change_feed.record_mutation)
+    change_feed.start()
+
+
+@app.on_event("shutdown")
+async def flush_logs():
+    health_service.stop()
+    directory_cache.stop()
+    change_feed.stop()
+    audit_writer.stop()
+    await logger.complete()
 
 @app.get("/")
 def root():
@@ -0,0 +1,232 @@
+import asyncio
+import heapq
+import itertools
+import math
+import re
+import time
+from typing import Dict, List, Optional, Tuple
+from fastapi import Request
+from fastapi.responses import JSONResponse
+from loguru import logger
+from app.config import settings
+
+API_PREFIX = "/api/v2/ldap"
+
+# Menor número = mayor prioridad al repartir los slots que se liberan
+PRIORITIES = {"auth": 0, "read": 1, "write": 2, "bulk": 3}
+
+# (método, ruta relativa a API_PREFIX, clase). Las rutas no listadas: GET -> read, resto -> write
+ROUTE_CLASSES: List[Tuple[str, "re.Pattern", str]] = [
+    ("POST", re.compile(r"^/auth/validate$"), "auth"),
+    ("POST", re.compile(r"^/assign-roles$"), "bulk"),
+    ("POST", re.compile(r"^/sync-roles$"), "bulk"),
+    ("PUT", re.compile(r"^/update-role$"), "bulk"),
+    ("DELETE", re.compile(r"^/delete-role-group$"), "bulk"),
+    ("POST", re.compile(r"^/assign-organizational-group$"), "bulk"),
+    ("PUT", re.compile(r"^/update-organizational-group$"), "bulk"),
+    ("GET", re.compile(r"^/export/"), "bulk"),
+    ("POST", re.compile(r"^/users/bulk/"), "bulk"),
+]
+
+# Sin límite: no tocan LDAP, deben responder siempre (también con sobrecarga, como el perfilador) o son conexiones largas (SSE)
+EXEMPT_PATHS = re.compile(r"^/(health|jobs|changes/stream|debug)(/|$)")
+
+
+def classify(method: str, path: str) -> Optional[str]:
+    if not path.startswith(API_PREFIX):
+        return None
+    relative = path[len(API_PREFIX):] or "/"
+    if EXEMPT_PATHS.match(relative):
+        return None
+    for route_method, pattern, admission_class in ROUTE_CLASSES:
+        if method == route_method and pattern.match(relative):
+            return admission_class
+    return "read" if method in ("GET", "HEAD") else "write"
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, admission_class: str, reason: str, retry_after: int):
+        super().__init__(f"{admission_class} requests saturated ({reason})")
+        self.admission_class = admission_class
+        self.retry_after = retry_after
+
+
+class _ClassState:
+    __slots__ = ("name", "priority", "limit", "queue_size", "active", "waiting", "avg_seconds")
+
+    def __init__(self, name: str, limit: int, queue_size: int):
+        self.name = name
+        self.priority = PRIORITIES.get(name, len(PRIORITIES))
+        self.limit = limit
+        self.queue_size = queue_size
+        self.active = 0
+        self.waiting = 0
+        self.avg_seconds = 0.1
+
+
+class AdmissionController:
+    """Límite de concurrencia por clase de ruta con colas acotadas y prioridad.
+
+    Cada clase tiene su propio máximo de requests en curso y de requests en
+    espera; además hay un máximo global. Al liberarse un slot se despierta al
+    waiter de mayor prioridad (auth primero) y las demás clases nunca ocupan
+    los últimos `auth_reserved` slots globales. Corre en el event loop: no
+    necesita locks.
+    """
+
+    def __init__(self, limits: Dict[str, Tuple[int, int]], max_concurrent: int, auth_reserved: int, queue_timeout: float):
+        self.classes = {name: _ClassState(name, limit, queue_size) for name, (limit, queue_size) in limits.items()}
+        self.max_concurrent = max_concurrent
+        self.auth_reserved = auth_reserved
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self._waiters: List[Tuple[int, int, str, asyncio.Future]] = []
+        self._sequence = itertools.count()
+
+    def _can_run(self, state: _ClassState) -> bool:
+        global_limit = self.max_concurrent if state.name == "auth" else self.max_concurrent - self.auth_reserved
+        return state.active < state.limit and self.active < global_limit
+
+    def _runnable_waiter(self, priority: int) -> bool:
+        return any(
+            entry[0] <= priority and not entry[3].done() and self._can_run(self.classes[entry[2]])
+            for entry in self._waiters
+        )
+
+    def _grant(self, state: _ClassState):
+        state.active += 1
+        self.active += 1
+
+    def _retry_after(self, state: _ClassState) -> int:
+        # Tiempo estimado para vaciar la cola actual con la duración media de la clase
+        return max(1, math.ceil(state.avg_seconds * (state.waiting + 1) / max(1, state.limit)))
+
+    async def acquire(self, admission_class: str):
+        state = self.classes[admission_class]
+        # Un slot libre se otorga ya, aunque otras clases tengan waiters, si ninguno igual o más prioritario
+        # puede usarlo; si no, una clase sin cola (queue_size 0) recibiría 429 con slots libres
+        if self._can_run(state) and not self._runnable_waiter(state.priority):
+            self._grant(state)
+            return
+        if state.waiting >= state.queue_size:
+            raise AdmissionRejected(admission_class, "queue full", self._retry_after(state))
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (state.priority, next(self._sequence), admission_class, future))
+        # Si hay slot libre y nadie más prioritario puede usarlo, entra sin esperar
+        self._wake()
+        if future.done():
+            return
+        state.waiting += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            if future.done() and not future.cancelled():
+                return  # el slot llegó justo al vencer el timeout
+            future.cancel()
+            raise AdmissionRejected(admission_class, "queue timeout", self._retry_after(state))
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(admission_class, 0.0)
+            future.cancel()
+            raise
+        finally:
+            state.waiting -= 1
+
+    def release(self, admission_class: str, elapsed: float):
+        state = self.classes[admission_class]
+        state.active -= 1
+        self.active -= 1
+        if elapsed:
+            state.avg_seconds = state.avg_seconds * 0.9 + elapsed * 0.1
+        self._wake()
+
+    def _wake(self):
+        # Se recorre la cola en orden de prioridad; un waiter que no cabe en su clase no bloquea a los demás
+        skipped = []
+        while self._waiters:
+            entry = heapq.heappop(self._waiters)
+            future = entry[3]
+            if future.done():
+                continue
+            state = self.classes[entry[2]]
+            if self._can_run(state):
+                self._grant(state)
+                future.set_result(None)
+            else:
+                skipped.append(entry)
+                if self.active >= self.max_concurrent:
+                    break
+        for entry in skipped:
+            heapq.heappush(self._waiters, entry)
+
+    def stats(self) -> Dict[str, Dict[str, object]]:
+        return {
+            name: {"active": state.active, "waiting": state.waiting, "limit": state.limit, "queue_size": state.queue_size}
+            for name, state in self.classes.items()
+        }
+
+
+def parse_limits(raw: str) -> Dict[str, Tuple[int, int]]:
+    limits = {}
+    for item in raw.split(","):
+        if not item.strip():
+            continue
+        name, values = item.split("=", 1)
+        limit, _, queue_size = values.partition(":")
+        limits[name.strip()] = (int(limit), int(queue_size or 0))
+    for name in PRIORITIES:
+        limits.setdefault(name, (settings.ADMISSION_MAX_CONCURRENT, 0))
+    return limits
+
+
+admission_controller = AdmissionController(
+    parse_limits(settings.ADMISSION_LIMITS),
+    settings.ADMISSION_MAX_CONCURRENT,
+    settings.ADMISSION_AUTH_RESERVED,
+    settings.ADMISSION_QUEUE_TIMEOUT_SECONDS
+)
+
+
+async def admission_middleware(request: Request, call_next):
+    admission_class = classify(request.method, request.url.path) if settings.ADMISSION_ENABLED else None
+    if admission_class is None:
+        return await call_next(request)
+
+    try:
+        await admission_controller.acquire(admission_class)
+    except AdmissionRejected as e:
+        logger.warning("[ADMISSION] Rejected {} {}: {}", request.method, request.url.path, e)
+        return JSONResponse(
+            status_code=429,
+            content={"detail": str(e)},
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
+    started = time.monotonic()
+    released = False
+
+    def release():
+        nonlocal released
+        if not released:
+            released = True
+            admission_controller.release(admission_class, time.monotonic() - started)
+
+    try:
+        response = await call_next(request)
+    except BaseException:
+        release()
+        raise
+
+    # El slot se libera cuando termina el cuerpo (p.ej. el export en streaming), no al enviar las cabeceras
+    body_iterator = response.body_iterator
+
+    async def release_after_body():
+        try:
+            async for chunk in body_iterator:
+                yield chunk
+        finally:
+            release()
+
+    response.body_iterator = release_after_body()
+    return response
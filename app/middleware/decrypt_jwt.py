@@ -1,6 +1,10 @@
 import json
-from fastapi import Request, HTTPException
+from typing import Callable
+from fastapi import Header, Request, HTTPException
 from app.services.jwt_service import jwt_service
+from app.utils.log import redact
+from app.utils.tracing import span
+from loguru import logger
 
 async def decrypt_request(request: Request):
     body = await request.body()
@@ -9,14 +13,42 @@ async def decrypt_request(request: Request):
 
     try:
         data = json.loads(body.decode("utf-8"))
-        print("Payload recibido:", data)
         if "token" not in data:
             raise HTTPException(status_code=422, detail="Falta campo 'token'")
-        decrypted = jwt_service.decrypt_payload(data["token"])
-        print("Payload desencriptado:", decrypted)
+        with span("jwt.decode"):
+            decrypted = jwt_service.decrypt_payload(data["token"])
+        logger.opt(lazy=True).debug("Payload desencriptado: {}", lambda: redact(decrypted))
         for k in ["iat","exp"]:
             decrypted.pop(k, None)
         return decrypted
     except Exception as e:
-        print("Error desencriptando:", e)
-        raise HTTPException(status_code=422, detail=f"Error desencriptando payload: {str(e)}")
\ No newline at end of file
+        logger.warning("Error desencriptando payload: {}", e)
+        raise HTTPException(status_code=422, detail=f"Error desencriptando payload: {str(e)}")
+
+
+def verify_scoped_token(authorization: str, scope: str) -> dict:
+    """Valida "Authorization: Bearer <jwt>" con exp y el scope pedido; devuelve los claims."""
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        raise HTTPException(status_code=401, detail="Bearer token required", headers={"WWW-Authenticate": "Bearer"})
+    try:
+        claims = jwt_service.decrypt_payload(token.strip())
+    except Exception as e:
+        logger.warning("[AUTH] Rejected bearer token for scope {}: {}", scope, e)
+        raise HTTPException(status_code=401, detail=str(e), headers={"WWW-Authenticate": "Bearer"})
+    # Solo tokens de corta duración: sin exp un token filtrado serviría para siempre
+    if "exp" not in claims:
+        raise HTTPException(status_code=401, detail="Token without expiration", headers={"WWW-Authenticate": "Bearer"})
+    # Los payloads de las demás rutas van firmados con la misma clave: sin el scope no sirven aquí
+    scopes = claims.get("scope")
+    scopes = scopes.split() if isinstance(scopes, str) else scopes if isinstance(scopes, list) else []
+    if scope not in scopes:
+        raise HTTPException(status_code=403, detail=f"Token without '{scope}' scope")
+    return claims
+
+
+def require_scope(scope: str) -> Callable[..., dict]:
+    """Dependencia para rutas GET sin body: exige un bearer token con `scope`."""
+    def dependency(authorization: str = Header(None)) -> dict:
+        return verify_scoped_token(authorization, scope)
+    return dependency
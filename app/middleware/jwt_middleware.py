@@ -2,6 +2,8 @@ from fastapi import Request
 from fastapi.responses import JSONResponse
 import json
 from app.services.jwt_service import jwt_service
+from app.utils.log import redact
+from loguru import logger
 
 async def decrypt_jwt_middleware(request: Request, call_next):
     if request.method in ["POST", "PUT", "PATCH"]:
@@ -14,7 +16,7 @@ async def decrypt_jwt_middleware(request: Request, call_next):
                     decrypted_data = jwt_service.decrypt_payload(json_data["token"])
                     for key in ["iat", "exp"]:
                         decrypted_data.pop(key, None)
-                    print("Decrypted Data:", decrypted_data)
+                    logger.opt(lazy=True).debug("Decrypted Data: {}", lambda: redact(decrypted_data))
 
                     new_body = json.dumps(decrypted_data).encode("utf-8")
 
@@ -0,0 +1,52 @@
+import time
+import uuid
+from typing import Optional
+from fastapi import Request
+from app.config import settings
+from app.middleware.admission import classify
+from app.utils.request_context import actor_var, deadline_var, request_id_var
+from app.utils.tracing import RequestTrace, trace_var, span_exporter
+
+
+def request_timeout(request: Request) -> Optional[float]:
+    """Segundos de deadline del request: la cabecera X-Request-Timeout o el valor por defecto de la ruta."""
+    try:
+        requested = float(request.headers.get("X-Request-Timeout", ""))
+    except ValueError:
+        requested = 0
+    if requested > 0:
+        return min(requested, settings.REQUEST_TIMEOUT_MAX_SECONDS)
+    # Exports, operaciones masivas y SSE pueden durar lo que necesiten
+    if classify(request.method, request.url.path) in (None, "bulk"):
+        return None
+    return settings.REQUEST_TIMEOUT_SECONDS or None
+
+
+async def request_context_middleware(request: Request, call_next):
+    request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+    trace = RequestTrace(request_id, f"{request.method} {request.url.path}")
+    trace.root.set("http.method", request.method)
+    trace.root.set("http.target", request.url.path)
+
+    # El JWT identifica al sistema que llama, no a la persona: quien la conozca la envía en X-Actor
+    actor = request.headers.get("X-Actor") or f"ip:{request.client.host if request.client else 'unknown'}"
+
+    timeout = request_timeout(request)
+
+    request_id_token = request_id_var.set(request_id)
+    actor_token = actor_var.set(actor)
+    deadline_token = deadline_var.set(time.monotonic() + timeout if timeout else None)
+    trace_token = trace_var.set(trace)
+    try:
+        response = await call_next(request)
+    finally:
+        trace_var.reset(trace_token)
+        actor_var.reset(actor_token)
+        deadline_var.reset(deadline_token)
+        request_id_var.reset(request_id_token)
+
+    trace.finish(response.status_code)
+    response.headers["X-Request-ID"] = request_id
+    response.headers["Server-Timing"] = trace.server_timing()
+    span_exporter.submit(trace)
+    return response
@@ -14,3 +14,12 @@ class RoleUpdateRequest(BaseModel):
     area: Optional[str] = None
 
 
+class RoleMembershipSync(BaseModel):
+    role_type: str
+    role_name: str
+    area: Optional[str] = None
+    users: List[str]  # Conjunto deseado completo de miembros (emails)
+
+class RoleSyncRequest(BaseModel):
+    roles: List[RoleMembershipSync]
+    dry_run: bool = False
@@ -63,6 +63,17 @@ class UpdatedUserRequest(BaseModel):
     password: Optional[str] = None
 
 
+class BulkLifecycleRequest(BaseModel):
+    # Se combinan con AND; se exige al menos uno para no afectar a todo el directorio
+    emails: Optional[List[str]] = None
+    area: Optional[str] = None
+    department: Optional[str] = None
+    country: Optional[str] = None
+    province: Optional[str] = None
+    city: Optional[str] = None
+    dry_run: bool = False
+
+
 class ApiResponse(BaseModel):
     success: bool
     message: str
@@ -72,4 +83,9 @@ class ApiResponse(BaseModel):
 class HealthCheckResponse(BaseModel):
     status: str
     ldap_connection: bool
-    error: Optional[str] = None
\ No newline at end of file
+    error: Optional[str] = None
+    live: Optional[bool] = None
+    ready: Optional[bool] = None
+    uptime_seconds: Optional[float] = None
+    servers: Optional[List[dict]] = None
+    pools: Optional[List[dict]] = None
\ No newline at end of file
@@ -0,0 +1,103 @@
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+def _encode_active(value: Any) -> str:
+    return "ACTIVE" if value else "INACTIVE"
+
+
+def _decode_active(value: str) -> bool:
+    return value == "ACTIVE"
+
+
+@dataclass(frozen=True)
+class UserAttribute:
+    """Relación entre un campo del modelo User y su atributo LDAP."""
+    field: str
+    ldap: str
+    multi: bool = False
+    default: Any = ""
+    updatable: bool = True
+    readable: bool = True
+    encode: Optional[Callable[[Any], Any]] = None
+    decode: Optional[Callable[[str], Any]] = None
+
+
+USER_OBJECT_CLASSES = ["inetOrgPerson", "organizationalPerson", "person", "top"]
+
+USER_ATTRIBUTES: Tuple[UserAttribute, ...] = (
+    UserAttribute("email", "uid", updatable=False),
+    UserAttribute("firstName", "givenName"),
+    UserAttribute("lastName", "sn"),
+    UserAttribute("id", "employeeNumber", updatable=False),
+    UserAttribute("active", "description", default=True, encode=_encode_active, decode=_decode_active),
+    UserAttribute("address", "postalAddress"),
+    UserAttribute("department", "departmentNumber"),
+    UserAttribute("area", "physicalDeliveryOfficeName"),
+    UserAttribute("position", "title"),
+    UserAttribute("phone", "telephoneNumber", multi=True, default=()),
+    UserAttribute("imageUrl", "labeledURI"),
+    UserAttribute("password", "userPassword", readable=False),
+    # Gestionados por los servicios de roles y grupos organizacionales
+    UserAttribute("businessCategory", "businessCategory", multi=True, default=(), updatable=False),
+    UserAttribute("employeeType", "employeeType", updatable=False),
+)
+
+USER_FIELD_MAPPING: Dict[str, str] = {attr.field: attr.ldap for attr in USER_ATTRIBUTES if attr.updatable}
+USER_READ_ATTRIBUTES: List[str] = [attr.ldap for attr in USER_ATTRIBUTES if attr.readable]
+
+# Campos que se devuelven en las respuestas de la API (UserResponse)
+USER_RESPONSE_FIELDS = (
+    "email", "firstName", "lastName", "id", "active", "address",
+    "department", "area", "position", "phone", "imageUrl", "dn",
+)
+
+# Atributos operacionales que cambian en cada modificación de la entrada (base del ETag)
+USER_VERSION_ATTRIBUTES = ["entryCSN", "modifyTimestamp"]
+
+_READABLE = tuple(attr for attr in USER_ATTRIBUTES if attr.readable)
+
+
+class UserRecord:
+    """Usuario decodificado directamente de la respuesta cruda de una búsqueda (sin ldap3.Entry)."""
+
+    __slots__ = ("dn",) + tuple(attr.field for attr in _READABLE)
+
+    @classmethod
+    def from_raw(cls, dn: str, raw_attributes: Dict[str, List[bytes]]) -> "UserRecord":
+        record = cls.__new__(cls)
+        record.dn = dn
+        for attr in _READABLE:
+            raw = raw_attributes.get(attr.ldap)
+            if not raw:
+                value = list(attr.default) if attr.multi else attr.default
+            elif attr.multi:
+                value = [v.decode("utf-8") for v in raw]
+            else:
+                value = raw[0].decode("utf-8")
+                if attr.decode:
+                    value = attr.decode(value)
+            setattr(record, attr.field, value)
+        return record
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {field: getattr(self, field) for field in USER_RESPONSE_FIELDS}
+
+
+def encode_user_attribute(attr: UserAttribute, value: Any) -> Any:
+    return attr.encode(value) if attr.encode else value
+
+
+def entry_version(raw_attributes: Dict[str, List[bytes]]) -> str:
+    """entryCSN y modifyTimestamp concatenados; cadena vacía si el servidor no expone ninguno."""
+    return "|".join(
+        raw_attributes[name][0].decode("utf-8")
+        for name in USER_VERSION_ATTRIBUTES
+        if raw_attributes.get(name)
+    )
+
+
+def email_from_dn(dn: str) -> str:
+    """Email (uid) a partir del RDN del usuario, sin leer la entrada."""
+    first_rdn = dn.split(',')[0]
+    return first_rdn.split('=', 1)[1] if first_rdn.lower().startswith('uid=') else dn
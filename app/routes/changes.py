@@ -0,0 +1,73 @@
+import asyncio
+import json
+import time
+from typing import Any, AsyncIterator, Dict, Optional
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from app.config import settings
+from app.services.change_feed_service import change_feed
+
+router = APIRouter()
+
+
+@router.get("/changes", summary="Cambios en usuarios y grupos desde un cursor")
+def list_changes(
+    cursor: Optional[str] = Query(None, description="Cursor devuelto por la llamada anterior; sin cursor se obtiene la posición actual"),
+    limit: int = Query(100, ge=1, le=1000)
+):
+    try:
+        return change_feed.read(cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def _sse(event: str, data: Dict[str, Any], event_id: Optional[str] = None) -> str:
+    lines = [f"event: {event}"]
+    if event_id:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {json.dumps(data)}")
+    return "\n".join(lines) + "\n\n"
+
+
+async def _stream(request: Request, page: Dict[str, Any], limit: int) -> AsyncIterator[str]:
+    # El primer evento da el punto de reanudación aunque todavía no haya cambios
+    yield _sse("cursor", {"cursor": page["cursor"]}, page["cursor"])
+    last_sent = time.monotonic()
+    resync = False
+    while True:
+        if page["resync"] and not resync:
+            yield _sse("resync", {"detail": "Cursor outside the change log: deletions in the gap are not included"})
+        resync = page["resync"]
+        changes = page["changes"]
+        for i, change in enumerate(changes):
+            # Con el id en el último cambio del lote, Last-Event-ID permite reanudar tras una desconexión
+            yield _sse("change", change, page["cursor"] if i == len(changes) - 1 else None)
+        if changes:
+            last_sent = time.monotonic()
+        if not page["has_more"]:
+            if time.monotonic() - last_sent >= settings.CHANGE_FEED_HEARTBEAT_SECONDS:
+                yield ": keepalive\n\n"
+                last_sent = time.monotonic()
+            await asyncio.sleep(settings.CHANGE_FEED_STREAM_POLL_SECONDS)
+            if await request.is_disconnected():
+                return
+        page = await run_in_threadpool(change_feed.read, page["cursor"], limit)
+
+
+@router.get("/changes/stream", summary="Cambios en usuarios y grupos por Server-Sent Events")
+async def stream_changes(
+    request: Request,
+    cursor: Optional[str] = Query(None, description="Cursor inicial; también se acepta la cabecera Last-Event-ID"),
+    limit: int = Query(100, ge=1, le=1000)
+):
+    cursor = cursor or request.headers.get("Last-Event-ID")
+    try:
+        page = await run_in_threadpool(change_feed.read, cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return StreamingResponse(
+        _stream(request, page, limit),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
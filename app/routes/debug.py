@@ -0,0 +1,35 @@
+from typing import Literal
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+from app.config import settings
+from app.middleware.decrypt_jwt import verify_scoped_token
+from app.utils.profiler import sampling_profiler
+
+router = APIRouter()
+
+DEBUG_SCOPE = "debug"
+
+
+def require_debug_token(authorization: str = Header(None)):
+    # Deshabilitado se comporta como si la ruta no existiera
+    if not settings.PROFILER_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return verify_scoped_token(authorization, DEBUG_SCOPE)
+
+
+@router.get("/debug/profile", summary="Perfil por muestreo de todos los hilos del proceso")
+def profile_route(
+    seconds: float = Query(10, gt=0, description="Duración de la captura (hasta PROFILER_MAX_SECONDS)"),
+    interval_ms: float = Query(10, ge=1, le=1000, description="Intervalo entre muestras"),
+    include_idle: bool = Query(False, description="Incluir los hilos bloqueados esperando (locks, colas, sockets)"),
+    top: int = Query(30, ge=1, le=500, description="Cantidad de funciones en top_functions"),
+    format: Literal["json", "collapsed"] = Query("json", description="collapsed = texto para flamegraph.pl/speedscope"),
+    _claims: dict = Depends(require_debug_token)
+):
+    result = sampling_profiler.run(seconds, interval_ms / 1000, include_idle=include_idle, top=top)
+    if result is None:
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    if format == "collapsed":
+        lines = "".join(f"{stack} {count}\n" for stack, count in result["collapsed"].most_common())
+        return PlainTextResponse(lines)
+    return result
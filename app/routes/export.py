@@ -0,0 +1,21 @@
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import StreamingResponse
+from app.middleware.decrypt_jwt import require_scope
+from app.services.export_service import export_service
+
+router = APIRouter()
+
+EXPORT_SCOPE = "export"
+
+
+@router.get("/export/ldif", summary="Exportar usuarios, roles y grupos organizacionales en LDIF")
+def export_ldif(
+    gzip: bool = Query(False, description="Comprimir la salida con gzip"),
+    _claims: dict = Depends(require_scope(EXPORT_SCOPE))
+):
+    filename = "ldap-export.ldif.gz" if gzip else "ldap-export.ldif"
+    return StreamingResponse(
+        export_service.iter_chunks(compress=gzip),
+        media_type="application/gzip" if gzip else "text/plain; charset=utf-8",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
\ No newline at end of file
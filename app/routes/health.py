@@ -0,0 +1,34 @@
+from fastapi import APIRouter, status
+from fastapi.responses import JSONResponse
+from app.models.user import HealthCheckResponse
+from app.services.health_service import health_service
+
+router = APIRouter()
+
+
+# Los tres endpoints responden con el último resultado del prober; no tocan LDAP.
+# Son async para no depender del threadpool, que se agota justo cuando LDAP se cuelga
+
+@router.get("/health", response_model=HealthCheckResponse, summary="Health Check")
+async def health_check_route():
+    snapshot = health_service.snapshot()
+    http_status = status.HTTP_200_OK if snapshot["ready"] else status.HTTP_503_SERVICE_UNAVAILABLE
+    return JSONResponse(status_code=http_status, content=HealthCheckResponse(**snapshot).dict())
+
+
+@router.get("/health/live", summary="Liveness probe")
+async def liveness_route():
+    live = health_service.is_live()
+    return JSONResponse(
+        status_code=status.HTTP_200_OK if live else status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"status": "alive" if live else "dead"}
+    )
+
+
+@router.get("/health/ready", summary="Readiness probe")
+async def readiness_route():
+    ready = health_service.is_ready()
+    return JSONResponse(
+        status_code=status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"status": "ready" if ready else "not_ready"}
+    )
@@ -0,0 +1,30 @@
+from fastapi import APIRouter, HTTPException, status
+from fastapi.responses import JSONResponse
+from app.services.job_service import job_service
+
+router = APIRouter()
+
+
+def job_accepted_response(job) -> JSONResponse:
+    return JSONResponse(
+        status_code=status.HTTP_202_ACCEPTED,
+        content={
+            "success": True,
+            "message": "Job queued",
+            "job_id": job.id,
+            "status_url": f"/api/v2/ldap/jobs/{job.id}"
+        }
+    )
+
+
+@router.get("/jobs", summary="Listar jobs en segundo plano")
+def list_jobs():
+    return {"jobs": [job.to_dict() for job in job_service.list()]}
+
+
+@router.get("/jobs/{job_id}", summary="Estado y progreso de un job")
+def get_job(job_id: str):
+    job = job_service.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
@@ -1,14 +1,31 @@
-from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi import APIRouter, HTTPException, Depends, Query, Header, Response
+from fastapi.concurrency import run_in_threadpool
 from app.middleware.decrypt_jwt import decrypt_request
 from app.models.organizational_group import OrgGroupAssignment, OrgGroupUpdateRequest
 from app.services.organizational_group_service import OrganizationalGroupService
+from app.services.org_hierarchy_service import org_hierarchy_index
+from app.models.user_record import email_from_dn
+from app.services.job_service import job_service
+from app.routes.jobs import job_accepted_response
+from app.utils.idempotency import idempotency_store
 from loguru import logger
+from app.exceptions import LDAPServiceError
+from typing import Optional
 
 router = APIRouter()
 org_group_service = OrganizationalGroupService()
 
+job_service.register(
+    "update_organizational_group",
+    lambda params, job: org_group_service.update_organizational_group(OrgGroupUpdateRequest(**params), job=job)
+)
+
 @router.post("/assign-organizational-group")
-async def assign_organizational_group(payload: dict = Depends(decrypt_request)):
+async def assign_organizational_group(
+    response: Response,
+    payload: dict = Depends(decrypt_request),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
 
     try:
         org_group = OrgGroupAssignment(**payload)
@@ -16,25 +33,39 @@ async def assign_organizational_group(payload: dict = Depends(decrypt_request)):
         if not org_group.users:
             raise HTTPException(status_code=400, detail="At least one user must be provided")
         
-        result = org_group_service.assign_organizational_group(org_group)
+        result = await run_in_threadpool(
+            idempotency_store.run,
+            idempotency_key,
+            "assign-organizational-group",
+            payload,
+            lambda: org_group_service.assign_organizational_group(org_group),
+            response
+        )
         return result
-        
+
+    except (HTTPException, LDAPServiceError):
+        raise
     except Exception as e:
         logger.error(f"Error in assign_organizational_group endpoint: {e}")
         raise HTTPException(status_code=500, detail=str(e))
     
 
 @router.put("/update-organizational-group")
-async def update_organizational_group(payload: dict = Depends(decrypt_request)):
+async def update_organizational_group(payload: dict = Depends(decrypt_request), background: bool = Query(False, description="Ejecutar como job en segundo plano")):
     try:
         org_group_update = OrgGroupUpdateRequest(**payload)
-        success = org_group_service.update_organizational_group(org_group_update)
+        if background:
+            return job_accepted_response(job_service.submit("update_organizational_group", org_group_update.dict()))
+
+        success = await run_in_threadpool(org_group_service.update_organizational_group, org_group_update)
 
         return{
             "success": success,
             "message": "Organizational group updated successfully" 
         }
     
+    except LDAPServiceError:
+        raise
     except Exception as e:
         logger.error(F"Error updating organizational group: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -48,7 +79,8 @@ async def remove_user_from_org_group(
     hierarchy_level: int = Query(..., description="Nivel jerárquico del grupo organizacional")
 ):
     try:
-        success = org_group_service.remove_user_from_org_group(
+        success = await run_in_threadpool(
+            org_group_service.remove_user_from_org_group,
             email=email,
             group_name=group_name,
             hierarchy_level=hierarchy_level
@@ -57,7 +89,49 @@ async def remove_user_from_org_group(
         return {"success": success, "message": "User removed from organizational group successfully"}
 
     
+    except LDAPServiceError:
+        raise
     except Exception as e:
         logger.error(f"Error removing user from organizational group: {e}")
         raise HTTPException(status_code=500, detail=str(e))
-    
\ No newline at end of file
+
+
+@router.get("/organizational-groups/{group_name}/{hierarchy_level}/descendants", summary="Subárbol de un grupo organizacional")
+def get_org_group_descendants(
+    group_name: str,
+    hierarchy_level: int,
+    max_depth: Optional[int] = Query(None, ge=1, description="Profundidad máxima desde el grupo")
+):
+    descendants = org_hierarchy_index.descendants(group_name, hierarchy_level, max_depth)
+    if descendants is None:
+        raise HTTPException(status_code=404, detail="Organizational group not found")
+    return {"success": True, "group_name": group_name, "hierarchy_level": hierarchy_level, "descendants": descendants}
+
+
+@router.get("/organizational-groups/{group_name}/{hierarchy_level}/ancestors", summary="Cadena jerárquica sobre un grupo organizacional")
+def get_org_group_ancestors(group_name: str, hierarchy_level: int):
+    ancestors = org_hierarchy_index.ancestors(group_name, hierarchy_level)
+    if ancestors is None:
+        raise HTTPException(status_code=404, detail="Organizational group not found")
+    return {"success": True, "group_name": group_name, "hierarchy_level": hierarchy_level, "ancestors": ancestors}
+
+
+@router.get("/organizational-groups/{group_name}/{hierarchy_level}/users", summary="Usuarios bajo un grupo organizacional")
+def get_org_group_users(
+    group_name: str,
+    hierarchy_level: int,
+    include_descendants: bool = Query(True, description="Incluir usuarios de los grupos descendientes"),
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000)
+):
+    user_dns = org_hierarchy_index.users(group_name, hierarchy_level, include_descendants)
+    if user_dns is None:
+        raise HTTPException(status_code=404, detail="Organizational group not found")
+    page = user_dns[offset:offset + limit]
+    return {
+        "success": True,
+        "total": len(user_dns),
+        "offset": offset,
+        "limit": limit,
+        "users": [{"email": email_from_dn(dn), "dn": dn} for dn in page]
+    }
@@ -1,15 +1,27 @@
-from fastapi import APIRouter, HTTPException, Query, Depends
+from fastapi import APIRouter, HTTPException, Query, Depends, Header, Response
+from fastapi.concurrency import run_in_threadpool
 from app.middleware.decrypt_jwt import decrypt_request
-from app.models.role import RoleAssignment, RoleUpdateRequest
+from app.models.role import RoleAssignment, RoleUpdateRequest, RoleSyncRequest
 from app.services.role_service import RoleService
+from app.services.job_service import job_service
+from app.routes.jobs import job_accepted_response
+from app.utils.idempotency import idempotency_store
 from loguru import logger
+from app.exceptions import LDAPServiceError
 from typing import Optional
 
 router = APIRouter()
 role_service = RoleService()
 
+job_service.register("update_role_name", lambda params, job: role_service.update_role_name(**params, job=job))
+job_service.register("delete_role_group", lambda params, job: role_service.delete_role_group(**params, job=job))
+
 @router.post("/assign-roles")
-async def assign_roles(payload: dict = Depends(decrypt_request)):
+async def assign_roles(
+    response: Response,
+    payload: dict = Depends(decrypt_request),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
 
     role_assignment = RoleAssignment(**payload)
 
@@ -23,16 +35,25 @@ async def assign_roles(payload: dict = Depends(decrypt_request)):
         if role_assignment.role_local and not role_assignment.area:
             raise HTTPException(status_code=400, detail="Area must be provided for local roles")
         
-        result = role_service.assign_roles(role_assignment)
+        result = await run_in_threadpool(
+            idempotency_store.run,
+            idempotency_key,
+            "assign-roles",
+            payload,
+            lambda: role_service.assign_roles(role_assignment),
+            response
+        )
         return result
-        
+
+    except (HTTPException, LDAPServiceError):
+        raise
     except Exception as e:
         logger.error(f"Error in assign_roles endpoint: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.put('/update-role')
-async def update_role(payload: dict = Depends(decrypt_request)):
+async def update_role(payload: dict = Depends(decrypt_request), background: bool = Query(False, description="Ejecutar como job en segundo plano")):
     role_update = RoleUpdateRequest(**payload)
 
     try:
@@ -42,18 +63,24 @@ async def update_role(payload: dict = Depends(decrypt_request)):
         if role_update.role_type == "role_local" and not role_update.area:
             raise HTTPException(status_code=400, detail="Area must be provided for local roles")
         
-        success = role_service.update_role_name(
-            role_type=role_update.role_type,
-            old_role_name=role_update.old_role_name,
-            new_role_name=role_update.new_role_name,
-            area=role_update.area
-        )
+        params = {
+            "role_type": role_update.role_type,
+            "old_role_name": role_update.old_role_name,
+            "new_role_name": role_update.new_role_name,
+            "area": role_update.area
+        }
+        if background:
+            return job_accepted_response(job_service.submit("update_role_name", params))
+
+        success = await run_in_threadpool(lambda: role_service.update_role_name(**params))
 
         return {
             "success": success,
             "message": f"{role_update.role_type} name updated successfully"
             }
     
+    except LDAPServiceError:
+        raise
     except Exception as e:
         logger.error(f"Error updating role: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -67,19 +94,55 @@ async def remove_role(email: str, role_type: str, role_name: str, area: Optional
         if role_type not in ["role_global", "role_local"]:
             raise HTTPException(status_code=400, detail="Invalid role type")
         
-        success = role_service.remove_role_from_user(email, role_type, role_name, area)
+        success = await run_in_threadpool(role_service.remove_role_from_user, email, role_type, role_name, area)
         return {"success": success}
         
+    except LDAPServiceError:
+        raise
     except Exception as e:
         logger.error(f"Error removing role: {e}")
         raise HTTPException(status_code=500, detail=str(e))
     
 
 @router.delete("/delete-role-group")
-async def delete_role_group(role_type: str, role_name: str, area: Optional[str] = None):
+async def delete_role_group(role_type: str, role_name: str, area: Optional[str] = None, background: bool = Query(False, description="Ejecutar como job en segundo plano")):
     try:
-        success = role_service.delete_role_group(role_type, role_name, area)
+        if background:
+            job = job_service.submit("delete_role_group", {"role_type": role_type, "role_name": role_name, "area": area})
+            return job_accepted_response(job)
+
+        success = await run_in_threadpool(role_service.delete_role_group, role_type, role_name, area)
         return {"success": success}
+    except LDAPServiceError:
+        raise
     except Exception as e:
         logger.error(f"Error deleting role group: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/sync-roles")
+async def sync_roles(payload: dict = Depends(decrypt_request)):
+    sync_request = RoleSyncRequest(**payload)
+
+    def sync_all():
+        results = []
+        for sync in sync_request.roles:
+            try:
+                if sync.role_type not in ["role_global", "role_local"]:
+                    raise Exception("Invalid role type")
+                diff = role_service.sync_role_members(sync, dry_run=sync_request.dry_run)
+                results.append({"role_name": sync.role_name, "success": True, **diff})
+            except LDAPServiceError:
+                raise
+            except Exception as e:
+                logger.error(f"Error syncing role {sync.role_name}: {e}")
+                results.append({"role_name": sync.role_name, "success": False, "message": str(e)})
+        return {"success": True, "results": results}
+
+    try:
+        return await run_in_threadpool(sync_all)
+    except LDAPServiceError:
+        raise
+    except Exception as e:
+        logger.error(f"Error in sync_roles endpoint: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
@@ -1,5 +1,6 @@
-from fastapi import APIRouter, HTTPException, Depends, status
-from fastapi.responses import JSONResponse
+import json
+from fastapi import APIRouter, HTTPException, Depends, Header, Query, Response, status
+from fastapi.responses import StreamingResponse
 from app.middleware.decrypt_jwt import decrypt_request
 from app.models.user import (
     User,
@@ -7,61 +8,110 @@ from app.models.user import (
     AuthRequest,
     AuthResponse,
     UpdatedUserRequest,
-    ApiResponse,
-    HealthCheckResponse
+    BulkLifecycleRequest,
+    ApiResponse
 )
 from app.services.user_service import UserService
+from app.services.user_index_service import user_directory_index
+from app.services.bulk_user_service import bulk_user_service, summarize
+from app.utils.etag import etag_matches
+from app.utils.idempotency import idempotency_store
+from app.utils.tracing import span
+from typing import Literal, Optional
+from loguru import logger
+from app.exceptions import LDAPServiceError
 
 router = APIRouter()
 user_service = UserService()
 
 @router.post("/create-user", response_model=ApiResponse, summary="Crear un nuevo usuario en LDAP")
-def create_user_route(payload: dict = Depends(decrypt_request)):   
-    print("Payload recibido en endpoint:", payload)
+def create_user_route(
+    response: Response,
+    payload: dict = Depends(decrypt_request),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
     try:
-        user = User(**payload)
+        with span("validation.user"):
+            user = User(**payload)
     except Exception as e:
-        print("Error validando User:", e)
+        logger.warning("Error validando User: {}", e)
         raise HTTPException(status_code=422, detail=f"Error validando User: {str(e)}")
-    try:
-        dn = user_service.create_user(user)
-        return ApiResponse(
-            success=True,
-            message="User created successfully",
-            dn=dn
-        )
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+
+    def create():
+        try:
+            dn = user_service.create_user(user)
+            return ApiResponse(
+                success=True,
+                message="User created successfully",
+                dn=dn
+            )
+        except LDAPServiceError:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    return idempotency_store.run(idempotency_key, "create-user", payload, create, response)
     
+@router.get("/users/search", summary="Búsqueda de usuarios mientras se escribe")
+def search_users_route(
+    q: str = Query(..., min_length=1, max_length=100, description="Comienzo del nombre, apellido, email o ID"),
+    limit: int = Query(10, ge=1, le=50)
+):
+    # Se atiende desde el índice en memoria: no consulta LDAP
+    users = user_directory_index.search(q, limit)
+    return {"success": True, "query": q, "users": [user.to_dict() for user in users]}
+
+
 @router.get("/users/{email}", response_model=ApiResponse, summary="Obtener usuario")
-def get_user_route(email: str):
+def get_user_route(
+    email: str,
+    response: Response,
+    if_none_match: Optional[str] = Header(None, alias="If-None-Match")
+):
     try:
-        user_data = user_service.get_user(email)
+        if if_none_match:
+            etag = user_service.current_etag(email)
+            if etag_matches(if_none_match, etag):
+                return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+        user_data, etag = user_service.get_user_with_etag(email)
         if not user_data:
             raise HTTPException(status_code=404, detail="User not found")
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = "no-cache"
         return ApiResponse(
             success=True,
             message= "User found",
             data=user_data
         )
+    except (HTTPException, LDAPServiceError):
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
     
 @router.patch("/users/{email}", response_model=ApiResponse, summary="Actualizar usuario")
 def update_user_route(email: str, payload: dict = Depends(decrypt_request)):
-    user_data = UpdatedUserRequest(**payload)
+    with span("validation.user_update"):
+        user_data = UpdatedUserRequest(**payload)
     try:
         updated_data = {k: v for k, v in user_data.dict().items() if v is not None}
 
         if not updated_data:
             raise HTTPException(status_code=400, detail="No fields to update")
         
-        dn = user_service.update_user(email, updated_data)
+        result = user_service.update_user(email, updated_data)
+        changed_fields = result["changed_fields"]
         return ApiResponse(
             success=True,
-            message="User updated successfully",
-            dn=dn
+            message="User updated successfully" if changed_fields else "No changes to apply",
+            data={"changed_fields": changed_fields},
+            dn=result["dn"]
         )
+    except LDAPServiceError:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -73,6 +123,8 @@ def delete_user_route(email: str):
             success=True,
             message="User deactivated successfully"
         )
+    except LDAPServiceError:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -84,6 +136,8 @@ def hard_delete_user_route(email: str):
             success=True,
             message="User permanently deleted"
         )
+    except LDAPServiceError:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
     
@@ -95,6 +149,8 @@ def reactivate_user_route(email: str):
             success=True,
             message="User reactivated successfully"
         )
+    except LDAPServiceError:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -103,30 +159,63 @@ def authenticate_user_route(auth_request: AuthRequest):
     try:
         result= user_service.authenticate_user(auth_request.email, auth_request.password)
         return AuthResponse(**result)
+    except LDAPServiceError:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
-    
-@router.get("/health", response_model=HealthCheckResponse, summary="Health Check")
-def health_check_route():
+
+
+def _indexed_users_page(total: int, users: list, offset: int, limit: int) -> dict:
+    return {
+        "success": True,
+        "total": total,
+        "offset": offset,
+        "limit": limit,
+        "users": [
+            {"email": user.email, "dn": user.dn, "area": user.area, "department": user.department}
+            for user in users
+        ]
+    }
+
+
+@router.get("/areas/{area}/users", summary="Usuarios de un área")
+def list_area_users_route(area: str, offset: int = Query(0, ge=0), limit: int = Query(100, ge=1, le=1000)):
+    total, users = user_directory_index.users_in_area(area, offset, limit)
+    return _indexed_users_page(total, users, offset, limit)
+
+
+@router.get("/departments/{department}/users", summary="Usuarios de un departamento")
+def list_department_users_route(department: str, offset: int = Query(0, ge=0), limit: int = Query(100, ge=1, le=1000)):
+    total, users = user_directory_index.users_in_department(department, offset, limit)
+    return _indexed_users_page(total, users, offset, limit)
+
+
+@router.post("/users/bulk/{action}", summary="Desactivar, reactivar o eliminar usuarios en lote")
+def bulk_lifecycle_route(
+    action: Literal["deactivate", "reactivate", "delete"],
+    payload: dict = Depends(decrypt_request),
+    stream: bool = Query(False, description="Enviar un resultado por línea (NDJSON) a medida que terminan")
+):
     try:
-        ldap_status = user_service.ldap.test_connection()
-        status_str = "healthy" if ldap_status else "unhealthy"
-        http_status = status.HTTP_200_OK if ldap_status else status.HTTP_503_SERVICE_UNAVAILABLE
-        return JSONResponse(
-            status_code=http_status,
-            content=HealthCheckResponse(
-                status=status_str,
-                ldap_connection=ldap_status
-            ).dict()
-        )
+        bulk_request = BulkLifecycleRequest(**payload)
+        results = bulk_user_service.run(action, bulk_request)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    if stream:
+        def ndjson():
+            collected = []
+            for result in results:
+                collected.append(result)
+                yield json.dumps(result) + "\n"
+            yield json.dumps({"summary": summarize(collected)}) + "\n"
+
+        return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+    try:
+        collected = list(results)
+    except LDAPServiceError:
+        raise
     except Exception as e:
-        return JSONResponse(
-            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-            content=HealthCheckResponse(
-                status="unhealthy",
-                ldap_connection=False,
-                error=str(e)
-            ).dict()
-        )        
-
-    
\ No newline at end of file
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"success": True, "action": action, "summary": summarize(collected), "results": collected}
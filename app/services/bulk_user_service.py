@@ -0,0 +1,140 @@
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Dict, Iterator, List, Tuple
+from ldap3.utils.conv import escape_filter_chars
+from loguru import logger
+from app.config import settings
+from app.ldap_client import LDAPClientPool
+from app.models.user import BulkLifecycleRequest
+from app.models.user_record import USER_ATTRIBUTES, UserRecord, email_from_dn, encode_user_attribute
+from app.services.user_index_service import user_directory_index
+
+ACTIONS = ("deactivate", "reactivate", "delete")
+EMAIL_BATCH_SIZE = 100
+_ACTIVE = next(attr for attr in USER_ATTRIBUTES if attr.field == "active")
+
+
+class BulkUserService:
+    """Desactiva, reactiva o elimina en lote los usuarios que cumplen un selector.
+
+    Los usuarios se resuelven con búsquedas paginadas (una por cada bloque de
+    100 emails, o una sola si el selector no lleva emails) y los cambios se
+    aplican en paralelo con conexiones de un pool. Los resultados se producen
+    a medida que terminan, para poder enviarlos en streaming.
+    """
+
+    def __init__(self, workers: int = None):
+        self.workers = workers or settings.BULK_WORKERS
+        self.base_dn = settings.BASE_DN
+
+    def run(self, action: str, request: BulkLifecycleRequest) -> Iterator[Dict[str, Any]]:
+        if action not in ACTIONS:
+            raise ValueError(f"Unsupported bulk action: {action}")
+        base_dn, filters = self._build_selector(request)
+        return self._run(action, request, base_dn, filters)
+
+    def _build_selector(self, request: BulkLifecycleRequest) -> Tuple[str, List[str]]:
+        if not (request.emails or request.area or request.department or request.country):
+            raise ValueError("At least one selector (emails, area, department or country/province/city) is required")
+        if request.city and not request.province:
+            raise ValueError("city requires province and country")
+        if request.province and not request.country:
+            raise ValueError("province requires country")
+
+        # Mismo árbol que build_user_dn: ou=ciudad,ou=provincia,ou=país,ou=users
+        base_dn = f"ou=users,{self.base_dn}"
+        for ou in (request.country, request.province, request.city):
+            if ou:
+                base_dn = f"ou={ou.lower()},{base_dn}"
+
+        base_filter = "(objectClass=inetOrgPerson)"
+        if request.area:
+            base_filter += f"(physicalDeliveryOfficeName={escape_filter_chars(request.area)})"
+        if request.department:
+            base_filter += f"(departmentNumber={escape_filter_chars(request.department)})"
+
+        if not request.emails:
+            return base_dn, [f"(&{base_filter})"]
+        filters = []
+        for i in range(0, len(request.emails), EMAIL_BATCH_SIZE):
+            batch = request.emails[i:i + EMAIL_BATCH_SIZE]
+            uid_filter = "".join(f"(uid={escape_filter_chars(email)})" for email in batch)
+            filters.append(f"(&{base_filter}(|{uid_filter}))")
+        return base_dn, filters
+
+    def _run(self, action: str, request: BulkLifecycleRequest, base_dn: str, filters: List[str]) -> Iterator[Dict[str, Any]]:
+        logger.info(f"[BULK] {action} users under {base_dn} ({len(filters)} searches, dry_run={request.dry_run})")
+        # Una conexión extra para la búsqueda paginada, que se mantiene abierta mientras se aplican los cambios
+        pool = LDAPClientPool(self.workers + 1, name="bulk")
+        matched = set()
+        processed = 0
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                pending = set()
+                with pool.acquire() as ldap:
+                    # Un país/provincia/ciudad sin OU simplemente no tiene usuarios
+                    if not ldap.entry_exists(base_dn):
+                        logger.warning(f"[BULK] Selector base not found: {base_dn}")
+                        filters = []
+                    for search_filter in filters:
+                        for item in ldap.paged_search(base_dn, search_filter, attributes=["uid", "description"], page_size=settings.EXPORT_PAGE_SIZE):
+                            record = UserRecord.from_raw(item["dn"], item["raw_attributes"])
+                            email = record.email or email_from_dn(record.dn)
+                            if email.lower() in matched:
+                                continue
+                            matched.add(email.lower())
+
+                            if request.dry_run:
+                                yield {"email": email, "dn": record.dn, "success": True, "status": "matched"}
+                                continue
+
+                            if len(pending) >= self.workers * 2:
+                                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                                for future in done:
+                                    processed += 1
+                                    yield future.result()
+                            # El executor no copia los contextvars: sin esto la auditoría y las trazas pierden actor y request
+                            pending.add(executor.submit(contextvars.copy_context().run, self._apply, pool, action, email, record))
+
+                while pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        processed += 1
+                        yield future.result()
+        finally:
+            pool.close()
+
+        for email in request.emails or []:
+            if email.lower() not in matched:
+                matched.add(email.lower())
+                yield {"email": email, "dn": None, "success": False, "status": "not_found", "message": "User not found"}
+
+        logger.success(f"[BULK] {action} finished: {processed} users processed")
+
+    def _apply(self, pool: LDAPClientPool, action: str, email: str, record: UserRecord) -> Dict[str, Any]:
+        result = {"email": email, "dn": record.dn}
+        try:
+            with pool.acquire() as ldap:
+                if action == "delete":
+                    ldap.delete_entry(record.dn)
+                    user_directory_index.remove(email)
+                    return {**result, "success": True, "status": "deleted"}
+
+                active = action == "reactivate"
+                if record.active == active:
+                    return {**result, "success": True, "status": "unchanged"}
+                ldap.modify_entry(record.dn, {_ACTIVE.ldap: encode_user_attribute(_ACTIVE, active)})
+                return {**result, "success": True, "status": "updated"}
+        except Exception as e:
+            logger.error(f"[BULK] Error applying {action} to {email}: {e}")
+            return {**result, "success": False, "status": "failed", "message": str(e)}
+
+
+def summarize(results: List[Dict[str, Any]]) -> Dict[str, int]:
+    summary = {"total": len(results)}
+    for result in results:
+        summary[result["status"]] = summary.get(result["status"], 0) + 1
+    return summary
+
+
+bulk_user_service = BulkUserService()
@@ -0,0 +1,368 @@
+import base64
+import binascii
+import itertools
+import json
+import sqlite3
+import threading
+import uuid
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from ldap3.utils.conv import escape_filter_chars
+from loguru import logger
+from app.config import settings
+from app.ldap_client import LDAPClient
+from app.models.user_record import email_from_dn
+
+ADDED = "added"
+MODIFIED = "modified"
+DELETED = "deleted"
+
+# Operaciones de LDAPClient (ver ldap_client.mutation) -> tipo de cambio; el resto son modified
+_MUTATION_TYPES = {"add": ADDED, "delete": DELETED}
+
+# Solo interesan usuarios y grupos (roles y grupos organizacionales), no las OUs
+_ENTRY_FILTER = "(|(objectClass=inetOrgPerson)(objectClass=groupOfNames))"
+
+# Ventana inicial de cada búsqueda del resync; se duplica mientras no alcance para una página
+RESYNC_WINDOW_SECONDS = 60
+
+
+def _changed_attributes(operation: str, changes: Any) -> Optional[List[str]]:
+    if operation == "modify" and isinstance(changes, dict):
+        return sorted(changes)
+    if operation in ("add_value", "remove_value"):
+        return [changes["attribute"]]
+    if operation.endswith(("_member", "_members")):
+        return ["member"]
+    return None
+
+
+def _decode(raw: dict, attribute: str) -> str:
+    return raw[attribute][0].decode("utf-8") if raw.get(attribute) else ""
+
+
+def encode_cursor(state: Dict[str, Any]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(state, separators=(",", ":")).encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Dict[str, Any]:
+    try:
+        state = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (binascii.Error, ValueError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(state, dict) or not isinstance(state.get("l"), str):
+        raise ValueError("Invalid cursor")
+    return state
+
+
+class MemoryChangeLog:
+    """Últimos `max_entries` cambios del proceso; se pierde al reiniciar (los cursores viejos hacen resync)."""
+
+    def __init__(self, max_entries: int):
+        self.log_id = uuid.uuid4().hex[:12]
+        self.max_entries = max_entries
+        self._entries: "deque[Dict[str, Any]]" = deque(maxlen=max_entries)
+        # (dn, stamp) de los cambios ya leídos del directorio, para no repetirlos en cada sondeo
+        self._stamps: "OrderedDict[Tuple[str, str], None]" = OrderedDict()
+        self._seq = 0
+        self._watermark: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def append(self, change: Dict[str, Any], stamp: Optional[str] = None) -> bool:
+        with self._lock:
+            if stamp is not None:
+                key = (change["dn"].lower(), stamp)
+                if key in self._stamps:
+                    return False
+                self._stamps[key] = None
+                while len(self._stamps) > self.max_entries:
+                    self._stamps.popitem(last=False)
+            self._seq += 1
+            self._entries.append({"seq": self._seq, **change})
+            return True
+
+    def read(self, after_seq: int, limit: int) -> List[Dict[str, Any]]:
+        with self._lock:
+            if not self._entries:
+                return []
+            # Las secuencias son consecutivas: la posición se calcula sin recorrer
+            start = max(0, after_seq - self._entries[0]["seq"] + 1)
+            return list(itertools.islice(self._entries, start, start + limit))
+
+    def head(self) -> int:
+        return self._seq
+
+    def oldest(self) -> int:
+        with self._lock:
+            return self._entries[0]["seq"] if self._entries else self._seq + 1
+
+    def get_watermark(self) -> Optional[str]:
+        return self._watermark
+
+    def set_watermark(self, value: str):
+        self._watermark = value
+
+    def purge(self):
+        # El deque ya descarta los más viejos
+        pass
+
+
+class SQLiteChangeLog:
+    """Registro de cambios compartido entre workers (y entre reinicios) en un archivo SQLite (WAL)."""
+
+    def __init__(self, path: str, max_entries: int):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS change_log ("
+            " seq INTEGER PRIMARY KEY AUTOINCREMENT, dn TEXT NOT NULL, stamp TEXT, data TEXT NOT NULL)"
+        )
+        # Los cambios propios no tienen stamp (NULL no choca en un índice único)
+        self._db.execute("CREATE UNIQUE INDEX IF NOT EXISTS change_log_stamp ON change_log (dn, stamp)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS change_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._db.execute("INSERT OR IGNORE INTO change_meta (key, value) VALUES ('log_id', ?)", (uuid.uuid4().hex[:12],))
+        self.log_id = self._db.execute("SELECT value FROM change_meta WHERE key = 'log_id'").fetchone()[0]
+
+    def append(self, change: Dict[str, Any], stamp: Optional[str] = None) -> bool:
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT OR IGNORE INTO change_log (dn, stamp, data) VALUES (?, ?, ?)",
+                (change["dn"].lower(), stamp, json.dumps(change)),
+            )
+            return cursor.rowcount == 1
+
+    def read(self, after_seq: int, limit: int) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT seq, data FROM change_log WHERE seq > ? ORDER BY seq LIMIT ?", (after_seq, limit)
+            ).fetchall()
+        return [{"seq": seq, **json.loads(data)} for seq, data in rows]
+
+    def head(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COALESCE(MAX(seq), 0) FROM change_log").fetchone()[0]
+
+    def oldest(self) -> int:
+        with self._lock:
+            row = self._db.execute("SELECT MIN(seq) FROM change_log").fetchone()
+        return row[0] if row[0] is not None else 1
+
+    def get_watermark(self) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute("SELECT value FROM change_meta WHERE key = 'watermark'").fetchone()
+        return row[0] if row else None
+
+    def set_watermark(self, value: str):
+        # Varios workers sondean: el watermark solo avanza
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO change_meta (key, value) VALUES ('watermark', ?)"
+                " ON CONFLICT(key) DO UPDATE SET value = excluded.value WHERE excluded.value > change_meta.value",
+                (value,),
+            )
+
+    def purge(self):
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM change_log WHERE seq <= (SELECT MAX(seq) FROM change_log) - ?", (self.max_entries,)
+            )
+
+
+class ChangeFeed:
+    """Feed de cambios del directorio (usuarios y grupos) leído con un cursor.
+
+    Se alimenta de dos fuentes: las escrituras del propio microservicio (listener
+    de LDAPClient, incluye bajas) y un sondeo periódico por `modifyTimestamp` o
+    `entryCSN` que detecta lo que cambiaron otros workers o herramientas
+    externas. Un cambio hecho por este servicio puede aparecer dos veces (local
+    y al sondear); los consumidores deben tratar los cambios como idempotentes.
+
+    El cursor es opaco: identifica el registro, la posición en él y el último
+    watermark del directorio. Si el registro ya no tiene esa posición (reinicio
+    con el registro en memoria o cursor demasiado viejo) se responde con un
+    resync: las entradas modificadas desde el watermark, leídas con búsquedas
+    paginadas por ventanas de stamp. Las bajas ocurridas en ese intervalo no
+    se pueden reconstruir.
+    """
+
+    def __init__(self, log, attribute: str, poll_seconds: float, skew_seconds: float):
+        self.log = log
+        self.attribute = attribute
+        self.poll_seconds = poll_seconds
+        self.skew_seconds = skew_seconds
+        self.base_dn = settings.BASE_DN
+        self._ldap: Optional[LDAPClient] = None
+        self._ldap_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is not None or self.poll_seconds <= 0:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="change-feed-poller", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.poll_seconds):
+            try:
+                self.poll()
+                self.log.purge()
+            except Exception as e:
+                logger.error(f"[CHANGES] Error polling directory changes: {e}")
+
+    # --- fuentes ------------------------------------------------------
+
+    def record_mutation(self, event: Dict[str, Any]):
+        """Listener de LDAPClient: registra las escrituras confirmadas por el servidor."""
+        if not event["success"] or event["operation"] == "add_ou":
+            return
+        operation = event["operation"]
+        change_type = _MUTATION_TYPES.get(operation, MODIFIED)
+        self.log.append(self._change(change_type, event["dn"], "local", _changed_attributes(operation, event["changes"])))
+
+    def poll(self) -> int:
+        """Registra las entradas con stamp >= watermark que aún no estaban en el registro."""
+        watermark = self.log.get_watermark() or self._initial_watermark()
+        latest = watermark
+        found = 0
+        for stamp, dn, change_type in self._directory_changes(watermark):
+            if self.log.append(self._change(change_type, dn, "directory"), stamp=stamp):
+                found += 1
+            latest = max(latest, stamp)
+        self.log.set_watermark(latest)
+        if found:
+            logger.info(f"[CHANGES] {found} directory changes since {watermark}")
+        return found
+
+    def _directory_changes(self, since: str, until: Optional[str] = None) -> List[Tuple[str, str, str]]:
+        """Entradas con since <= stamp (< until si se indica), ordenadas por (stamp, dn)."""
+        bound = f"(!({self.attribute}>={escape_filter_chars(until)}))" if until else ""
+        search_filter = f"(&({self.attribute}>={escape_filter_chars(since)}){bound}{_ENTRY_FILTER})"
+        attributes = sorted({self.attribute, "createTimestamp", "modifyTimestamp"})
+        changes = []
+        # Conexión propia reutilizada entre sondeos (el hilo del poller y los resync)
+        with self._ldap_lock:
+            if self._ldap is None:
+                self._ldap = LDAPClient()
+            for item in self._ldap.paged_search(self.base_dn, search_filter, attributes=attributes, page_size=settings.EXPORT_PAGE_SIZE):
+                raw = item["raw_attributes"]
+                stamp = _decode(raw, self.attribute)
+                if not stamp:
+                    continue
+                created = _decode(raw, "createTimestamp")
+                change_type = ADDED if created and created == _decode(raw, "modifyTimestamp") else MODIFIED
+                changes.append((stamp, item["dn"], change_type))
+        changes.sort()
+        return changes
+
+    def _initial_watermark(self) -> str:
+        # Sin watermark previo se empieza "ahora" según el reloj local, con margen por desfase con el servidor
+        return self._format_stamp(datetime.now(timezone.utc) - timedelta(seconds=self.skew_seconds))
+
+    def _format_stamp(self, moment: datetime) -> str:
+        if self.attribute.lower() == "entrycsn":
+            return moment.strftime("%Y%m%d%H%M%S.000000Z#000000#000#000000")
+        return moment.strftime("%Y%m%d%H%M%SZ")
+
+    def _shift_stamp(self, stamp: str, seconds: float) -> Optional[str]:
+        """Stamp `seconds` después de `stamp`; None si cae más allá del presente (ventana abierta)."""
+        try:
+            moment = datetime.strptime(stamp[:14], "%Y%m%d%H%M%S").replace(tzinfo=timezone.utc)
+        except ValueError:
+            return None
+        moment += timedelta(seconds=seconds)
+        if moment > datetime.now(timezone.utc) + timedelta(seconds=self.skew_seconds):
+            return None
+        return self._format_stamp(moment)
+
+    @staticmethod
+    def _change(change_type: str, dn: str, source: str, attributes: Optional[List[str]] = None) -> Dict[str, Any]:
+        return {
+            "type": change_type,
+            "dn": dn,
+            "email": email_from_dn(dn) if dn.lower().startswith("uid=") else None,
+            "attributes": attributes,
+            "source": source,
+            "at": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+        }
+
+    # --- lectura ------------------------------------------------------
+
+    def read(self, cursor: Optional[str], limit: int = 100) -> Dict[str, Any]:
+        """Cambios posteriores al cursor (hasta `limit`) y el cursor para continuar.
+
+        Sin cursor no devuelve cambios: solo el cursor de la posición actual.
+        """
+        if not cursor:
+            return self._page([], self._cursor(self.log.head()), has_more=False, resync=False)
+        state = decode_cursor(cursor)
+        if state.get("r") or state["l"] != self.log.log_id or int(state.get("s", 0)) < self.log.oldest() - 1:
+            return self._resync(state, limit)
+        changes = self.log.read(int(state["s"]), limit)
+        last = changes[-1]["seq"] if changes else int(state["s"])
+        return self._page(changes, self._cursor(last), has_more=len(changes) >= limit, resync=False)
+
+    def _resync(self, state: Dict[str, Any], limit: int) -> Dict[str, Any]:
+        # Al empezar se fija la posición del registro a la que se vuelve al terminar
+        if state.get("r"):
+            log_id, head, skip = state["l"], int(state["h"]), int(state.get("o", 0))
+            window = max(1.0, float(state.get("w", RESYNC_WINDOW_SECONDS)))
+        else:
+            log_id, head, skip, window = self.log.log_id, self.log.head(), 0, float(RESYNC_WINDOW_SECONDS)
+            logger.info(f"[CHANGES] Cursor outside the change log, resync from {state.get('t')}")
+        since = state.get("t") or self._initial_watermark()
+
+        # Ventanas [lower, upper) consecutivas desde `since` hasta reunir una página (+1 para saber si hay más):
+        # cada página lee solo lo que cubre y no todo lo cambiado desde `since`
+        entries: List[Tuple[str, str, str]] = []
+        lower = since
+        while True:
+            upper = self._shift_stamp(lower, window)
+            entries.extend(self._directory_changes(lower, upper))
+            if len(entries) > skip + limit or upper is None:
+                break
+            lower, window = upper, window * 2
+
+        # Orden (stamp, dn): las `skip` primeras con stamp == since ya se entregaron
+        page = entries[skip:skip + limit]
+        changes = [{"seq": None, **self._change(change_type, dn, "directory")} for _, dn, change_type in page]
+        if len(entries) - skip > limit:
+            last = page[-1][0]
+            delivered = sum(1 for stamp, _, _ in page if stamp == last) + (skip if last == since else 0)
+            # Si la última ventana trajo mucho más que una página, la siguiente se achica
+            if len(entries) > 4 * (skip + limit):
+                window /= 2
+            cursor = encode_cursor({"l": log_id, "r": 1, "h": head, "t": last, "o": delivered, "w": window})
+            return self._page(changes, cursor, has_more=True, resync=True)
+        latest = max([since] + [stamp for stamp, _, _ in entries])
+        cursor = encode_cursor({"l": log_id, "s": head, "t": latest})
+        return self._page(changes, cursor, has_more=False, resync=True)
+
+    def _cursor(self, seq: int) -> str:
+        return encode_cursor({"l": self.log.log_id, "s": seq, "t": self.log.get_watermark() or self._initial_watermark()})
+
+    @staticmethod
+    def _page(changes: List[Dict[str, Any]], cursor: str, has_more: bool, resync: bool) -> Dict[str, Any]:
+        return {"changes": changes, "cursor": cursor, "has_more": has_more, "resync": resync}
+
+
+def _build_log():
+    if settings.CHANGE_FEED_PATH:
+        return SQLiteChangeLog(settings.CHANGE_FEED_PATH, settings.CHANGE_FEED_MAX_ENTRIES)
+    return MemoryChangeLog(settings.CHANGE_FEED_MAX_ENTRIES)
+
+
+change_feed = ChangeFeed(
+    _build_log(),
+    attribute=settings.CHANGE_FEED_ATTRIBUTE,
+    poll_seconds=settings.CHANGE_FEED_POLL_SECONDS,
+    skew_seconds=settings.CHANGE_FEED_SKEW_SECONDS,
+)
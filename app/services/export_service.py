@@ -0,0 +1,72 @@
+import zlib
+from typing import Iterator, Iterable, List, Optional
+from loguru import logger
+from app.ldap_client import LDAPClient
+from app.config import settings
+from app.utils.ldif import format_entry
+
+
+MANAGED_SUBTREES = ["ou=users", "ou=roles", "ou=organizational_groups"]
+CHUNK_SIZE = 64 * 1024
+# Nunca salen del directorio: los hashes de contraseña permiten ataques offline
+EXCLUDED_ATTRIBUTES = {"userpassword"}
+
+
+class ExportService:
+    def __init__(self):
+        self.base_dn = settings.BASE_DN
+        self.page_size = settings.EXPORT_PAGE_SIZE
+
+    def iter_ldif(self, subtrees: Optional[List[str]] = None) -> Iterator[str]:
+        # Conexión propia: un export largo no debe bloquear la conexión de los requests
+        ldap = LDAPClient()
+        exported = 0
+        try:
+            yield "version: 1\n\n"
+            for subtree in subtrees or MANAGED_SUBTREES:
+                subtree_dn = f"{subtree},{self.base_dn}"
+                if not ldap.entry_exists(subtree_dn):
+                    logger.warning(f"[EXPORT] Subtree not found, skipping: {subtree_dn}")
+                    continue
+
+                logger.info(f"[EXPORT] Exporting {subtree_dn}")
+                for item in ldap.paged_search(subtree_dn, "(objectClass=*)", page_size=self.page_size):
+                    attributes = {
+                        name: values for name, values in item['raw_attributes'].items()
+                        if name.lower() not in EXCLUDED_ATTRIBUTES
+                    }
+                    yield format_entry(item['dn'], attributes)
+                    exported += 1
+            logger.success(f"[EXPORT] Exported {exported} entries")
+        finally:
+            ldap.close()
+
+    def iter_chunks(self, compress: bool = False, subtrees: Optional[List[str]] = None) -> Iterator[bytes]:
+        """Agrupa el LDIF en bloques de ~64KB, opcionalmente comprimidos en gzip al vuelo."""
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+        for chunk in _buffered(self.iter_ldif(subtrees)):
+            if compressor:
+                data = compressor.compress(chunk)
+                if data:
+                    yield data
+            else:
+                yield chunk
+        if compressor:
+            yield compressor.flush()
+
+
+def _buffered(records: Iterable[str]) -> Iterator[bytes]:
+    buffer: List[bytes] = []
+    size = 0
+    for record in records:
+        data = record.encode("utf-8")
+        buffer.append(data)
+        size += len(data)
+        if size >= CHUNK_SIZE:
+            yield b"".join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield b"".join(buffer)
+
+
+export_service = ExportService()
@@ -0,0 +1,146 @@
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from ldap3 import Server, Connection, BASE, NONE
+from loguru import logger
+from app.config import settings
+from app.ldap_client import pool_stats, receive_timeout
+from app.utils.resilience import circuit_breaker
+
+
+class ServerStatus:
+    __slots__ = ("host", "healthy", "connect_ms", "bind_ms", "root_dse_ms", "error", "checked_at", "last_success_at")
+
+    def __init__(self, host: str):
+        self.host = host
+        self.healthy = False
+        self.connect_ms: Optional[float] = None
+        self.bind_ms: Optional[float] = None
+        self.root_dse_ms: Optional[float] = None
+        self.error: Optional[str] = None
+        self.checked_at: Optional[float] = None
+        self.last_success_at: Optional[float] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class HealthService:
+    """Prueba periódicamente cada servidor LDAP desde un hilo propio y guarda el resultado.
+
+    Cada sonda abre una conexión dedicada (no comparte la de los requests), mide
+    conexión, bind y lectura del root DSE, y la cierra. Los endpoints de salud
+    solo leen el último resultado en memoria.
+    """
+
+    def __init__(self, hosts: List[str], interval_seconds: float, timeout_seconds: float, stale_seconds: float):
+        self.hosts = hosts
+        self.interval_seconds = interval_seconds
+        self.timeout_seconds = timeout_seconds
+        self.stale_seconds = stale_seconds
+        self._status: Dict[str, ServerStatus] = {host: ServerStatus(host) for host in hosts}
+        self._started_at = time.time()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="health-prober", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            for host in self.hosts:
+                self._probe(self._status[host])
+            self._stop.wait(self.interval_seconds)
+
+    def _probe(self, current: ServerStatus):
+        conn = None
+        was_healthy = current.healthy
+        try:
+            server = Server(current.host, port=settings.LDAP_PORT, get_info=NONE, connect_timeout=self.timeout_seconds)
+            conn = Connection(
+                server,
+                user=settings.LDAP_BIND_DN,
+                password=settings.LDAP_PASSWORD,
+                receive_timeout=receive_timeout(self.timeout_seconds)
+            )
+            started = time.perf_counter()
+            conn.open()
+            opened = time.perf_counter()
+            if not conn.bind():
+                raise Exception(f"Bind failed: {conn.result.get('description')}")
+            bound = time.perf_counter()
+            conn.search("", "(objectClass=*)", search_scope=BASE, attributes=["namingContexts"])
+            finished = time.perf_counter()
+
+            current.connect_ms = round((opened - started) * 1000, 2)
+            current.bind_ms = round((bound - opened) * 1000, 2)
+            current.root_dse_ms = round((finished - bound) * 1000, 2)
+            current.healthy = True
+            current.error = None
+            current.last_success_at = time.time()
+            # Un sondeo exitoso cierra el breaker sin esperar a que un request haga de prueba
+            circuit_breaker(current.host, settings.LDAP_PORT).record_success()
+        except Exception as e:
+            current.healthy = False
+            current.error = str(e)
+        finally:
+            current.checked_at = time.time()
+            if conn is not None:
+                try:
+                    conn.unbind()
+                except Exception:
+                    pass
+
+        # Solo se registran los cambios de estado para no llenar el log cada intervalo
+        if current.healthy and not was_healthy:
+            logger.info("[HEALTH] LDAP server {} is healthy (bind {} ms, root DSE {} ms)", current.host, current.bind_ms, current.root_dse_ms)
+        elif not current.healthy and (was_healthy or current.last_success_at is None):
+            logger.warning("[HEALTH] LDAP server {} is unhealthy: {}", current.host, current.error)
+
+    def _is_fresh(self, current: ServerStatus, now: float) -> bool:
+        return current.healthy and current.last_success_at is not None and now - current.last_success_at <= self.stale_seconds
+
+    def is_live(self) -> bool:
+        # La liveness no depende del directorio: solo de que el prober siga corriendo
+        return self._thread is None or self._thread.is_alive()
+
+    def is_ready(self) -> bool:
+        now = time.time()
+        return any(self._is_fresh(current, now) for current in self._status.values())
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.time()
+        ready = self.is_ready()
+        servers = [
+            {**current.to_dict(), "circuit": circuit_breaker(current.host, settings.LDAP_PORT).state}
+            for current in self._status.values()
+        ]
+        if all(current.checked_at is None for current in self._status.values()):
+            status_str = "starting"
+        else:
+            status_str = "healthy" if ready else "unhealthy"
+        return {
+            "status": status_str,
+            "ldap_connection": ready,
+            "live": self.is_live(),
+            "ready": ready,
+            "error": None if ready else next((current.error for current in self._status.values() if current.error), None),
+            "uptime_seconds": round(now - self._started_at, 1),
+            "servers": servers,
+            "pools": pool_stats(),
+        }
+
+
+health_service = HealthService(
+    settings.HEALTH_PROBE_HOSTS,
+    settings.HEALTH_PROBE_INTERVAL_SECONDS,
+    settings.HEALTH_PROBE_TIMEOUT_SECONDS,
+    settings.HEALTH_STALE_SECONDS
+)
@@ -0,0 +1,199 @@
+import csv
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Iterator, Tuple, Dict, Any, List, Optional
+from loguru import logger
+from app.ldap_client import LDAPClientPool
+from app.models.user import User
+from app.services.user_service import UserService
+from app.config import settings
+from app.utils.ldif import parse_ldif
+
+
+TRUE_VALUES = {"true", "1", "yes", "si", "sí", "active"}
+
+
+class InvalidRow(Exception):
+    """Fila del CSV que no forma un usuario válido; se cuenta como fallida sin detener la importación."""
+
+    def __init__(self, line: int, error: Exception):
+        super().__init__(str(error))
+        self.line = line
+
+
+def _csv_row_to_user(row: Dict[str, str]) -> User:
+    data = {k: v for k, v in row.items() if k and v not in (None, "")}
+    data["phone"] = [p.strip() for p in data.get("phone", "").replace("|", ";").split(";") if p.strip()]
+    data["active"] = str(data.get("active", "true")).strip().lower() in TRUE_VALUES
+    return User(**data)
+
+
+class ImportService:
+    """Carga masiva de usuarios desde CSV o LDIF con checkpoint para poder retomar.
+
+    Las filas se leen de forma incremental, se agrupan en bloques y cada bloque
+    se inserta en un hilo con su propia conexión del pool. El checkpoint guarda
+    cuántas filas consecutivas ya se procesaron.
+    """
+
+    def __init__(self, chunk_size: int = None, workers: int = None):
+        self.chunk_size = chunk_size or settings.IMPORT_CHUNK_SIZE
+        self.workers = workers or settings.IMPORT_WORKERS
+        self.base_dn = settings.BASE_DN
+        self.user_service = UserService()
+        self._known_ous = set()
+        self._ou_lock = threading.Lock()
+
+    def iter_records(self, path: str, fmt: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        if fmt == "csv":
+            with open(path, newline="", encoding="utf-8") as handle:
+                reader = csv.DictReader(handle)
+                for row in reader:
+                    try:
+                        user = _csv_row_to_user(row)
+                        dn = self.user_service.build_user_dn(user)
+                    except ValueError as e:
+                        # ValidationError de pydantic incluido: la fila ocupa su lugar para que el checkpoint avance
+                        yield None, InvalidRow(reader.line_num, e)
+                        continue
+                    yield dn, self.user_service.build_user_attrs(user)
+        elif fmt == "ldif":
+            with open(path, encoding="utf-8") as handle:
+                yield from parse_ldif(handle)
+        else:
+            raise Exception(f"Unsupported import format: {fmt}")
+
+    def run(self, path: str, fmt: Optional[str] = None, checkpoint_path: Optional[str] = None) -> Dict[str, Any]:
+        fmt = fmt or ("ldif" if path.lower().endswith(".ldif") else "csv")
+        checkpoint_path = checkpoint_path or f"{path}.checkpoint.json"
+        checkpoint = self._load_checkpoint(checkpoint_path, path)
+        start_row = checkpoint["rows_done"]
+        if start_row:
+            logger.info(f"[IMPORT] Resuming {path} from row {start_row}")
+
+        pool = LDAPClientPool(self.workers, name="import")
+        started = time.monotonic()
+        pending = {}
+        finished_chunks = {}
+        next_chunk_start = start_row
+
+        def record_progress(future):
+            chunk_start, chunk_len = pending.pop(future)
+            stats = future.result()
+            for key in ("created", "skipped", "failed"):
+                checkpoint[key] += stats[key]
+            checkpoint["errors"] = (checkpoint["errors"] + stats["errors"])[-100:]
+            finished_chunks[chunk_start] = chunk_len
+
+            # El checkpoint solo avanza sobre bloques consecutivos terminados
+            while checkpoint["rows_done"] in finished_chunks:
+                checkpoint["rows_done"] += finished_chunks.pop(checkpoint["rows_done"])
+            self._save_checkpoint(checkpoint_path, checkpoint)
+
+            processed = checkpoint["rows_done"] - start_row
+            elapsed = time.monotonic() - started
+            logger.info(f"[IMPORT] {checkpoint['rows_done']} rows done ({processed / elapsed if elapsed else 0:.1f} rows/s)")
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for chunk in self._chunks(self.iter_records(path, fmt), start_row):
+                    if len(pending) >= self.workers * 2:
+                        done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+                        for future in done:
+                            record_progress(future)
+
+                    future = executor.submit(self._import_chunk, pool, chunk)
+                    pending[future] = (next_chunk_start, len(chunk))
+                    next_chunk_start += len(chunk)
+
+                while pending:
+                    done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+                    for future in done:
+                        record_progress(future)
+        finally:
+            pool.close()
+
+        elapsed = time.monotonic() - started
+        processed = checkpoint["rows_done"] - start_row
+        summary = {
+            "rows_done": checkpoint["rows_done"],
+            "created": checkpoint["created"],
+            "skipped": checkpoint["skipped"],
+            "failed": checkpoint["failed"],
+            "elapsed_seconds": round(elapsed, 2),
+            "rows_per_second": round(processed / elapsed, 1) if elapsed else 0.0,
+            "errors": checkpoint["errors"],
+        }
+        logger.success(f"[IMPORT] Finished {path}: {summary['created']} created, {summary['skipped']} skipped, {summary['failed']} failed, {summary['rows_per_second']} rows/s")
+        return summary
+
+    def _chunks(self, records, start_row: int) -> Iterator[List[Tuple[str, Dict[str, Any]]]]:
+        chunk = []
+        for index, record in enumerate(records):
+            if index < start_row:
+                continue
+            chunk.append(record)
+            if len(chunk) >= self.chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def _import_chunk(self, pool: LDAPClientPool, chunk: List[Tuple[Optional[str], Any]]) -> Dict[str, Any]:
+        stats = {"created": 0, "skipped": 0, "failed": 0, "errors": []}
+        with pool.acquire() as ldap:
+            for dn, attrs in chunk:
+                if isinstance(attrs, InvalidRow):
+                    stats["failed"] += 1
+                    stats["errors"].append({"line": attrs.line, "error": str(attrs)})
+                    continue
+                try:
+                    self._ensure_parent_ous(ldap, dn)
+                except Exception as e:
+                    stats["failed"] += 1
+                    stats["errors"].append({"dn": dn, "error": str(e)})
+                    continue
+                try:
+                    ldap.create_entry(dn, attrs)
+                    stats["created"] += 1
+                except Exception as e:
+                    # Solo el resultado del add indica si la entrada ya existía
+                    if ldap.result and ldap.result.get("description") == "entryAlreadyExists":
+                        stats["skipped"] += 1
+                    else:
+                        stats["failed"] += 1
+                        stats["errors"].append({"dn": dn, "error": str(e)})
+        return stats
+
+    def _ensure_parent_ous(self, ldap, dn: str):
+        # Crea una sola vez cada OU intermedia bajo BASE_DN (users, país, provincia, ciudad)
+        rdns = dn.split(",")[1:]
+        base_len = len(self.base_dn.split(","))
+        for i in range(len(rdns) - base_len - 1, -1, -1):
+            ou_dn = ",".join(rdns[i:])
+            if not rdns[i].lower().startswith("ou=") or ou_dn in self._known_ous:
+                continue
+            with self._ou_lock:
+                if ou_dn in self._known_ous:
+                    continue
+                if not ldap.entry_exists(ou_dn):
+                    ldap.create_ou(ou_dn)
+                self._known_ous.add(ou_dn)
+
+    def _load_checkpoint(self, checkpoint_path: str, source: str) -> Dict[str, Any]:
+        if os.path.exists(checkpoint_path):
+            with open(checkpoint_path, encoding="utf-8") as handle:
+                checkpoint = json.load(handle)
+            if checkpoint.get("source") == os.path.abspath(source):
+                return checkpoint
+            logger.warning(f"[IMPORT] Checkpoint {checkpoint_path} belongs to another file, starting over")
+        return {"source": os.path.abspath(source), "rows_done": 0, "created": 0, "skipped": 0, "failed": 0, "errors": []}
+
+    def _save_checkpoint(self, checkpoint_path: str, checkpoint: Dict[str, Any]):
+        tmp_path = f"{checkpoint_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as handle:
+            json.dump(checkpoint, handle)
+        os.replace(tmp_path, checkpoint_path)
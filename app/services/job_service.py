@@ -0,0 +1,416 @@
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field, asdict
+from typing import Optional, Dict, Any, Iterable, List, Callable, Set
+from loguru import logger
+from app.config import settings
+from app.utils.request_context import actor_var
+
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+
+@dataclass
+class Job:
+    id: str
+    type: str
+    params: Dict[str, Any]
+    status: str = QUEUED
+    total: int = 0
+    processed: int = 0
+    failed: int = 0
+    checkpoint: Dict[str, Any] = field(default_factory=dict)
+    result: Any = None
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    actor: str = "-"
+
+    def to_dict(self) -> Dict[str, Any]:
+        percent = round(self.processed * 100 / self.total, 1) if self.total else None
+        return {
+            "id": self.id,
+            "type": self.type,
+            "status": self.status,
+            "progress": {
+                "total": self.total,
+                "processed": self.processed,
+                "failed": self.failed,
+                "percent": percent,
+            },
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class MemoryJobStore:
+    def __init__(self):
+        self._jobs: Dict[str, Job] = {}
+        self._done: Dict[str, Set[str]] = {}
+        self._leases: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def save(self, job: Job, done: Iterable[str] = ()):
+        with self._lock:
+            self._jobs[job.id] = job
+            self._done.setdefault(job.id, set()).update(done)
+
+    def done_keys(self, job_id: str) -> Set[str]:
+        with self._lock:
+            return set(self._done.get(job_id, ()))
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self) -> List[Job]:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def delete(self, job_id: str):
+        with self._lock:
+            self._jobs.pop(job_id, None)
+            self._done.pop(job_id, None)
+            self._leases.pop(job_id, None)
+
+    def claim(self, job_id: str, owner: str, lease_seconds: float) -> Optional[Job]:
+        now = time.time()
+        with self._lock:
+            job = self._jobs.get(job_id)
+            lease = self._leases.get(job_id)
+            if job is None or job.status not in (QUEUED, RUNNING) or (lease and lease[1] > now):
+                return None
+            self._leases[job_id] = (owner, now + lease_seconds)
+            return job
+
+    def renew(self, job_id: str, owner: str, lease_seconds: float) -> bool:
+        with self._lock:
+            lease = self._leases.get(job_id)
+            if not lease or lease[0] != owner:
+                return False
+            self._leases[job_id] = (owner, time.time() + lease_seconds)
+            return True
+
+    def claimable(self) -> List[str]:
+        now = time.time()
+        with self._lock:
+            return [
+                job.id for job in self._jobs.values()
+                if job.status in (QUEUED, RUNNING) and not (job.id in self._leases and self._leases[job.id][1] > now)
+            ]
+
+
+class SQLiteJobStore:
+    """Persiste los jobs en SQLite para poder retomarlos tras un reinicio.
+
+    Varios procesos pueden compartir el archivo: cada job pendiente lo ejecuta
+    el proceso que lo reclama (owner + lease_expires_at, columnas fuera del JSON
+    para que save() no las pise). Un lease que su dueño deja vencer, porque
+    el proceso murió, lo puede reclamar otro.
+    """
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY, status TEXT NOT NULL, finished_at REAL, data TEXT NOT NULL,"
+            " owner TEXT, lease_expires_at REAL)"
+        )
+        # Elementos ya procesados, una fila por clave: cada checkpoint agrega solo los nuevos
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS job_done ("
+            " job_id TEXT NOT NULL, key TEXT NOT NULL, PRIMARY KEY (job_id, key)) WITHOUT ROWID"
+        )
+        # Archivos creados antes de los leases
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(jobs)")}
+        for column, definition in (("owner", "TEXT"), ("lease_expires_at", "REAL")):
+            if column not in columns:
+                self._db.execute(f"ALTER TABLE jobs ADD COLUMN {column} {definition}")
+
+    def save(self, job: Job, done: Iterable[str] = ()):
+        """Guarda el job y agrega `done` a sus elementos procesados, en una sola transacción."""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute(
+                    "INSERT INTO jobs (id, status, finished_at, data) VALUES (?, ?, ?, ?)"
+                    " ON CONFLICT(id) DO UPDATE SET status = excluded.status,"
+                    " finished_at = excluded.finished_at, data = excluded.data",
+                    (job.id, job.status, job.finished_at, json.dumps(asdict(job), default=str)),
+                )
+                self._db.executemany(
+                    "INSERT OR IGNORE INTO job_done (job_id, key) VALUES (?, ?)", ((job.id, key) for key in done)
+                )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def done_keys(self, job_id: str) -> Set[str]:
+        with self._lock:
+            rows = self._db.execute("SELECT key FROM job_done WHERE job_id = ?", (job_id,)).fetchall()
+        return {row[0] for row in rows}
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            row = self._db.execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return Job(**json.loads(row[0])) if row else None
+
+    def list(self) -> List[Job]:
+        with self._lock:
+            rows = self._db.execute("SELECT data FROM jobs").fetchall()
+        return [Job(**json.loads(row[0])) for row in rows]
+
+    def delete(self, job_id: str):
+        with self._lock:
+            self._db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            self._db.execute("DELETE FROM job_done WHERE job_id = ?", (job_id,))
+
+    def claim(self, job_id: str, owner: str, lease_seconds: float) -> Optional[Job]:
+        """Toma el job si está pendiente y sin lease vigente; None si otro proceso lo tiene."""
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                claimed = self._db.execute(
+                    "UPDATE jobs SET owner = ?, lease_expires_at = ? WHERE id = ? AND status IN (?, ?)"
+                    " AND (lease_expires_at IS NULL OR lease_expires_at <= ?)",
+                    (owner, now + lease_seconds, job_id, QUEUED, RUNNING, now),
+                ).rowcount
+                row = self._db.execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone() if claimed else None
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return Job(**json.loads(row[0])) if row else None
+
+    def renew(self, job_id: str, owner: str, lease_seconds: float) -> bool:
+        with self._lock:
+            return self._db.execute(
+                "UPDATE jobs SET lease_expires_at = ? WHERE id = ? AND owner = ?",
+                (time.time() + lease_seconds, job_id, owner),
+            ).rowcount == 1
+
+    def claimable(self) -> List[str]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id FROM jobs WHERE status IN (?, ?) AND (lease_expires_at IS NULL OR lease_expires_at <= ?)",
+                (QUEUED, RUNNING, time.time()),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+
+class JobContext:
+    """Progreso y checkpoint de un job, usado por los servicios durante el fan-out.
+
+    Los elementos ya procesados se guardan en el store (solo los nuevos en
+    cada checkpoint) para que un job retomado no repita el trabajo hecho antes
+    de la interrupción.
+    """
+
+    def __init__(self, job: Job, store=None, save_every: int = 50):
+        self.job = job
+        self._store = store
+        self._save_every = save_every
+        # "done" en el checkpoint: jobs guardados antes de la tabla de elementos procesados,
+        # se pasan a la tabla en el próximo save
+        self._unsaved: List[str] = job.checkpoint.pop("done", [])
+        self._done = set(self._unsaved)
+        if store is not None:
+            self._done |= store.done_keys(job.id)
+
+    @classmethod
+    def detached(cls) -> "JobContext":
+        # Contexto para ejecuciones síncronas dentro del request: no persiste nada
+        return cls(Job(id="inline", type="inline", params={}, status=RUNNING))
+
+    @property
+    def stage(self) -> Optional[str]:
+        return self.job.checkpoint.get("stage")
+
+    def set_stage(self, stage: str):
+        self.job.checkpoint["stage"] = stage
+        self.save()
+
+    def set_total(self, total: int):
+        self.job.total = total
+        self.save()
+
+    def is_done(self, key: str) -> bool:
+        return key in self._done
+
+    def pending(self, items: List[str]) -> List[str]:
+        return [item for item in items if item not in self._done]
+
+    def mark_done(self, key: str, success: bool = True):
+        self._done.add(key)
+        self.job.processed += 1
+        if not success:
+            self.job.failed += 1
+        self._unsaved.append(key)
+        if len(self._unsaved) >= self._save_every:
+            self.save()
+
+    def save(self):
+        unsaved, self._unsaved = self._unsaved, []
+        if self._store is None:
+            return
+        self._store.save(self.job, unsaved)
+
+
+class JobService:
+    def __init__(self, store, workers: int, retention_seconds: int, lease_seconds: float = 60):
+        self.store = store
+        self.workers = workers
+        self.retention_seconds = retention_seconds
+        self.lease_seconds = lease_seconds
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._handlers: Dict[str, Callable[[Dict[str, Any], JobContext], Any]] = {}
+        self._queue: "queue.Queue[str]" = queue.Queue()
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        # Jobs en la cola local sin reclamar y jobs que este proceso está ejecutando
+        self._enqueued: Set[str] = set()
+        self._running: Set[str] = set()
+
+    def register(self, job_type: str, handler: Callable[[Dict[str, Any], JobContext], Any]):
+        self._handlers[job_type] = handler
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._worker, name=f"job-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            thread = threading.Thread(target=self._heartbeat, name="job-leases", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+        # Jobs interrumpidos por un reinicio (lease vencido) vuelven a la cola desde su checkpoint
+        resumed = self._enqueue_claimable()
+        if resumed:
+            logger.info(f"[JOBS] Resuming {resumed} unfinished jobs")
+
+    def _enqueue(self, job_id: str) -> bool:
+        with self._lock:
+            if job_id in self._enqueued or job_id in self._running:
+                return False
+            self._enqueued.add(job_id)
+        self._queue.put(job_id)
+        return True
+
+    def _enqueue_claimable(self) -> int:
+        return sum(1 for job_id in self.store.claimable() if self._enqueue(job_id))
+
+    def _heartbeat(self):
+        # Renueva los leases propios y encola los jobs cuyo dueño dejó vencer el suyo
+        while True:
+            time.sleep(self.lease_seconds / 3)
+            try:
+                with self._lock:
+                    running = list(self._running)
+                for job_id in running:
+                    if not self.store.renew(job_id, self.owner, self.lease_seconds):
+                        logger.warning(f"[JOBS] Lost the lease of job {job_id}")
+                resumed = self._enqueue_claimable()
+                if resumed:
+                    logger.info(f"[JOBS] Taking over {resumed} jobs with an expired lease")
+            except Exception as e:
+                logger.error(f"[JOBS] Error renewing job leases: {e}")
+
+    def submit(self, job_type: str, params: Dict[str, Any]) -> Job:
+        if job_type not in self._handlers:
+            raise Exception(f"Unknown job type: {job_type}")
+        self.start()
+        self.purge_expired()
+
+        job = Job(id=uuid.uuid4().hex, type=job_type, params=params, actor=actor_var.get())
+        self.store.save(job)
+        self._enqueue(job.id)
+        logger.info(f"[JOBS] Job {job.id} queued: {job_type}")
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.store.get(job_id)
+
+    def list(self) -> List[Job]:
+        self.purge_expired()
+        return sorted(self.store.list(), key=lambda job: job.created_at, reverse=True)
+
+    def purge_expired(self):
+        limit = time.time() - self.retention_seconds
+        for job in self.store.list():
+            if job.finished_at and job.finished_at < limit:
+                self.store.delete(job.id)
+
+    def _worker(self):
+        while True:
+            job_id = self._queue.get()
+            try:
+                with self._lock:
+                    self._enqueued.discard(job_id)
+                    self._running.add(job_id)
+                # Con un store compartido solo uno de los procesos consigue el lease
+                job = self.store.claim(job_id, self.owner, self.lease_seconds)
+                if job:
+                    self._run(job)
+            except Exception as e:
+                logger.error(f"[JOBS] Unexpected error in job worker for {job_id}: {e}")
+            finally:
+                with self._lock:
+                    self._running.discard(job_id)
+                self._queue.task_done()
+
+    def _run(self, job: Job):
+        handler = self._handlers.get(job.type)
+        job.status = RUNNING
+        job.started_at = job.started_at or time.time()
+        self.store.save(job)
+        context = JobContext(job, self.store)
+        actor_token = actor_var.set(job.actor)
+
+        try:
+            logger.info(f"[JOBS] Job {job.id} started: {job.type}")
+            if handler is None:
+                raise Exception(f"No handler registered for job type: {job.type}")
+            job.result = handler(job.params, context)
+            job.status = COMPLETED
+            logger.success(f"[JOBS] Job {job.id} completed")
+        except Exception as e:
+            job.status = FAILED
+            job.error = str(e)
+            logger.error(f"[JOBS] Job {job.id} failed: {e}")
+        finally:
+            actor_var.reset(actor_token)
+            job.finished_at = time.time()
+            context.save()
+
+
+def _build_store():
+    if settings.JOB_STORE_PATH:
+        return SQLiteJobStore(settings.JOB_STORE_PATH)
+    return MemoryJobStore()
+
+
+job_service = JobService(
+    store=_build_store(),
+    workers=settings.JOB_WORKERS,
+    retention_seconds=settings.JOB_RETENTION_SECONDS,
+    lease_seconds=settings.JOB_LEASE_SECONDS,
+)
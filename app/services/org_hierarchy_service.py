@@ -0,0 +1,302 @@
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
+from loguru import logger
+from app.config import settings
+from app.ldap_client import LDAPClient
+
+NodeKey = Tuple[str, int]
+
+_PATH_PART = re.compile(r"^(.+)\((\d+)\)$")
+
+
+def hierarchy_key(name: str, level: int) -> NodeKey:
+    # Misma normalización que el cn de los grupos: "Ventas Norte" nivel 2 -> ("ventas_norte", 2)
+    from app.services.organizational_group_service import normalize_name
+    return normalize_name(name), int(level)
+
+
+def parse_hierarchy_path(value: str) -> Optional[List[Tuple[str, int]]]:
+    """"A(1) > B(2)" -> [("A", 1), ("B", 2)]; None si el valor no es una ruta jerárquica (p.ej. un rol)."""
+    chain = []
+    for part in value.split(" > "):
+        match = _PATH_PART.match(part.strip())
+        if not match:
+            return None
+        chain.append((match.group(1), int(match.group(2))))
+    return chain
+
+
+class OrgNode:
+    __slots__ = ("key", "name", "level", "type", "dn", "parent", "children", "members")
+
+    def __init__(self, key: NodeKey, name: str, level: int):
+        self.key = key
+        self.name = name
+        self.level = level
+        self.type: Optional[str] = None
+        self.dn: Optional[str] = None
+        self.parent: Optional[NodeKey] = None
+        self.children: Set[NodeKey] = set()
+        self.members: Set[str] = set()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "level": self.level,
+            "type": self.type,
+            "dn": self.dn,
+            "parent": {"name_key": self.parent[0], "level": self.parent[1]} if self.parent else None,
+            "children": len(self.children),
+            "members": len(self.members),
+        }
+
+
+class OrgHierarchyIndex:
+    """Árbol en memoria de grupos organizacionales y sus miembros.
+
+    Se construye desde ou=organizational_groups (grupos y miembros) y desde las
+    rutas `businessCategory` de los usuarios (relaciones padre/hijo). Los
+    servicios lo actualizan en cada asignación, cambio o baja, y se reconstruye
+    completo cada ORG_INDEX_REFRESH_SECONDS para corregir cambios hechos fuera
+    del microservicio. Los cambios que llegan mientras se reconstruye se
+    vuelven a aplicar sobre el árbol nuevo.
+    """
+
+    def __init__(self, refresh_seconds: float):
+        self.base_dn = settings.BASE_DN
+        self.refresh_seconds = refresh_seconds
+        self._nodes: Dict[NodeKey, OrgNode] = {}
+        self._lock = threading.RLock()
+        self._loaded = threading.Event()
+        self._build_lock = threading.Lock()
+        self._pending: Optional[List[Tuple[Callable[..., None], Tuple[Any, ...]]]] = None
+        self._thread: Optional[threading.Thread] = None
+        self.built_at: Optional[float] = None
+
+    # --- construcción -------------------------------------------------
+
+    def start(self):
+        if self._thread is not None or self.refresh_seconds <= 0:
+            return
+        self._thread = threading.Thread(target=self._run, name="org-hierarchy-index", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.rebuild()
+            except Exception as e:
+                logger.error(f"[ORG_INDEX] Error rebuilding hierarchy index: {e}")
+            time.sleep(self.refresh_seconds)
+
+    def ensure_loaded(self):
+        if not self._loaded.is_set():
+            self.rebuild(only_if_missing=True)
+
+    def rebuild(self, only_if_missing: bool = False):
+        with self._build_lock:
+            if only_if_missing and self._loaded.is_set():
+                return
+            started = time.monotonic()
+            with self._lock:
+                self._pending = []
+            nodes: Dict[NodeKey, OrgNode] = {}
+            # Conexión propia: la reconstrucción recorre todo el directorio
+            ldap = LDAPClient()
+            try:
+                groups_dn = f"ou=organizational_groups,{self.base_dn}"
+                if ldap.entry_exists(groups_dn):
+                    for item in ldap.paged_search(groups_dn, "(objectClass=groupOfNames)", attributes=["cn", "member"]):
+                        cn = item["raw_attributes"].get("cn", [b""])[0].decode("utf-8")
+                        name_key, _, level = cn.rpartition("_")
+                        if not name_key or not level.isdigit():
+                            continue
+                        node = self._get_or_create(nodes, (name_key, int(level)), name_key, int(level))
+                        node.dn = item["dn"]
+                        node.members = {v.decode("utf-8") for v in item["raw_attributes"].get("member", []) if v}
+
+                users_dn = f"ou=users,{self.base_dn}"
+                if ldap.entry_exists(users_dn):
+                    for item in ldap.paged_search(users_dn, "(businessCategory=*)", attributes=["businessCategory"]):
+                        for value in item["raw_attributes"].get("businessCategory", []):
+                            chain = parse_hierarchy_path(value.decode("utf-8"))
+                            if chain:
+                                self._link_chain(nodes, [{"name": name, "level": level} for name, level in chain])
+            except Exception:
+                with self._lock:
+                    self._pending = None
+                raise
+            finally:
+                ldap.close()
+
+            with self._lock:
+                # Los tipos solo llegan en los requests: se conservan entre reconstrucciones
+                for key, node in nodes.items():
+                    previous = self._nodes.get(key)
+                    if previous is not None and node.type is None:
+                        node.type = previous.type
+                pending, self._pending = self._pending, None
+                self._nodes = nodes
+                for apply, args in pending:
+                    apply(*args)
+            self.built_at = time.time()
+            self._loaded.set()
+            logger.info(f"[ORG_INDEX] Hierarchy index built: {len(nodes)} nodes in {time.monotonic() - started:.2f}s")
+
+    @staticmethod
+    def _get_or_create(nodes: Dict[NodeKey, OrgNode], key: NodeKey, name: str, level: int) -> OrgNode:
+        node = nodes.get(key)
+        if node is None:
+            node = OrgNode(key, name, level)
+            nodes[key] = node
+        elif node.name == key[0] and name != key[0]:
+            # El cn normalizado se reemplaza por el nombre original cuando se conoce
+            node.name = name
+        return node
+
+    def _link_chain(self, nodes: Dict[NodeKey, OrgNode], chain: List[Dict[str, Any]]):
+        parent: Optional[OrgNode] = None
+        for item in sorted(chain, key=lambda x: x.get("level", 0)):
+            key = hierarchy_key(item["name"], item["level"])
+            node = self._get_or_create(nodes, key, item["name"], item["level"])
+            if item.get("type"):
+                node.type = item["type"]
+            if parent is not None and node.parent != parent.key:
+                if node.parent and node.parent in nodes:
+                    nodes[node.parent].children.discard(key)
+                node.parent = parent.key
+                parent.children.add(key)
+            parent = node
+
+    # --- actualizaciones desde los servicios --------------------------
+
+    def record_assignment(self, group_name: str, hierarchy_level: int, group_type: Optional[str], group_dn: str, hierarchy_chain: List[Dict[str, Any]], user_dn: str):
+        self._record(self._apply_assignment, group_name, hierarchy_level, group_type, group_dn, hierarchy_chain, user_dn)
+
+    def record_removal(self, group_name: str, hierarchy_level: int, user_dn: str, group_deleted: bool):
+        self._record(self._apply_removal, group_name, hierarchy_level, user_dn, group_deleted)
+
+    def record_update(self, old_name: str, old_level: int, new_name: str, new_level: int, new_group_dn: str, new_chain: List[Dict[str, Any]]):
+        self._record(self._apply_update, old_name, old_level, new_name, new_level, new_group_dn, new_chain)
+
+    def _record(self, apply: Callable[..., None], *args: Any):
+        with self._lock:
+            # Durante una reconstrucción el cambio se guarda para repetirlo sobre el árbol nuevo
+            if self._pending is not None:
+                self._pending.append((apply, args))
+            if self._loaded.is_set():
+                apply(*args)
+
+    def _apply_assignment(self, group_name: str, hierarchy_level: int, group_type: Optional[str], group_dn: str, hierarchy_chain: List[Dict[str, Any]], user_dn: str):
+        self._link_chain(self._nodes, hierarchy_chain)
+        key = hierarchy_key(group_name, hierarchy_level)
+        node = self._get_or_create(self._nodes, key, group_name, hierarchy_level)
+        node.dn = group_dn
+        if group_type:
+            node.type = group_type
+        node.members.add(user_dn)
+
+    def _apply_removal(self, group_name: str, hierarchy_level: int, user_dn: str, group_deleted: bool):
+        node = self._nodes.get(hierarchy_key(group_name, hierarchy_level))
+        if node is None:
+            return
+        node.members.discard(user_dn)
+        if group_deleted:
+            node.dn = None
+            self._prune(node)
+
+    def _apply_update(self, old_name: str, old_level: int, new_name: str, new_level: int, new_group_dn: str, new_chain: List[Dict[str, Any]]):
+        old_key = hierarchy_key(old_name, old_level)
+        new_key = hierarchy_key(new_name, new_level)
+        old_node = self._nodes.get(old_key)
+        if old_node is not None and old_key != new_key:
+            # Los hijos y miembros pasan al nodo renombrado
+            del self._nodes[old_key]
+            if old_node.parent in self._nodes:
+                self._nodes[old_node.parent].children.discard(old_key)
+            new_node = self._get_or_create(self._nodes, new_key, new_name, new_level)
+            new_node.members |= old_node.members
+            new_node.children |= old_node.children
+            new_node.type = new_node.type or old_node.type
+            for child_key in old_node.children:
+                if child_key in self._nodes:
+                    self._nodes[child_key].parent = new_key
+        self._link_chain(self._nodes, new_chain)
+        node = self._get_or_create(self._nodes, new_key, new_name, new_level)
+        node.dn = new_group_dn
+
+    def _prune(self, node: OrgNode):
+        # Un nodo sin grupo, sin miembros y sin hijos ya no aporta nada al árbol
+        while node is not None and node.dn is None and not node.members and not node.children:
+            del self._nodes[node.key]
+            parent = self._nodes.get(node.parent) if node.parent else None
+            if parent is not None:
+                parent.children.discard(node.key)
+            node = parent
+
+    # --- consultas ----------------------------------------------------
+
+    def get(self, name: str, level: int) -> Optional[OrgNode]:
+        self.ensure_loaded()
+        with self._lock:
+            return self._nodes.get(hierarchy_key(name, level))
+
+    def descendants(self, name: str, level: int, max_depth: Optional[int] = None) -> Optional[List[Dict[str, Any]]]:
+        self.ensure_loaded()
+        with self._lock:
+            node = self._nodes.get(hierarchy_key(name, level))
+            if node is None:
+                return None
+            return [
+                {**self._nodes[key].to_dict(), "depth": depth}
+                for key, depth in self._walk(node.key, max_depth)
+                if key != node.key
+            ]
+
+    def ancestors(self, name: str, level: int) -> Optional[List[Dict[str, Any]]]:
+        self.ensure_loaded()
+        with self._lock:
+            node = self._nodes.get(hierarchy_key(name, level))
+            if node is None:
+                return None
+            chain = []
+            seen = {node.key}
+            parent_key = node.parent
+            while parent_key and parent_key in self._nodes and parent_key not in seen:
+                seen.add(parent_key)
+                parent = self._nodes[parent_key]
+                chain.append(parent.to_dict())
+                parent_key = parent.parent
+            chain.reverse()
+            return chain
+
+    def users(self, name: str, level: int, include_descendants: bool = True) -> Optional[List[str]]:
+        """DNs de los miembros del nodo (y de su subárbol), ordenados para paginar de forma estable."""
+        self.ensure_loaded()
+        with self._lock:
+            node = self._nodes.get(hierarchy_key(name, level))
+            if node is None:
+                return None
+            if not include_descendants:
+                return sorted(node.members)
+            members: Set[str] = set()
+            for key, _ in self._walk(node.key, None):
+                members |= self._nodes[key].members
+            return sorted(members)
+
+    def _walk(self, root: NodeKey, max_depth: Optional[int]) -> Iterator[Tuple[NodeKey, int]]:
+        stack = [(root, 0)]
+        seen: Set[NodeKey] = set()
+        while stack:
+            key, depth = stack.pop()
+            if key in seen or key not in self._nodes:
+                continue
+            seen.add(key)
+            yield key, depth
+            if max_depth is None or depth < max_depth:
+                stack.extend((child, depth + 1) for child in sorted(self._nodes[key].children, reverse=True))
+
+
+org_hierarchy_index = OrgHierarchyIndex(settings.ORG_INDEX_REFRESH_SECONDS)
@@ -1,10 +1,16 @@
 from app.ldap_client import LDAPClient
 from app.models.organizational_group import OrgGroupAssignment, OrgGroupUpdateRequest
 from loguru import logger
+from app.exceptions import LDAPServiceError
 from typing import Optional, Dict, Any, List
-from ldap3 import BASE
+from ldap3 import BASE, MODIFY_REPLACE
+from ldap3.utils.conv import escape_filter_chars
 import re
 from app.config import settings
+from app.models.user_record import UserRecord
+from app.services.job_service import JobContext
+from app.services.org_hierarchy_service import org_hierarchy_index
+from app.utils.cache import directory_cache
 
 class OrganizationalGroupService:
     def __init__(self):
@@ -13,7 +19,7 @@ class OrganizationalGroupService:
     
     def assign_organizational_group(self, org_group: OrgGroupAssignment) -> Dict[str, Any]:
         try:
-            logger.info(f"Assigning organizational group '{org_group.group_name}' to users: {org_group.users}")
+            logger.info("Assigning organizational group '{}' to users: {}", org_group.group_name, org_group.users)
 
             results = []
             for email in org_group.users:
@@ -34,6 +40,14 @@ class OrganizationalGroupService:
                         group_type=org_group.group_type,
                         hierarchy_chain=[item.dict() for item in org_group.hierarchy_chain]
                     )
+                    org_hierarchy_index.record_assignment(
+                        group_name=org_group.group_name,
+                        hierarchy_level=org_group.hierarchy_level,
+                        group_type=org_group.group_type,
+                        group_dn=self._get_org_group_dn(org_group.group_name, org_group.hierarchy_level),
+                        hierarchy_chain=[item.dict() for item in org_group.hierarchy_chain],
+                        user_dn=user_dn
+                    )
 
                     results.append({
                         "email": email,
@@ -42,20 +56,20 @@ class OrganizationalGroupService:
                     })
 
                 except Exception as e:
-                    logger.error(f"Error assigning org group to {email}: {e}")
+                    logger.error("Error assigning org group to {}: {}", email, e)
                     results.append({
                         "email": email,
                         "success": False,
                         "message": str(e)
                     })
             
-            logger.success(f"Organizational group assignment completed for {len(org_group.users)} users")
+            logger.success("Organizational group assignment completed for {} users", len(org_group.users))
             return {
                 "success": True,
                 "results": results
             }
         except Exception as e:
-            logger.error(f"Error in organizational group assignment: {e}")
+            logger.error("Error in organizational group assignment: {}", e)
             raise
 
     def remove_user_from_org_group(self, email: str, group_name: str, hierarchy_level: int) -> bool:
@@ -71,76 +85,73 @@ class OrganizationalGroupService:
             if not self.ldap.entry_exists(group_dn):
                 raise Exception(f"Organizational group not found: {group_dn}")
             
-            entries = self.ldap.search(base_dn=group_dn, search_filter="(objectClass=groupOfNames)", search_scope='BASE')
-
-            if entries:
-                group_entry = entries[0]
-                members = set(group_entry.member.values) if hasattr(group_entry, 'member') else set()
-                logger.info(f"[REMOVE_ORG] Current members in group {group_dn}: {members}")
-
-                if user_dn in members:
-                    if len(members) == 1:
-                        logger.warning(f"[REMOVE_ORG] User: {user_dn} is the last member of group. Deleting group {group_dn}")
-                        self.ldap.delete_entry(group_dn)
-                        logger.info(f"[REMOVE_ORG] Group {group_dn} deleted successfully")
-                    else:
-                        self.ldap.remove_group_member(group_dn, user_dn)
-                        logger.info(f"[REMOVE_ORG] User {user_dn} removed from group {group_dn}")
-
-                    try:
-                        changes = {
-                            "businessCategory": [],
-                            "employeeType": []
-                        }
-                        self.ldap.modify_entry(user_dn, changes)
-                        logger.success(f"[REMOVE_ORG] BUISINESS CATEGORY and EMPLOYEE TYPE attributes cleared for user {user_dn}")
-                    except Exception as e:
-                        logger.error(f"[REMOVE_ORG] Error clearing attributes for user {user_dn}: {e}")
-                    
-                    return True
+            if self.ldap.is_group_member(group_dn, user_dn):
+                group_deleted = self.ldap.count_group_members(group_dn, limit=2) == 1
+                if group_deleted:
+                    logger.warning("[REMOVE_ORG] User: {} is the last member of group. Deleting group {}", user_dn, group_dn)
+                    self.ldap.delete_entry(group_dn)
+                    logger.info("[REMOVE_ORG] Group {} deleted successfully", group_dn)
                 else:
-                    logger.warning(f"[REMOVE_ORG] User {user_dn} is not a member of group {group_dn}")
-                    return False
+                    self.ldap.remove_group_member(group_dn, user_dn)
+                    logger.info("[REMOVE_ORG] User {} removed from group {}", user_dn, group_dn)
+                org_hierarchy_index.record_removal(group_name, hierarchy_level, user_dn, group_deleted)
+
+                try:
+                    changes = {
+                        "businessCategory": [],
+                        "employeeType": []
+                    }
+                    self.ldap.modify_entry(user_dn, changes)
+                    logger.success("[REMOVE_ORG] BUISINESS CATEGORY and EMPLOYEE TYPE attributes cleared for user {}", user_dn)
+                except Exception as e:
+                    logger.error("[REMOVE_ORG] Error clearing attributes for user {}: {}", user_dn, e)
+                
+                return True
             else:
-                logger.warning(f"[REMOVE_ORG] Group not found during search: {group_dn}")
+                logger.warning("[REMOVE_ORG] User {} is not a member of group {}", user_dn, group_dn)
                 return False
         except Exception as e:
-            logger.error(f"[REMOVE_ORG] Error removing user from org group: {e}")
+            logger.error("[REMOVE_ORG] Error removing user from org group: {}", e)
             raise
 
 
-    def update_organizational_group(self, update_request: 'OrgGroupUpdateRequest') -> bool:
-
+    def update_organizational_group(self, update_request: 'OrgGroupUpdateRequest', job: Optional[JobContext] = None) -> bool:
+        job = job or JobContext.detached()
         try:
             old_group_dn = self._get_org_group_dn(update_request.old_group_name, update_request.old_hierarchy_level)
             new_group_dn = self._get_org_group_dn(update_request.new_group_name, update_request.new_hierarchy_level)
 
+            if job.stage == "group_created":
+                # Job retomado después de crear el grupo nuevo: solo falta borrar el viejo
+                if self.ldap.entry_exists(old_group_dn):
+                    self.ldap.delete_entry(old_group_dn)
+                return True
+
             if not self.ldap.entry_exists(old_group_dn):
                 raise Exception(f"Organizational group not found: {old_group_dn}")
             
             if old_group_dn != new_group_dn and self.ldap.entry_exists(new_group_dn):
                 raise Exception(f"A group with name '{update_request.new_group_name}' and level '{update_request.new_hierarchy_level}' already exists.")
             
-            entries = self.ldap.search(base_dn=old_group_dn, search_filter="(objectClass=groupOfNames)", search_scope='BASE')
-            members = []
-            if entries and hasattr(entries[0], 'member'):
-                members = list(entries[0].member.values)
+            members = list(self.ldap.iter_group_members(old_group_dn))
+            job.set_total(len(members))
 
-            logger.info(f"[UPDATE_ORG] Updating group '{update_request.old_group_name}' to '{update_request.new_group_name}' with {len(members)} members")
+            logger.info("[UPDATE_ORG] Updating group '{}' to '{}' with {} members", update_request.old_group_name, update_request.new_group_name, len(members))
 
             new_hierarchy_path = self._build_hierarchy_path([item.dict() for item in update_request.new_hierarchy_chain])
 
             if members:
-                for user_dn in members:
-                    try:
-                        changes = {
-                            "businessCategory": new_hierarchy_path,
-                            "employeeType": update_request.new_group_name
-                        }
-                        self.ldap.modify_entry(user_dn, changes)
-                        logger.info(f"[UPDATE_ORG] Updated user {user_dn} with new hierarchy: {new_hierarchy_path}")
-                    except Exception as e:
-                        logger.error(f"[UPDATE_ORG] Error updating user {user_dn}: {e}")
+                changes = {
+                    "businessCategory": [(MODIFY_REPLACE, [new_hierarchy_path])],
+                    "employeeType": [(MODIFY_REPLACE, [update_request.new_group_name])]
+                }
+                for result in self.ldap.batch_modify([(user_dn, changes) for user_dn in job.pending(members)]):
+                    if result["success"]:
+                        logger.info("[UPDATE_ORG] Updated user {} with new hierarchy: {}", result['dn'], new_hierarchy_path)
+                        job.mark_done(result["dn"])
+                    else:
+                        logger.error("[UPDATE_ORG] Error updating user {}: {} {}", result['dn'], result['result'], result['message'])
+                        job.mark_done(result["dn"], success=False)
 
             if old_group_dn != new_group_dn:
                 new_cn = new_group_dn.split(',')[0].split('=')[1]
@@ -150,46 +161,50 @@ class OrganizationalGroupService:
                     "member": members if members else []
                 }
                 self.ldap.create_entry(new_group_dn, attrs)
+                job.set_stage("group_created")
                 self.ldap.delete_entry(old_group_dn)
-                logger.success(f"[UPDATE_ORG] Group renamed from '{update_request.old_group_name}' to '{update_request.new_group_name}' successfully")
+                logger.success("[UPDATE_ORG] Group renamed from '{}' to '{}' successfully", update_request.old_group_name, update_request.new_group_name)
             else:
-                logger.info(f"[UPDATE_ORG] Only hierarchy path updated, group DN remains the same.")
-
+                logger.info("[UPDATE_ORG] Only hierarchy path updated, group DN remains the same.")
+
+            org_hierarchy_index.record_update(
+                update_request.old_group_name,
+                update_request.old_hierarchy_level,
+                update_request.new_group_name,
+                update_request.new_hierarchy_level,
+                new_group_dn,
+                [item.dict() for item in update_request.new_hierarchy_chain]
+            )
             return True
         except Exception as e:
-            logger.error(f"[UPDATE_ORG] Error updating organizational group: {e}")
+            logger.error("[UPDATE_ORG] Error updating organizational group: {}", e)
             raise
 
 
 
     def _find_user_dn(self, email: str) -> str | None:
         try: 
-            search_filter = f"(uid={email})"
-            entries = self.ldap.search(base_dn=self.base_dn, search_filter=search_filter)
-
-            if entries:
-                return entries[0].entry_dn
-            return None
-            
+            return directory_cache.get_or_load(
+                "dn", email.lower(),
+                lambda: self.ldap.find_dn(self.base_dn, f"(uid={escape_filter_chars(email)})")
+            )
+        except LDAPServiceError:
+            raise
         except Exception as e:
-            logger.error(f"Error finding user DN for {email}: {e}")
+            logger.error("Error finding user DN for {}: {}", email, e)
             return None
 
+
     def _assign_org_group_to_user(self, user_dn: str, group_name: str, hierarchy_level: int, group_type: str, hierarchy_chain: List[Dict]):
         group_dn = self._get_org_group_dn(group_name, hierarchy_level)
         self._ensure_org_group(group_dn, first_member_dn=user_dn)
 
-        entries = self.ldap.search(base_dn=group_dn, search_filter="(objectClass=groupOfNames)", search_scope='BASE')
-        if entries:
-            group_entry = entries[0]
-            members = set(group_entry.member.values) if hasattr(group_entry, 'member') else set()
-            if user_dn not in members:
-                members.add(user_dn)
-                self.ldap.add_group_member(group_dn, user_dn)
-                logger.info(f"[ORG_GROUP] User {user_dn} added to group {group_dn}")
+        if not self.ldap.is_group_member(group_dn, user_dn):
+            self.ldap.add_group_member(group_dn, user_dn)
+            logger.info("[ORG_GROUP] User {} added to group {}", user_dn, group_dn)
         
         hierarchy_path = self._build_hierarchy_path(hierarchy_chain)
-        logger.info(f"[ORG_GROUP] Jerarquía completa: {hierarchy_path}")
+        logger.info("[ORG_GROUP] Jerarquía completa: {}", hierarchy_path)
         
         try:
             changes = {
@@ -197,11 +212,11 @@ class OrganizationalGroupService:
                 "employeeType": group_name
             }
             self.ldap.modify_entry(user_dn, changes)
-            logger.success(f"[ORG_GROUP] ✓ Usuario actualizado con jerarquía: {hierarchy_path}")
+            logger.success("[ORG_GROUP] ✓ Usuario actualizado con jerarquía: {}", hierarchy_path)
         except Exception as e:
-            logger.error(f"[ORG_GROUP] ✗ Error actualizando usuario: {e}")
+            logger.error("[ORG_GROUP] ✗ Error actualizando usuario: {}", e)
             import traceback
-            logger.error(f"[ORG_GROUP] Traceback: {traceback.format_exc()}")
+            logger.error("[ORG_GROUP] Traceback: {}", traceback.format_exc())
 
     def _build_hierarchy_path(self, hierarchy_chain: List[Dict]) -> str:
         sorted_chain = sorted(hierarchy_chain, key=lambda x: x.get('level', 0))
@@ -210,12 +225,14 @@ class OrganizationalGroupService:
 
     def _get_user_business_categories(self, user_dn: str) -> List[str]:
         try:
-            entries = self.ldap.search(user_dn, "(objectClass=*)", search_scope='BASE')
-            if entries and hasattr(entries[0], "businessCategory"):
-                return list(entries[0].businessCategory.values)
-            return []
+            raw_attributes = self.ldap.read_raw(user_dn, ["businessCategory"])
+            if raw_attributes is None:
+                return []
+            return UserRecord.from_raw(user_dn, raw_attributes).businessCategory
+        except LDAPServiceError:
+            raise
         except Exception as e:
-            logger.warning(f"Could not get businessCategory for {user_dn}: {e}")
+            logger.warning("Could not get businessCategory for {}: {}", user_dn, e)
             return []
 
     def _get_org_group_dn(self, group_name: str, hierarchy_level: int) -> str:
@@ -239,7 +256,7 @@ class OrganizationalGroupService:
             else:
                 raise Exception("First member DN is required to create a new organizational group")
             self.ldap.create_entry(group_dn, attrs)
-            logger.info(f"[ORG_GROUP] Created new organizational group: {group_dn}")
+            logger.info("[ORG_GROUP] Created new organizational group: {}", group_dn)
 
 
 def normalize_name(name: str) -> str:
@@ -1,10 +1,16 @@
 from app.ldap_client import LDAPClient
-from app.models.role import RoleAssignment
+from app.models.role import RoleAssignment, RoleMembershipSync
 from loguru import logger
+from app.exceptions import LDAPServiceError
 from typing import Optional, Dict, Any, List
-from ldap3 import MODIFY_ADD, MODIFY_REPLACE, BASE
+from ldap3 import MODIFY_ADD, MODIFY_DELETE, MODIFY_REPLACE
+from ldap3.utils.conv import escape_filter_chars
 import re
 from app.config import settings
+from app.models.user_record import UserRecord, email_from_dn
+from app.services.job_service import JobContext
+from app.services.user_index_service import user_directory_index
+from app.utils.cache import directory_cache
 
 class RoleService:
     def __init__(self):
@@ -13,12 +19,15 @@ class RoleService:
     
     def assign_roles(self, role_assigment: RoleAssignment) -> Dict[str, Any]:
         try:
-            logger.info(f"Assigning roles: {role_assigment.users}")
+            logger.info("Assigning roles: {}", role_assigment.users)
 
             results = []
+            # DN y área de todo el lote desde el índice; solo los usuarios no indexados van a LDAP
+            indexed = user_directory_index.lookup_many(role_assigment.users) if user_directory_index.loaded else {}
             for email in role_assigment.users:
                 try:
-                    user_dn = self._find_user_dn(email)
+                    entry = indexed.get(email)
+                    user_dn = entry.dn if entry else self._find_user_dn(email)
                     if not user_dn:
                         results.append({
                             "email": email,
@@ -36,12 +45,15 @@ class RoleService:
                             })
                             continue
 
-                        if not self._validate_user_area(user_dn, role_assigment.area):
+                        area_matches = entry is not None and entry.area.lower() == role_assigment.area.lower()
+                        # Un no-coincidente del índice se confirma en LDAP por si el índice está desactualizado
+                        if not area_matches and not self._validate_user_area(user_dn, role_assigment.area):
                             results.append({
                                 "email": email,
                                 "success": False,
                                 "message": f"User does not belong to area {role_assigment.area}"
                             })
+                            continue
 
                     if role_assigment.role_global:
                         self._assign_role_to_user(user_dn, "role_global", role_assigment.role_global)
@@ -56,128 +68,126 @@ class RoleService:
                     })
 
                 except Exception as e:
-                    logger.error(f"Error assigning roles to {email}: {e}")
+                    logger.error("Error assigning roles to {}: {}", email, e)
                     results.append({
                         "email": email,
                         "success": False,
                         "message": str(e)
                     })
-            logger.success(f"Role assignment completed for {len(role_assigment.users)} users")
+            logger.success("Role assignment completed for {} users", len(role_assigment.users))
             return {
                 "success": True,
                 "results": results
             }
         except Exception as e:
-            logger.error(f"Error in role assignment: {e}")
+            logger.error("Error in role assignment: {}", e)
             raise
 
 
     def _validate_user_area(self, user_dn: str, required_area: str) -> bool:
         try:
-            search_filter = "(objectClass=*)"
-            entries = self.ldap.search(base_dn=user_dn, search_filter=search_filter)
-            if entries and hasattr(entries[0], "physicalDeliveryOfficeName"):
-                user_area = getattr(entries[0], "physicalDeliveryOfficeName")
-                if hasattr(user_area, 'value'):
-                    user_area_value = user_area.value
-                else:
-                    user_area_value = str(user_area)
-                
-                return user_area_value.lower() == required_area.lower()
-            return False
+            raw_attributes = self.ldap.read_raw(user_dn, ["physicalDeliveryOfficeName"])
+            if raw_attributes is None:
+                return False
+            user_area = UserRecord.from_raw(user_dn, raw_attributes).area
+            return bool(user_area) and user_area.lower() == required_area.lower()
+        except LDAPServiceError:
+            raise
         except Exception as e:
-            logger.error(f"Error validating user area for {user_dn}: {e}")
+            logger.error("Error validating user area for {}: {}", user_dn, e)
             return False
-                
-    
 
     def _find_user_dn(self, email:str) -> str | None:
         try: 
-            search_filter = f"(uid={email})"
-            entries = self.ldap.search(base_dn=self.base_dn, search_filter=search_filter)
-
-            if entries:
-                return entries[0].entry_dn
-            return None
-            
+            return directory_cache.get_or_load(
+                "dn", email.lower(),
+                lambda: self.ldap.find_dn(self.base_dn, f"(uid={escape_filter_chars(email)})")
+            )
+        except LDAPServiceError:
+            raise
         except Exception as e:
-            logger.error(f"Error finding user DN for {email}: {e}")
+            logger.error("Error finding user DN for {}: {}", email, e)
             return None
 
     def _assign_role_to_user(self, user_dn: str, role_type: str, role_name: str, area: Optional[str] = None):
         group_dn = self._get_role_group_dn(role_type, role_name, area)
         self._ensure_role_group(group_dn, first_member_dn=user_dn)
 
-        entries = self.ldap.search(base_dn=group_dn, search_filter="(objectClass=groupOfNames)", search_scope='BASE')
-        if entries:
-            group_entry = entries[0]
-            members = set(group_entry.member.values) if hasattr(group_entry, 'member') else set()
-            if user_dn not in members:
-                members.add(user_dn)
-                self.ldap.add_group_member(group_dn, user_dn)
+        if not self.ldap.is_group_member(group_dn, user_dn):
+            self.ldap.add_group_member(group_dn, user_dn)
         
         # SOLO para role_local
         if role_type == "role_local":
-            logger.info(f"[BC] Intentando agregar businessCategory para role_local: {role_name}")
+            logger.info("[BC] Intentando agregar businessCategory para role_local: {}", role_name)
             try:
                 current_categories = self._get_user_business_categories(user_dn)
-                logger.info(f"[BC] Categorías actuales: {current_categories}")
+                logger.info("[BC] Categorías actuales: {}", current_categories)
                 
                 if role_name not in current_categories: 
                     current_categories.append(role_name)
-                    logger.info(f"[BC] Nuevas categorías: {current_categories}")
+                    logger.info("[BC] Nuevas categorías: {}", current_categories)
 
                     changes = {"businessCategory": current_categories}
-                    logger.info(f"[BC] Ejecutando modify_entry en {user_dn} con {changes}")
+                    logger.info("[BC] Ejecutando modify_entry en {} con {}", user_dn, changes)
                     self.ldap.modify_entry(user_dn, changes)
-                    logger.success(f"[BC] ✓ businessCategory actualizado exitosamente")
+                    logger.success("[BC] ✓ businessCategory actualizado exitosamente")
                 else:
-                    logger.info(f"[BC] Role '{role_name}' ya existe en businessCategory")
+                    logger.info("[BC] Role '{}' ya existe en businessCategory", role_name)
             except Exception as e:
-                logger.error(f"[BC] ✗ Error actualizando businessCategory: {e}")
+                logger.error("[BC] ✗ Error actualizando businessCategory: {}", e)
                 import traceback
-                logger.error(f"[BC] Traceback: {traceback.format_exc()}")
+                logger.error("[BC] Traceback: {}", traceback.format_exc())
     
     def _get_user_business_categories(self, user_dn: str) -> List[str]:
         try:
-            entries = self.ldap.search(user_dn, "(objectClass=*)", search_scope='BASE')
-            if entries and hasattr(entries[0], "businessCategory"):
-                return list(entries[0].businessCategory.values)
-            return []
+            raw_attributes = self.ldap.read_raw(user_dn, ["businessCategory"])
+            if raw_attributes is None:
+                return []
+            return UserRecord.from_raw(user_dn, raw_attributes).businessCategory
+        except LDAPServiceError:
+            raise
         except Exception as e:
-            logger.warning(f"Could not get businessCategory for {user_dn}: {e}")
+            logger.warning("Could not get businessCategory for {}: {}", user_dn, e)
             return []
 
 
-    def update_role_name(self, role_type: str, old_role_name: str, new_role_name: str, area: Optional[str] = None) -> bool:
+    def update_role_name(self, role_type: str, old_role_name: str, new_role_name: str, area: Optional[str] = None, job: Optional[JobContext] = None) -> bool:
+        job = job or JobContext.detached()
         try:
             old_group_dn = self._get_role_group_dn(role_type, old_role_name, area)
             new_group_dn = self._get_role_group_dn(role_type, new_role_name, area)
 
+            if job.stage == "group_created":
+                # Job retomado después de crear el grupo nuevo: solo falta borrar el viejo
+                if self.ldap.entry_exists(old_group_dn):
+                    self.ldap.delete_entry(old_group_dn)
+                return True
+
             if not self.ldap.entry_exists(old_group_dn):
                 raise Exception(f"Role group not found: {old_group_dn}")
             
             if self.ldap.entry_exists(new_group_dn):
                 raise Exception(f"A role with name '{new_role_name}' already exists.")
             
-            entries = self.ldap.search(base_dn=old_group_dn, search_filter="(objectClass=groupOfNames)", search_scope='BASE')
-            members = []
-            if entries and hasattr(entries[0], 'member'):
-                members = list(entries[0].member.values)
+            members = list(self.ldap.iter_group_members(old_group_dn))
+            job.set_total(len(members))
 
             if role_type == "role_local" and members:
-                logger.info(f"[UPDATE] Actualizando businessCategory de {len(members)} usuarios")
-                for user_dn in members:
-                    try:
-                        current_categories = self._get_user_business_categories(user_dn)
-                        if old_role_name in current_categories:
-                            current_categories.remove(old_role_name)
-                            current_categories.append(new_role_name)
-                            changes = {"businessCategory": current_categories}
-                            self.ldap.modify_entry(user_dn, changes)
-                            logger.info(f"[BC] Updated '{old_role_name}' to '{new_role_name}' in businessCategory of {user_dn}")
-                    except Exception as e:
-                        logger.error(f"[BC] Error updating businessCategory for {user_dn}: {e}")
+                logger.info("[UPDATE] Actualizando businessCategory de {} usuarios", len(members))
+                # Quitar el valor viejo y agregar el nuevo en un solo modify, sin leer la entrada:
+                # noSuchAttribute significa que el usuario no tenía el rol en businessCategory
+                rename = {"businessCategory": [(MODIFY_DELETE, [old_role_name]), (MODIFY_ADD, [new_role_name])]}
+                already_renamed = []
+                for result in self.ldap.batch_modify([(dn, rename) for dn in job.pending(members)], tolerate=("noSuchAttribute",)):
+                    if result["result"] == "attributeOrValueExists":
+                        # Ya tenía el valor nuevo: solo falta quitar el viejo
+                        already_renamed.append(result["dn"])
+                        continue
+                    self._mark_bc_result(job, result, f"Updated '{old_role_name}' to '{new_role_name}' in businessCategory")
+                if already_renamed:
+                    remove_old = {"businessCategory": [(MODIFY_DELETE, [old_role_name])]}
+                    for result in self.ldap.batch_modify([(dn, remove_old) for dn in already_renamed], tolerate=("noSuchAttribute",)):
+                        self._mark_bc_result(job, result, f"Updated '{old_role_name}' to '{new_role_name}' in businessCategory")
             
             new_cn = new_group_dn.split(',')[0].split('=')[1]
             attrs = {
@@ -187,30 +197,36 @@ class RoleService:
             }
 
             self.ldap.create_entry(new_group_dn, attrs)
+            job.set_stage("group_created")
             self.ldap.delete_entry(old_group_dn)
 
-            logger.success(f"[UPDATED] Role renamed from '{old_role_name}' to '{new_role_name}' successfully")
+            logger.success("[UPDATED] Role renamed from '{}' to '{}' successfully", old_role_name, new_role_name)
 
             return True
         except Exception as e:
-            logger.error(f"Error updating role name: {e}")
+            logger.error("Error updating role name: {}", e)
             raise
 
     
+    @staticmethod
+    def _mark_bc_result(job: JobContext, result: Dict[str, Any], action: str):
+        if result["success"]:
+            logger.info("[BC] {} of {}", action, result['dn'])
+            job.mark_done(result["dn"])
+        else:
+            logger.error("[BC] Error updating businessCategory for {}: {} {}", result['dn'], result['result'], result['message'])
+            job.mark_done(result["dn"], success=False)
+
     def _get_user_roles(self, user_dn: str, role_type: str) -> List[str]:
         try:
-            search_filter = "(objectClass=*)"
-            entries = self.ldap.search(base_dn=user_dn, search_filter=search_filter, search_scope=BASE)
-            if entries and hasattr(entries[0], role_type):
-                role_attr = getattr(entries[0], role_type)
-                if hasattr(role_attr, 'values'):
-                    return list(role_attr.values)
-                elif role_attr:
-                    return [str(role_attr)]
-            
-            return []
+            raw_attributes = self.ldap.read_raw(user_dn, [role_type])
+            if not raw_attributes:
+                return []
+            return [value.decode("utf-8") for value in raw_attributes.get(role_type) or []]
+        except LDAPServiceError:
+            raise
         except Exception as e:
-            logger.error(f"Error getting user roles for {user_dn}: {e}")
+            logger.error("Error getting user roles for {}: {}", user_dn, e)
             return []
         
     def get_user_roles(self, email: str) -> dict:
@@ -218,12 +234,11 @@ class RoleService:
         if not user_dn:
             return {"roles": []}
 
-        search_filter = f"(member={user_dn})"
-        entries = self.ldap.search(base_dn=f"ou=roles,{self.base_dn}", search_filter=search_filter)
+        search_filter = f"(member={escape_filter_chars(user_dn)})"
         roles = []
-        for entry in entries:
-            if hasattr(entry, "cn"):
-                roles.append(entry.cn.value)
+        for _, raw_attributes in self.ldap.search_raw(f"ou=roles,{self.base_dn}", search_filter, attributes=["cn"]):
+            if raw_attributes.get("cn"):
+                roles.append(raw_attributes["cn"][0].decode("utf-8"))
         return {"roles": roles}
 
 
@@ -233,21 +248,14 @@ class RoleService:
         if not user_dn:
             raise Exception(f"User not found: {email}")
         group_dn = self._get_role_group_dn(role_type, role_name, area)
-        entries = self.ldap.search(base_dn=group_dn, search_filter="(objectClass=groupOfNames)", search_scope='BASE')
         
-        if entries:
-            group_entry = entries[0]
-            members = set(group_entry.member.values) if hasattr(group_entry, 'member') else set()
-            logger.info(f"[REMOVE] Antes de eliminar: miembros en {group_dn}: {members}")
-
-            if user_dn in members:
-                if len(members) == 1:
+        if self.ldap.entry_exists(group_dn):
+            if self.ldap.is_group_member(group_dn, user_dn):
+                if self.ldap.count_group_members(group_dn, limit=2) == 1:
                     raise Exception("El grupo debe tener al menos un miembro activo. Si desea eliminar todos los miembros, considere eliminar el rol completo.")
                 
-                members.remove(user_dn)
-                logger.info(f"[REMOVE] Después de eliminar: miembros en {group_dn}: {members}")
                 self.ldap.remove_group_member(group_dn, user_dn)
-                logger.info(f"[REMOVE] Usuario {user_dn} removido de {group_dn}")
+                logger.info("[REMOVE] Usuario {} removido de {}", user_dn, group_dn)
 
                 if role_type == "role_local":
                     try:
@@ -256,18 +264,80 @@ class RoleService:
                             current_categories.remove(role_name)
                             changes = {"businessCategory": current_categories if current_categories else []}
                             self.ldap.modify_entry(user_dn, changes)
-                            logger.success(f"[BC] Removed '{role_name}' from businessCategory of {user_dn}")
+                            logger.success("[BC] Removed '{}' from businessCategory of {}", role_name, user_dn)
                     except Exception as e:
-                        logger.error(f"[BC] Error removing businessCategory: {e}")
+                        logger.error("[BC] Error removing businessCategory: {}", e)
 
                 return True
             else:
-                logger.warning(f"[REMOVE] Usuario {user_dn} no es miembro de {group_dn}")
+                logger.warning("[REMOVE] Usuario {} no es miembro de {}", user_dn, group_dn)
         else:
-            logger.warning(f"[REMOVE] Grupo no encontrado: {group_dn}")
+            logger.warning("[REMOVE] Grupo no encontrado: {}", group_dn)
         return False
 
     
+    def sync_role_members(self, sync: RoleMembershipSync, dry_run: bool = False) -> Dict[str, Any]:
+        """Lleva los miembros del grupo de rol al conjunto deseado aplicando solo las diferencias."""
+        group_dn = self._get_role_group_dn(sync.role_type, sync.role_name, sync.area)
+        desired, unresolved = self._find_user_dns(sync.users)
+        if not desired:
+            raise Exception("El grupo debe tener al menos un miembro activo. Si desea eliminar todos los miembros, considere eliminar el rol completo.")
+
+        group_exists = self.ldap.entry_exists(group_dn)
+        current = {}
+        if group_exists:
+            current = {dn.lower(): dn for dn in self.ldap.iter_group_members(group_dn)}
+
+        to_add = [dn for key, dn in desired.items() if key not in current]
+        to_remove = [dn for key, dn in current.items() if key not in desired]
+        logger.info("[SYNC] {}: +{} -{} ({} deseados)", group_dn, len(to_add), len(to_remove), len(desired))
+
+        if not dry_run:
+            if not group_exists:
+                cn = group_dn.split(',')[0].split('=')[1]
+                roles_ou_dn = f"ou=roles,{self.base_dn}"
+                if not self.ldap.entry_exists(roles_ou_dn):
+                    self.ldap.create_ou(roles_ou_dn)
+                self.ldap.create_entry(group_dn, {"objectClass": ["groupOfNames", "top"], "cn": cn, "member": to_add})
+            elif len(to_add) + len(to_remove) > len(desired):
+                # Si cambia casi todo, es más barato enviar la lista completa
+                self.ldap.replace_group_members(group_dn, list(desired.values()))
+            else:
+                self.ldap.modify_group_members(group_dn, to_add, to_remove)
+
+            if sync.role_type == "role_local":
+                add = {"businessCategory": [(MODIFY_ADD, [sync.role_name])]}
+                for result in self.ldap.batch_modify([(dn, add) for dn in to_add], tolerate=("attributeOrValueExists",)):
+                    if not result["success"]:
+                        logger.error("[SYNC][BC] Error adding '{}' to {}: {} {}", sync.role_name, result['dn'], result['result'], result['message'])
+                remove = {"businessCategory": [(MODIFY_DELETE, [sync.role_name])]}
+                for result in self.ldap.batch_modify([(dn, remove) for dn in to_remove], tolerate=("noSuchAttribute",)):
+                    if not result["success"]:
+                        logger.error("[SYNC][BC] Error removing '{}' from {}: {} {}", sync.role_name, result['dn'], result['result'], result['message'])
+
+        return {
+            "group_dn": group_dn,
+            "added": [email_from_dn(dn) for dn in to_add],
+            "removed": [email_from_dn(dn) for dn in to_remove],
+            "unchanged": len(desired) - len(to_add),
+            "unresolved": unresolved,
+            "dry_run": dry_run
+        }
+
+    def _find_user_dns(self, emails: List[str], batch_size: int = 100):
+        """Resuelve muchos emails a DN con búsquedas OR por lotes en lugar de una por usuario."""
+        found = {}
+        unique = list(dict.fromkeys(email.lower() for email in emails))
+        for i in range(0, len(unique), batch_size):
+            batch = unique[i:i + batch_size]
+            search_filter = "(|" + "".join(f"(uid={escape_filter_chars(email)})" for email in batch) + ")"
+            for dn, raw_attributes in self.ldap.search_raw(self.base_dn, search_filter, attributes=["uid"]):
+                email = UserRecord.from_raw(dn, raw_attributes).email or email_from_dn(dn)
+                found[email.lower()] = dn
+        desired = {dn.lower(): dn for dn in found.values()}
+        unresolved = [email for email in unique if email not in found]
+        return desired, unresolved
+
     def _get_role_group_dn(self, role_type: str, role_name:str, area: Optional[str] = None) -> str:
         role_name_norm = normalize_name(role_name)
         if role_type == "role_global":
@@ -297,38 +367,32 @@ class RoleService:
             self.ldap.create_entry(group_dn, attrs)
 
 
-    def delete_role_group(self, role_type: str, role_name: str, area: Optional[str] = None) -> bool:
+    def delete_role_group(self, role_type: str, role_name: str, area: Optional[str] = None, job: Optional[JobContext] = None) -> bool:
+        job = job or JobContext.detached()
         group_dn = self._get_role_group_dn(role_type, role_name, area)
         
         if self.ldap.entry_exists(group_dn):
 
             if role_type == "role_local":
                 try:
-                    entries = self.ldap.search(base_dn=group_dn, search_filter="(objectClass=groupOfNames)", search_scope='BASE')
-                    if entries and hasattr(entries[0], 'member'):
-                        members = entries[0].member.values
-                        logger.info(f"[DELETE] Eliminando businessCategory '{role_name}' de {len(members)} usuarios")
+                    members = list(self.ldap.iter_group_members(group_dn))
+                    if members:
+                        job.set_total(len(members))
+                        logger.info("[DELETE] Eliminando businessCategory '{}' de {} usuarios", role_name, len(members))
                         
-                        for user_dn in members:
-                            try:
-                                current_categories = self._get_user_business_categories(user_dn)
-                                if role_name in current_categories:
-                                    current_categories.remove(role_name)
-                                    changes = {"businessCategory": current_categories if current_categories else []}
-                                    self.ldap.modify_entry(user_dn, changes)
-                                    logger.info(f"[BC] Removed '{role_name}' from {user_dn}")
-                            except Exception as e:
-                                logger.error(f"[BC] Error removing businessCategory from {user_dn}: {e}")
+                        remove = {"businessCategory": [(MODIFY_DELETE, [role_name])]}
+                        for result in self.ldap.batch_modify([(dn, remove) for dn in job.pending(members)], tolerate=("noSuchAttribute",)):
+                            self._mark_bc_result(job, result, f"Removed '{role_name}' from businessCategory")
                 except Exception as e:
-                    logger.error(f"[DELETE] Error processing businessCategory cleanup: {e}")
+                    logger.error("[DELETE] Error processing businessCategory cleanup: {}", e)
 
 
             self.ldap.delete_entry(group_dn)
-            logger.info(f"Role group deleted: {group_dn}")
+            logger.info("Role group deleted: {}", group_dn)
             return True
         
         else:
-            logger.warning(f"Role group not found for deletion: {group_dn}")
+            logger.warning("Role group not found for deletion: {}", group_dn)
             return False
 
 
@@ -336,7 +400,6 @@ class RoleService:
 
 
 
-
 def normalize_name(name: str) -> str:
     replacements = {
         'á': 'a', 'é': 'e', 'í': 'i', 'ó': 'o', 'ú': 'u',
@@ -0,0 +1,327 @@
+import bisect
+import heapq
+import threading
+import time
+import unicodedata
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from loguru import logger
+from app.config import settings
+from app.ldap_client import LDAPClient
+from app.models.user_record import email_from_dn
+
+
+SEARCH_FIELDS = ("name", "first_name", "last_name", "mail", "employee_number")
+
+# Límite superior del rango de un prefijo en la lista ordenada
+_MAX_CHAR = chr(0x10FFFF)
+
+# Los cambios se acumulan fuera de la lista ordenada principal y se fusionan con
+# ella al llegar a max(COMPACT_MIN_CHANGES, len(lista) // COMPACT_RATIO)
+COMPACT_MIN_CHANGES = 1024
+COMPACT_RATIO = 64
+
+
+class IndexedUser:
+    __slots__ = ("email", "dn", "area", "department", "tokens") + SEARCH_FIELDS
+
+    def __init__(self, email: str, dn: str, area: str, department: str,
+                 name: str = "", first_name: str = "", last_name: str = "", mail: str = "", employee_number: str = ""):
+        self.email = email
+        self.dn = dn
+        self.area = area
+        self.department = department
+        self.name = name
+        self.first_name = first_name
+        self.last_name = last_name
+        self.mail = mail
+        self.employee_number = employee_number
+        self.tokens = _search_tokens(self)
+
+    def to_dict(self) -> Dict[str, str]:
+        return {
+            "email": self.email,
+            "name": self.name or f"{self.first_name} {self.last_name}".strip(),
+            "firstName": self.first_name,
+            "lastName": self.last_name,
+            "id": self.employee_number,
+            "dn": self.dn,
+            "area": self.area,
+            "department": self.department,
+        }
+
+
+def _key(value: Optional[str]) -> str:
+    return (value or "").strip().lower()
+
+
+def _fold(value: Optional[str]) -> str:
+    # Minúsculas y sin tildes: "José Peña" -> "jose pena"
+    decomposed = unicodedata.normalize("NFKD", (value or "").strip().lower())
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+def _search_tokens(user: "IndexedUser") -> frozenset:
+    """Cadenas por las que se puede encontrar al usuario escribiendo su comienzo."""
+    tokens = set()
+    for value in (user.name, user.first_name, user.last_name):
+        folded = _fold(value)
+        if folded:
+            tokens.add(folded)
+            tokens.update(folded.split())
+    for value in (user.email, user.mail, user.employee_number):
+        folded = _fold(value)
+        if folded:
+            tokens.add(folded)
+    return frozenset(tokens)
+
+
+def _decode(raw: dict, attribute: str) -> str:
+    return raw[attribute][0].decode("utf-8") if raw.get(attribute) else ""
+
+
+class UserDirectoryIndex:
+    """Índice email -> (dn, área, departamento) y sus inversos área -> emails y departamento -> emails.
+
+    Incluye además un índice de prefijos para la búsqueda mientras se escribe:
+    una lista ordenada de (token, email) sobre cn, givenName, sn, mail y
+    employeeNumber, consultada con bisect. Las actualizaciones no la tocan:
+    los tokens nuevos van a una lista chica aparte y los viejos quedan hasta
+    la próxima compactación (search los descarta al verificar el usuario).
+
+    Se alimenta de las lecturas y escrituras de UserService y se reconcilia con
+    una búsqueda paginada completa cada USER_INDEX_REFRESH_SECONDS. Los cambios
+    que llegan mientras se reconstruye se vuelven a aplicar sobre el índice nuevo.
+    """
+
+    def __init__(self, refresh_seconds: float):
+        self.base_dn = settings.BASE_DN
+        self.refresh_seconds = refresh_seconds
+        self._users: Dict[str, IndexedUser] = {}
+        self._by_area: Dict[str, Set[str]] = {}
+        self._by_department: Dict[str, Set[str]] = {}
+        self._prefixes: List[Tuple[str, str]] = []
+        self._added: List[Tuple[str, str]] = []
+        self._stale = 0
+        self._lock = threading.RLock()
+        self._build_lock = threading.Lock()
+        self._loaded = threading.Event()
+        self._pending: Optional[List[Tuple[str, Optional[IndexedUser]]]] = None
+        self._thread: Optional[threading.Thread] = None
+        self.built_at: Optional[float] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded.is_set()
+
+    def start(self):
+        if self._thread is not None or self.refresh_seconds <= 0:
+            return
+        self._thread = threading.Thread(target=self._run, name="user-directory-index", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.rebuild()
+            except Exception as e:
+                logger.error(f"[USER_INDEX] Error rebuilding user index: {e}")
+            time.sleep(self.refresh_seconds)
+
+    def ensure_loaded(self):
+        if not self._loaded.is_set():
+            self.rebuild(only_if_missing=True)
+
+    def rebuild(self, only_if_missing: bool = False):
+        with self._build_lock:
+            if only_if_missing and self._loaded.is_set():
+                return
+            started = time.monotonic()
+            with self._lock:
+                self._pending = []
+            users: Dict[str, IndexedUser] = {}
+            # Conexión propia: la reconciliación recorre todo ou=users
+            ldap = LDAPClient()
+            try:
+                users_dn = f"ou=users,{self.base_dn}"
+                if ldap.entry_exists(users_dn):
+                    attributes = ["uid", "physicalDeliveryOfficeName", "departmentNumber", "cn", "givenName", "sn", "mail", "employeeNumber"]
+                    for item in ldap.paged_search(users_dn, "(uid=*)", attributes=attributes):
+                        raw = item["raw_attributes"]
+                        email = _decode(raw, "uid") or email_from_dn(item["dn"])
+                        users[_key(email)] = IndexedUser(
+                            email, item["dn"], _decode(raw, "physicalDeliveryOfficeName"), _decode(raw, "departmentNumber"),
+                            name=_decode(raw, "cn"), first_name=_decode(raw, "givenName"), last_name=_decode(raw, "sn"),
+                            mail=_decode(raw, "mail"), employee_number=_decode(raw, "employeeNumber")
+                        )
+            except Exception:
+                with self._lock:
+                    self._pending = None
+                raise
+            finally:
+                ldap.close()
+
+            with self._lock:
+                pending, self._pending = self._pending, None
+                self._users = {}
+                self._by_area = {}
+                self._by_department = {}
+                self._prefixes = []
+                self._added = []
+                self._stale = 0
+                for user in users.values():
+                    self._add(user, ())
+                    self._prefixes.extend((token, _key(user.email)) for token in user.tokens)
+                # Se ordena una sola vez en lugar de insertar cada token en su posición
+                self._prefixes.sort()
+                for email, user in pending:
+                    self._apply(email, user)
+            self.built_at = time.time()
+            self._loaded.set()
+            logger.info(f"[USER_INDEX] User index built: {len(users)} users in {time.monotonic() - started:.2f}s")
+
+    # --- actualizaciones ----------------------------------------------
+
+    def record(self, email: str, dn: str, area: Optional[str], department: Optional[str], **search_fields: Optional[str]):
+        """Indexa el usuario; los campos de búsqueda no recibidos conservan el valor ya indexado."""
+        with self._lock:
+            current = self._users.get(_key(email))
+            fields = {
+                field: search_fields[field] if search_fields.get(field) is not None else (getattr(current, field) if current else "")
+                for field in SEARCH_FIELDS
+            }
+            # Cada GET sin caché y cada login pasan por acá: sin cambios no se toca el índice
+            if (
+                current is not None and current.email == email and current.dn == dn
+                and current.area == (area or "") and current.department == (department or "")
+                and all(getattr(current, field) == value for field, value in fields.items())
+            ):
+                return
+            self._update(email, IndexedUser(email, dn, area or "", department or "", **fields))
+
+    def record_changes(self, email: str, dn: str, area: Optional[str] = None, department: Optional[str] = None, **search_fields: Optional[str]):
+        """Actualiza solo los campos recibidos; si el usuario no está indexado se espera a la reconciliación."""
+        with self._lock:
+            current = self._users.get(_key(email))
+            if current is None:
+                return
+            self.record(
+                current.email, dn,
+                current.area if area is None else area,
+                current.department if department is None else department,
+                **search_fields
+            )
+
+    def remove(self, email: str):
+        self._update(email, None)
+
+    def _update(self, email: str, user: Optional[IndexedUser]):
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((email, user))
+            self._apply(email, user)
+
+    def _apply(self, email: str, user: Optional[IndexedUser]):
+        previous = self._users.pop(_key(email), None)
+        previous_tokens = frozenset()
+        if previous is not None:
+            self._discard(self._by_area, previous.area, previous.email)
+            self._discard(self._by_department, previous.department, previous.email)
+            previous_tokens = previous.tokens
+            self._stale += len(previous.tokens - (user.tokens if user is not None else frozenset()))
+        if user is not None:
+            self._add(user, user.tokens - previous_tokens)
+        if len(self._added) + self._stale >= max(COMPACT_MIN_CHANGES, len(self._prefixes) // COMPACT_RATIO):
+            self._compact()
+
+    def _add(self, user: IndexedUser, new_tokens: Iterable[str]):
+        self._users[_key(user.email)] = user
+        if user.area:
+            self._by_area.setdefault(_key(user.area), set()).add(user.email)
+        if user.department:
+            self._by_department.setdefault(_key(user.department), set()).add(user.email)
+        for token in new_tokens:
+            bisect.insort(self._added, (token, _key(user.email)))
+
+    def _compact(self):
+        # Una pasada lineal: fusiona las dos listas ordenadas y descarta tokens viejos y repetidos
+        merged: List[Tuple[str, str]] = []
+        for entry in heapq.merge(self._prefixes, self._added):
+            user = self._users.get(entry[1])
+            if user is not None and entry[0] in user.tokens and (not merged or merged[-1] != entry):
+                merged.append(entry)
+        self._prefixes, self._added, self._stale = merged, [], 0
+
+    @staticmethod
+    def _discard(index: Dict[str, Set[str]], value: str, email: str):
+        members = index.get(_key(value))
+        if members is not None:
+            members.discard(email)
+            if not members:
+                del index[_key(value)]
+
+    # --- consultas ----------------------------------------------------
+
+    def lookup(self, email: str) -> Optional[IndexedUser]:
+        with self._lock:
+            return self._users.get(_key(email))
+
+    def lookup_many(self, emails: Iterable[str]) -> Dict[str, IndexedUser]:
+        with self._lock:
+            return {email: self._users[_key(email)] for email in emails if _key(email) in self._users}
+
+    def users_in_area(self, area: str, offset: int = 0, limit: int = 100) -> Tuple[int, List[IndexedUser]]:
+        return self._page(self._by_area, area, offset, limit)
+
+    def users_in_department(self, department: str, offset: int = 0, limit: int = 100) -> Tuple[int, List[IndexedUser]]:
+        return self._page(self._by_department, department, offset, limit)
+
+    def search(self, query: str, limit: int = 10) -> List[IndexedUser]:
+        """Usuarios con algún token que empieza por cada palabra de `query`, en orden alfabético del token.
+
+        Recorre solo el rango de la palabra con menos coincidencias y corta al
+        reunir `limit` resultados.
+        """
+        words = set(_fold(query).split())
+        if not words or limit <= 0:
+            return []
+        self.ensure_loaded()
+        results: List[IndexedUser] = []
+        seen: Set[str] = set()
+        with self._lock:
+            ranges = {word: [_prefix_range(entries, word) for entries in (self._prefixes, self._added)] for word in words}
+            first = min(words, key=lambda word: sum(end - start for start, end in ranges[word]))
+            others = [word for word in words if word != first]
+            entries = heapq.merge(*(
+                _iter_range(source, start, end)
+                for source, (start, end) in zip((self._prefixes, self._added), ranges[first])
+            ))
+            for token, key in entries:
+                user = self._users.get(key)
+                # Entradas de usuarios borrados o de valores anteriores, pendientes de compactar
+                if user is None or token not in user.tokens or key in seen:
+                    continue
+                seen.add(key)
+                if others and not all(any(t.startswith(word) for t in user.tokens) for word in others):
+                    continue
+                results.append(user)
+                if len(results) >= limit:
+                    break
+        return results
+
+    def _page(self, index: Dict[str, Set[str]], value: str, offset: int, limit: int) -> Tuple[int, List[IndexedUser]]:
+        self.ensure_loaded()
+        with self._lock:
+            emails = sorted(index.get(_key(value), ()))
+            return len(emails), [self._users[_key(email)] for email in emails[offset:offset + limit]]
+
+
+def _prefix_range(entries: List[Tuple[str, str]], word: str) -> Tuple[int, int]:
+    return bisect.bisect_left(entries, (word,)), bisect.bisect_left(entries, (word + _MAX_CHAR,))
+
+
+def _iter_range(entries: List[Tuple[str, str]], start: int, end: int) -> Iterator[Tuple[str, str]]:
+    for i in range(start, end):
+        yield entries[i]
+
+
+user_directory_index = UserDirectoryIndex(settings.USER_INDEX_REFRESH_SECONDS)
@@ -1,8 +1,36 @@
 from app.models.user import User
 from app.ldap_client import LDAPClient
+from app.exceptions import LDAPServiceError
 from loguru import logger
-from typing import Optional, Dict, Any
+import json
+from typing import Optional, Dict, Any, List, Tuple
 from app.config import settings
+from ldap3.utils.conv import escape_filter_chars
+from app.models.user_record import (
+    USER_ATTRIBUTES,
+    USER_FIELD_MAPPING,
+    USER_OBJECT_CLASSES,
+    USER_READ_ATTRIBUTES,
+    USER_VERSION_ATTRIBUTES,
+    UserRecord,
+    encode_user_attribute,
+    entry_version
+)
+from app.services.user_index_service import user_directory_index
+from app.utils.cache import directory_cache
+from app.utils.etag import make_etag, user_validators
+from app.utils.log import sampled
+
+
+def _values_differ(current: Any, desired: Any) -> bool:
+    if isinstance(current, bool) or isinstance(desired, bool):
+        return current != desired
+
+    def normalize(value):
+        values = value if isinstance(value, (list, tuple)) else [value]
+        return sorted(str(v) for v in values if v not in ("", None))
+
+    return normalize(current) != normalize(desired)
 
 
 class UserService:
@@ -27,39 +55,26 @@ class UserService:
 
 
     def build_user_attrs(self, user: User) -> dict:
-        attrs = {
-            "objectClass": ["inetOrgPerson", "organizationalPerson", "person", "top"],
-            "uid": user.email,
-            "cn": f"{user.firstName} {user.lastName}",
-            "givenName": user.firstName,
-            "sn": user.lastName,
-            "mail": user.email,
-            "employeeNumber": user.id,
-        }
-        if hasattr(user, 'active'):
-            attrs["description"] = "ACTIVE" if user.active else "INACTIVE"
-        if user.address:
-            attrs["postalAddress"] = user.address
-        if user.department:
-            attrs["departmentNumber"] = user.department
-        if user.area:
-            attrs["physicalDeliveryOfficeName"] = user.area
-        if user.position:
-            attrs["title"] = user.position
-        if user.phone:
-            attrs["telephoneNumber"] = user.phone
-        if user.imageUrl and user.imageUrl.startswith(("http://", "https://")):
-            attrs["labeledURI"] = user.imageUrl
-        if user.password:
-            attrs["userPassword"] = user.password
-        
+        attrs = {"objectClass": list(USER_OBJECT_CLASSES)}
+        for attr in USER_ATTRIBUTES:
+            value = getattr(user, attr.field, None)
+            if attr.field == "imageUrl" and value and not value.startswith(("http://", "https://")):
+                continue
+            if value is None:
+                continue
+            value = encode_user_attribute(attr, value)
+            if value not in ("", []):
+                attrs[attr.ldap] = value
+
+        attrs["cn"] = f"{user.firstName} {user.lastName}"
+        attrs["mail"] = user.email
         return attrs
     
 
     def create_user(self, user: User) -> str:
 
         try:
-            logger.info(f"Creating user: {user.email}")
+            logger.info("Creating user: {}", user.email)
             users_dn = self.ensure_ou("users", self.base_dn)
             country_dn = self.ensure_ou(user.country, users_dn)
             province_dn = self.ensure_ou(user.province, country_dn)
@@ -72,114 +87,164 @@ class UserService:
                 raise Exception(f"User already exists: {user_dn}")
             
             self.ldap.create_entry(user_dn, attrs)
-            logger.success(f"User created successfully: {user.email}")
+            user_directory_index.record(
+                user.email, user_dn, user.area, user.department,
+                name=attrs["cn"], first_name=user.firstName, last_name=user.lastName, mail=user.email, employee_number=user.id
+            )
+            logger.success("User created successfully: {}", user.email)
             return user_dn
 
         except Exception as e:
-            logger.error(f"Error creating user {user.email}: {e}")
+            logger.error("Error creating user {}: {}", user.email, e)
             raise
 
     
     def get_user(self, email: str) -> Optional[Dict[str, Any]]:
+        return self.get_user_with_etag(email)[0]
+
+    def get_user_with_etag(self, email: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
         try:
-            logger.info(f"Getting user: {email}")
-            
-            search_filter = f"(uid={email})"
-            entries = self.ldap.search(base_dn=self.base_dn, search_filter=search_filter)
-            
-            if entries:
-                user_entry = entries[0]
-                description = user_entry.description.value if hasattr(user_entry, 'description') else "ACTIVE"
-                is_active = description == "ACTIVE"
-                user_data = {
-                    "email": user_entry.uid.value if hasattr(user_entry, 'uid') else email,
-                    "firstName": user_entry.givenName.value if hasattr(user_entry, 'givenName') else "",
-                    "lastName": user_entry.sn.value if hasattr(user_entry, 'sn') else "",
-                    "id": user_entry.employeeNumber.value if hasattr(user_entry, 'employeeNumber') else "",
-                    "active": is_active,
-                    "address": user_entry.postalAddress.value if hasattr(user_entry, 'postalAddress') else "",
-                    "department": user_entry.departmentNumber.value if hasattr(user_entry, 'departmentNumber') else "",
-                    "area": user_entry.physicalDeliveryOfficeName.value if hasattr(user_entry, 'physicalDeliveryOfficeName') else "",
-                    "position": user_entry.title.value if hasattr(user_entry, 'title') else "",
-                    "phone": user_entry.telephoneNumber.values if hasattr(user_entry, 'telephoneNumber') else [],
-                    "imageUrl": user_entry.labeledURI.value if hasattr(user_entry, 'labeledURI') else "",
-                    "dn": user_entry.entry_dn
-                }
-                logger.success(f"User found: {email}")
-                return user_data
+            sampled.info("Getting user: {}", email)
+
+            cached = directory_cache.get_or_load("user", email.lower(), lambda: self._load_user(email))
+            if cached:
+                user_data, etag = cached
+                sampled.info("User found: {}", email)
+                return user_data, etag
             
-            logger.warning(f"User not found: {email}")
-            return None
+            logger.warning("User not found: {}", email)
+            return None, None
             
         except Exception as e:
-            logger.error(f"Error getting user {email}: {e}")
+            logger.error("Error getting user {}: {}", email, e)
             raise
 
+    def _load_user(self, email: str) -> Optional[List[Any]]:
+        search_filter = f"(uid={escape_filter_chars(email)})"
+        attributes = USER_READ_ATTRIBUTES + USER_VERSION_ATTRIBUTES
+        results = self.ldap.search_raw(self.base_dn, search_filter, attributes=attributes, size_limit=1)
+        if not results:
+            return None
 
-    def update_user(self, email: str, user_data: Dict[str, Any]) -> str:
-            try:
-                logger.info(f"Updating user: {email}")
-                existing_user = self.get_user(email)
-                if not existing_user:
-                    raise Exception(f"User not found: {email}")
-                
-                user_dn = existing_user["dn"]
-                ldap_changes = {}
-                field_mapping = {
-                    "firstName": "givenName",
-                    "lastName": "sn", 
-                    "address": "postalAddress",
-                    "department": "departmentNumber",
-                    "area": "physicalDeliveryOfficeName",
-                    "position": "title",
-                    "phone": "telephoneNumber",
-                    "imageUrl": "labeledURI",
-                    "password": "userPassword",
-                    "active": "description"
-                }
-                
-                for field, ldap_attr in field_mapping.items():
-                    if field in user_data and user_data[field] is not None:  
-                        if field == "active":
-                            ldap_changes[ldap_attr] = "ACTIVE" if user_data[field] else "INACTIVE"
-                        else:
-                            ldap_changes[ldap_attr] = user_data[field]
-                
-                if "firstName" in user_data or "lastName" in user_data:
-                    first_name = user_data.get("firstName", existing_user["firstName"])
-                    last_name = user_data.get("lastName", existing_user["lastName"])
-                    ldap_changes["cn"] = f"{first_name} {last_name}"
-                
-                if ldap_changes:
-                    self.ldap.modify_entry(user_dn, ldap_changes)
-                    logger.success(f"User updated successfully: {email}")
-                else:
-                    logger.info(f"No changes to apply for user: {email}")
-                
-                return user_dn
-                
-            except Exception as e:
-                logger.error(f"Error updating user {email}: {e}")
-                raise
+        dn, raw_attributes = results[0]
+        user_data = UserRecord.from_raw(dn, raw_attributes).to_dict()
+        user_directory_index.record(
+            user_data["email"] or email, dn, user_data["area"], user_data["department"],
+            first_name=user_data["firstName"], last_name=user_data["lastName"], employee_number=user_data["id"]
+        )
+        version = entry_version(raw_attributes)
+        if version:
+            etag = make_etag(dn, version)
+            user_validators.put(email.lower(), dn, version, etag)
+        else:
+            # Sin entryCSN/modifyTimestamp el ETag sale del contenido y no se cachea
+            etag = make_etag(dn, json.dumps(user_data, sort_keys=True))
+        # Lista y no tupla: el valor tiene que sobrevivir a la serialización JSON de la caché compartida
+        return [user_data, etag]
+
+    def current_etag(self, email: str) -> Optional[str]:
+        """ETag cacheado si la entrada no cambió desde entonces (solo lee entryCSN/modifyTimestamp)."""
+        cached = user_validators.get(email.lower())
+        if cached is None:
+            return None
+        dn, version, etag = cached
+        try:
+            raw_attributes = self.ldap.read_raw(dn, USER_VERSION_ATTRIBUTES)
+        except Exception as e:
+            logger.warning("Error validating cached ETag for {}: {}", email, e)
+            return None
+        if raw_attributes is not None and entry_version(raw_attributes) == version:
+            return etag
+        # La entrada cambió (o ya no existe): el [user_data, etag] cacheado tampoco sirve,
+        # si no get_user_with_etag lo devolvería y el cliente recibiría un 304 obsoleto
+        user_validators.discard(email.lower())
+        directory_cache.invalidate("user", email.lower())
+        if raw_attributes is None:
+            directory_cache.invalidate("dn", email.lower())
+        return None
+
+
+    def update_user(self, email: str, user_data: Dict[str, Any], user_dn: Optional[str] = None) -> Dict[str, Any]:
+        try:
+            logger.info("Updating user: {}", email)
+            if not user_dn:
+                user_dn = directory_cache.get_or_load(
+                    "dn", email.lower(),
+                    lambda: self.ldap.find_dn(self.base_dn, f"(uid={escape_filter_chars(email)})")
+                )
+            if not user_dn:
+                raise Exception(f"User not found: {email}")
+
+            desired = {
+                field: user_data[field] for field in USER_FIELD_MAPPING
+                if field in user_data and user_data[field] is not None
+            }
+            # userPassword no se lee: si viene en el request siempre se escribe
+            read_attrs = {USER_FIELD_MAPPING[field] for field in desired if field != "password"}
+            renaming = "firstName" in desired or "lastName" in desired
+            if renaming:
+                read_attrs.update({"givenName", "sn"})
+            raw_attributes = self.ldap.read_raw(user_dn, sorted(read_attrs))
+            if raw_attributes is None:
+                raise Exception(f"User not found: {email}")
+            current = UserRecord.from_raw(user_dn, raw_attributes)
+
+            changed_fields = [
+                field for field, value in desired.items()
+                if field == "password" or _values_differ(getattr(current, field), value)
+            ]
+            attributes_by_field = {attr.field: attr for attr in USER_ATTRIBUTES}
+            ldap_changes = {
+                USER_FIELD_MAPPING[field]: encode_user_attribute(attributes_by_field[field], desired[field])
+                for field in changed_fields
+            }
+            if renaming and ("firstName" in changed_fields or "lastName" in changed_fields):
+                first_name = desired.get("firstName", current.firstName)
+                last_name = desired.get("lastName", current.lastName)
+                ldap_changes["cn"] = f"{first_name} {last_name}"
+
+            if ldap_changes:
+                self.ldap.modify_entry(user_dn, ldap_changes)
+                if {"area", "department"} & set(changed_fields) or "cn" in ldap_changes:
+                    user_directory_index.record_changes(
+                        email, user_dn,
+                        area=desired["area"] if "area" in changed_fields else None,
+                        department=desired["department"] if "department" in changed_fields else None,
+                        name=ldap_changes.get("cn"),
+                        first_name=desired["firstName"] if "firstName" in changed_fields else None,
+                        last_name=desired["lastName"] if "lastName" in changed_fields else None
+                    )
+                logger.success("User updated successfully: {} ({})", email, ', '.join(changed_fields))
+            else:
+                logger.info("No changes to apply for user: {}", email)
+
+            return {"dn": user_dn, "changed_fields": changed_fields}
+
+        except Exception as e:
+            logger.error("Error updating user {}: {}", email, e)
+            raise
 
 
     def delete_user(self, email: str) -> bool:
         try:
-            logger.info(f"Soft deleting user: {email}")
+            logger.info("Soft deleting user: {}", email)
             
             soft_delete_data = {"active": False}
-            self.update_user(email, soft_delete_data)
-            
-            logger.success(f"User soft deleted successfully: {email}")
+            result = self.update_user(email, soft_delete_data)
+
+            if result["changed_fields"]:
+                logger.success("User soft deleted successfully: {}", email)
+            else:
+                logger.info("User already inactive: {}", email)
             return True
             
         except Exception as e:
-            logger.error(f"Error soft deleting user {email}: {e}")
+            logger.error("Error soft deleting user {}: {}", email, e)
             raise
 
     def hard_delete_user(self, email: str) -> bool:
         try:
-            logger.info(f"Hard deleting user: {email}")
+            logger.info("Hard deleting user: {}", email)
             existing_user = self.get_user(email)
             if not existing_user:
                 raise Exception(f"User not found: {email}")
@@ -187,53 +252,59 @@ class UserService:
             user_dn = existing_user["dn"]
             
             self.ldap.delete_entry(user_dn)
-            logger.success(f"User hard deleted successfully: {email}")
+            user_directory_index.remove(email)
+            logger.success("User hard deleted successfully: {}", email)
             
             return True
         except Exception as e:
-            logger.error(f"Error hard deleting user {email}: {e}")
+            logger.error("Error hard deleting user {}: {}", email, e)
             raise
 
     def reactivate_user(self, email: str) -> bool:
 
         try:
-            logger.info(f"Reactivating user: {email}")
+            logger.info("Reactivating user: {}", email)
             
             reactivate_data = {"active": True}
-            self.update_user(email, reactivate_data)
-            
-            logger.success(f"User reactivated successfully: {email}")
+            result = self.update_user(email, reactivate_data)
+
+            if result["changed_fields"]:
+                logger.success("User reactivated successfully: {}", email)
+            else:
+                logger.info("User already active: {}", email)
             return True
         
         except Exception as e:
-            logger.error(f"Error reactivating user {email}: {e}")
+            logger.error("Error reactivating user {}: {}", email, e)
             raise
     
     def authenticate_user(self, email: str, password: str) -> Dict[str, Any]:
         try:
-            logger.info(f"Authenticating user: {email}")
+            sampled.info("Authenticating user: {}", email)
             
             user_data = self.get_user(email)
             if not user_data:
-                logger.warning(f"User not found for authentication: {email}")
+                logger.warning("User not found for authentication: {}", email)
                 return {"success": False, "message": "User not found"}
             
             user_dn = user_data["dn"]
             is_authenticated = self.ldap.bind_as_user(user_dn, password)
             
             if is_authenticated:
-                logger.success(f"Authentication successful for: {email}")
+                logger.success("Authentication successful for: {}", email)
                 return {
                     "success": True, 
                     "message": "Authentication successful",
                     "user": user_data
                 }
             else:
-                logger.warning(f"Authentication failed for: {email}")
+                logger.warning("Authentication failed for: {}", email)
                 return {"success": False, "message": "Invalid credentials"}
                 
+        except LDAPServiceError:
+            raise
         except Exception as e:
-            logger.error(f"Error authenticating user {email}: {e}")
+            logger.error("Error authenticating user {}: {}", email, e)
             return {"success": False, "message": "Authentication error"}
 
 
@@ -0,0 +1,160 @@
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+from loguru import logger
+from app.config import settings
+from app.utils.log import redact
+from app.utils.request_context import actor_var, request_id_var
+
+
+def _summarize(value: Any, max_values: int) -> Any:
+    # Un replace de miembros puede traer miles de DNs: se guarda una muestra y el total
+    if isinstance(value, dict):
+        return {k: _summarize(v, max_values) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        if len(value) > max_values:
+            return [_summarize(v, max_values) for v in value[:max_values]] + [f"... (+{len(value) - max_values} more)"]
+        return [_summarize(v, max_values) for v in value]
+    if isinstance(value, bytes):
+        return value.decode("utf-8", errors="replace")
+    return value
+
+
+class AuditWriter:
+    """Registro de auditoría de las escrituras en el directorio, en JSON-lines.
+
+    record() solo encola el evento (con actor e ID de request del contexto
+    actual); un hilo propio lo escribe por lotes en AUDIT_FILE y rota el
+    archivo al superar AUDIT_MAX_BYTES. Si la cola se llena, el request espera
+    como mucho AUDIT_BLOCK_SECONDS y el evento se descarta; los descartes
+    quedan registrados como un evento audit.dropped en el siguiente lote.
+    """
+
+    def __init__(self, file_path: str, max_bytes: int, backups: int, queue_size: int,
+                 batch_size: int, flush_seconds: float, block_seconds: float, max_values: int):
+        # {pid} permite un archivo por worker, así cada proceso rota el suyo
+        self.file_path = file_path.replace("{pid}", str(os.getpid())) if file_path else ""
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.block_seconds = block_seconds
+        self.max_values = max_values
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=queue_size)
+        self._dropped = 0
+        self._dropped_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.file_path)
+
+    def start(self):
+        if not self.enabled or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """Escribe lo que quede en la cola y detiene el hilo."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def record(self, event: Dict[str, Any]):
+        if not self.enabled:
+            return
+        entry = {
+            "ts": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+            "request_id": request_id_var.get(),
+            "actor": actor_var.get(),
+            **event,
+        }
+        if "changes" in entry:
+            entry["changes"] = _summarize(redact(entry["changes"]), self.max_values)
+        try:
+            self._queue.put(entry, timeout=self.block_seconds)
+        except queue.Full:
+            with self._dropped_lock:
+                self._dropped += 1
+                dropped = self._dropped
+            if dropped == 1 or dropped % 1000 == 0:
+                logger.warning("[AUDIT] Audit queue full, {} events dropped", dropped)
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            with self._dropped_lock:
+                dropped, self._dropped = self._dropped, 0
+            if dropped:
+                batch.append({
+                    "ts": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+                    "operation": "audit.dropped",
+                    "count": dropped,
+                })
+            if batch:
+                try:
+                    self._write(batch)
+                except Exception as e:
+                    logger.error("[AUDIT] Error writing {} audit events: {}", len(batch), e)
+            if self._stop.is_set() and self._queue.empty():
+                return
+
+    def _next_batch(self) -> List[Dict[str, Any]]:
+        # Espera el primer evento y junta los que lleguen hasta completar el lote o el intervalo
+        try:
+            batch = [self._queue.get(timeout=self.flush_seconds)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_seconds
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch: List[Dict[str, Any]]):
+        data = "".join(json.dumps(entry, separators=(",", ":"), default=str) + "\n" for entry in batch).encode("utf-8")
+        if self.max_bytes > 0 and os.path.exists(self.file_path) and os.path.getsize(self.file_path) + len(data) > self.max_bytes:
+            self._rotate()
+        # Solo se agrega al final: una única escritura por lote
+        with open(self.file_path, "ab") as handle:
+            handle.write(data)
+            handle.flush()
+            os.fsync(handle.fileno())
+
+    def _rotate(self):
+        # audit.jsonl -> audit.jsonl.1 -> ... -> audit.jsonl.N (el más viejo se descarta)
+        if self.backups <= 0:
+            os.remove(self.file_path)
+            return
+        for i in range(self.backups - 1, 0, -1):
+            source = f"{self.file_path}.{i}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.file_path}.{i + 1}")
+        os.replace(self.file_path, f"{self.file_path}.1")
+        logger.info("[AUDIT] Rotated audit file {}", self.file_path)
+
+
+audit_writer = AuditWriter(
+    settings.AUDIT_FILE,
+    max_bytes=settings.AUDIT_MAX_BYTES,
+    backups=settings.AUDIT_BACKUPS,
+    queue_size=settings.AUDIT_QUEUE_SIZE,
+    batch_size=settings.AUDIT_BATCH_SIZE,
+    flush_seconds=settings.AUDIT_FLUSH_SECONDS,
+    block_seconds=settings.AUDIT_BLOCK_SECONDS,
+    max_values=settings.AUDIT_MAX_VALUES,
+)
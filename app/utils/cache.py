@@ -0,0 +1,267 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, List, Optional, Tuple
+from loguru import logger
+from app.config import settings
+from app.models.user_record import email_from_dn
+
+_MISSING = object()
+
+
+class MemoryCacheBackend:
+    """LRU con TTL dentro del proceso."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return _MISSING
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return _MISSING
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: str, value: Any, ttl: float):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def delete_prefix(self, prefix: str):
+        with self._lock:
+            for key in [key for key in self._entries if key.startswith(prefix)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteCacheBackend:
+    """Caché compartida entre procesos en un archivo SQLite local (WAL).
+
+    Además de las entradas guarda un registro de invalidaciones: cada proceso
+    lo consulta periódicamente para expulsar de su caché en memoria las claves
+    que otro worker modificó.
+    """
+
+    def __init__(self, path: str):
+        self.origin = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS cache_entries ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS cache_invalidations ("
+            " seq INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT NOT NULL, prefix INTEGER NOT NULL,"
+            " origin TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._last_seq = self._db.execute("SELECT COALESCE(MAX(seq), 0) FROM cache_invalidations").fetchone()[0]
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value FROM cache_entries WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        return json.loads(row[0]) if row else _MISSING
+
+    def set(self, key: str, value: Any, ttl: float):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO cache_entries (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), time.time() + ttl),
+            )
+
+    def invalidate(self, key: str, prefix: bool = False):
+        """Borra la(s) entrada(s) compartidas y publica la invalidación para los demás procesos."""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                if prefix:
+                    self._db.execute("DELETE FROM cache_entries WHERE substr(key, 1, ?) = ?", (len(key), key))
+                else:
+                    self._db.execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+                self._db.execute(
+                    "INSERT INTO cache_invalidations (key, prefix, origin, created_at) VALUES (?, ?, ?, ?)",
+                    (key, int(prefix), self.origin, time.time()),
+                )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def poll_invalidations(self) -> List[Tuple[str, bool]]:
+        """Invalidaciones publicadas por otros procesos desde la última consulta."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT seq, key, prefix, origin FROM cache_invalidations WHERE seq > ? ORDER BY seq",
+                (self._last_seq,),
+            ).fetchall()
+        if rows:
+            self._last_seq = rows[-1][0]
+        return [(key, bool(prefix)) for _, key, prefix, origin in rows if origin != self.origin]
+
+    def purge(self, retention_seconds: float):
+        now = time.time()
+        with self._lock:
+            self._db.execute("DELETE FROM cache_entries WHERE expires_at <= ?", (now,))
+            self._db.execute("DELETE FROM cache_invalidations WHERE created_at < ?", (now - retention_seconds,))
+
+
+class DirectoryCache:
+    """Caché de lookups de usuarios, resolución de DNs y membresía de grupos.
+
+    Siempre hay una capa en memoria por proceso; con CACHE_BACKEND=sqlite se
+    añade una capa compartida entre workers y un hilo que aplica las
+    invalidaciones publicadas por los demás. Los valores cacheados se tratan
+    como de solo lectura.
+    """
+
+    def __init__(self, local: MemoryCacheBackend, shared: Optional[SQLiteCacheBackend], ttl_seconds: float, poll_seconds: float):
+        self.local = local
+        self.shared = shared
+        self.ttl_seconds = ttl_seconds
+        self.poll_seconds = poll_seconds
+        # Cada invalidación incrementa la generación: un valor leído de LDAP antes de
+        # una invalidación no se guarda, para no reinstalar un dato viejo
+        self._generation = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_seconds > 0
+
+    def start(self):
+        if self.shared is None or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="cache-invalidations", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        last_purge = time.monotonic()
+        while not self._stop.wait(self.poll_seconds):
+            try:
+                for key, prefix in self.shared.poll_invalidations():
+                    self._evict_local(key, prefix)
+                if time.monotonic() - last_purge >= max(self.ttl_seconds, 60):
+                    self.shared.purge(retention_seconds=max(self.ttl_seconds, 60))
+                    last_purge = time.monotonic()
+            except Exception as e:
+                logger.warning(f"[CACHE] Error reading invalidations: {e}")
+
+    def get_or_load(self, namespace: str, key: str, loader: Callable[[], Any], cache_none: bool = False) -> Any:
+        if not self.enabled:
+            return loader()
+        full_key = f"{namespace}:{key}"
+        value = self.local.get(full_key)
+        if value is not _MISSING:
+            return value
+        if self.shared is not None:
+            try:
+                value = self.shared.get(full_key)
+            except Exception as e:
+                logger.warning(f"[CACHE] Error reading shared cache: {e}")
+                value = _MISSING
+            if value is not _MISSING:
+                self.local.set(full_key, value, self.ttl_seconds)
+                return value
+
+        generation = self._generation
+        value = loader()
+        if (value is not None or cache_none) and generation == self._generation:
+            self.local.set(full_key, value, self.ttl_seconds)
+            if self.shared is not None:
+                try:
+                    self.shared.set(full_key, value, self.ttl_seconds)
+                except Exception as e:
+                    logger.warning(f"[CACHE] Error writing shared cache: {e}")
+        return value
+
+    def invalidate(self, namespace: str, key: str, prefix: bool = False):
+        if not self.enabled:
+            return
+        full_key = f"{namespace}:{key}"
+        self._evict_local(full_key, prefix)
+        if self.shared is not None:
+            try:
+                self.shared.invalidate(full_key, prefix)
+            except Exception as e:
+                logger.warning(f"[CACHE] Error publishing invalidation for {full_key}: {e}")
+
+    def member_key(self, group_dn: str, member_dn: str) -> str:
+        """Clave de membresía "grupo|miembro|generación".
+
+        La generación es un token por DN de miembro: al borrar el usuario se
+        invalida solo ese token y todas sus membresías dejan de encontrarse
+        (expiran por TTL), sin recorrer la caché buscando las claves del miembro.
+        """
+        member_dn = member_dn.lower()
+        if not self.enabled:
+            return f"{group_dn.lower()}|{member_dn}"
+        generation = self.get_or_load("member_gen", member_dn, lambda: uuid.uuid4().hex[:12])
+        return f"{group_dn.lower()}|{member_dn}|{generation}"
+
+    def invalidate_entry(self, dn: str, removed: bool = False):
+        """Invalida todo lo derivado de una entrada modificada o eliminada (usuario o grupo).
+
+        Con `removed` (borrado del usuario) también sus membresías en cualquier grupo.
+        """
+        dn = dn.lower()
+        if dn.startswith("uid="):
+            email = email_from_dn(dn)
+            self.invalidate("user", email)
+            self.invalidate("dn", email)
+            if removed:
+                self.invalidate("member_gen", dn)
+            return
+        # Membresías cacheadas con el DN como grupo
+        self.invalidate("member", f"{dn}|", prefix=True)
+
+    def _evict_local(self, full_key: str, prefix: bool):
+        self._generation += 1
+        if prefix:
+            self.local.delete_prefix(full_key)
+        else:
+            self.local.delete(full_key)
+
+
+def build_directory_cache() -> DirectoryCache:
+    shared = None
+    if settings.CACHE_BACKEND == "sqlite":
+        shared = SQLiteCacheBackend(settings.CACHE_PATH)
+    elif settings.CACHE_BACKEND != "memory":
+        logger.warning(f"[CACHE] Unknown CACHE_BACKEND {settings.CACHE_BACKEND!r}, using memory")
+    return DirectoryCache(
+        MemoryCacheBackend(settings.CACHE_MAX_ENTRIES),
+        shared,
+        ttl_seconds=settings.CACHE_TTL_SECONDS,
+        poll_seconds=settings.CACHE_INVALIDATION_POLL_SECONDS,
+    )
+
+
+directory_cache = build_directory_cache()
@@ -0,0 +1,36 @@
+import math
+import time
+from typing import Optional
+from app.exceptions import DeadlineExceededError
+from app.utils.request_context import deadline_var
+
+
+def time_remaining() -> Optional[float]:
+    """Segundos que le quedan al request en curso (negativo si ya venció); None sin deadline."""
+    deadline = deadline_var.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def deadline_expired() -> bool:
+    remaining = time_remaining()
+    return remaining is not None and remaining <= 0
+
+
+def check_deadline(operation: str) -> Optional[float]:
+    """Como time_remaining(), pero lanza DeadlineExceededError si el deadline ya venció."""
+    remaining = time_remaining()
+    if remaining is not None and remaining <= 0:
+        raise DeadlineExceededError(f"Request deadline exceeded before LDAP {operation}")
+    return remaining
+
+
+def bounded_timeout(default: float) -> float:
+    """El timeout configurado, recortado a lo que le queda al request."""
+    remaining = time_remaining()
+    return default if remaining is None else max(0.001, min(default, remaining))
+
+
+def search_time_limit() -> int:
+    # timeLimit de las búsquedas: segundos enteros (0 = sin límite en el servidor)
+    remaining = time_remaining()
+    return 0 if remaining is None else max(1, math.ceil(remaining))
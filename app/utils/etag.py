@@ -0,0 +1,59 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+from app.config import settings
+
+
+def make_etag(dn: str, version: str) -> str:
+    """ETag débil a partir del DN y la versión de la entrada (entryCSN/modifyTimestamp o hash del contenido)."""
+    digest = hashlib.sha1(f"{dn.lower()}|{version}".encode("utf-8")).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: Optional[str]) -> bool:
+    # Comparación débil (RFC 9110 §13.1.2): se ignora el prefijo W/
+    if not if_none_match or not etag:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    wanted = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == wanted:
+            return True
+    return False
+
+
+class ValidatorCache:
+    """LRU email -> (dn, versión, etag) para responder 304 con una lectura BASE de entryCSN/modifyTimestamp."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, Tuple[str, str, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Tuple[str, str, str]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: str, dn: str, version: str, etag: str):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (dn, version, etag)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def discard(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+user_validators = ValidatorCache(settings.USER_ETAG_CACHE_SIZE)
@@ -0,0 +1,265 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+from fastapi import HTTPException, Response
+from fastapi.encoders import jsonable_encoder
+from loguru import logger
+from app.config import settings
+
+
+class _Entry:
+    __slots__ = ("fingerprint", "expires_at", "done", "result", "error")
+
+    def __init__(self, fingerprint: str, expires_at: float):
+        self.fingerprint = fingerprint
+        self.expires_at = expires_at
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[HTTPException] = None
+
+
+class SQLiteIdempotencyBackend:
+    """Claves de idempotencia compartidas entre workers en un archivo SQLite local (WAL).
+
+    Cada clave la toma un solo proceso (estado pending); al terminar guarda la
+    respuesta (done) para que los reintentos que lleguen a otro worker la
+    reproduzcan. Mientras el request sigue en curso un hilo renueva el lease
+    de los pending propios cada lease_seconds/3; uno que vence sin renovarse
+    es de un worker caído y puede volver a tomarse.
+    """
+
+    def __init__(self, path: str, lease_seconds: float):
+        self.origin = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.lease_seconds = lease_seconds
+        self._lock = threading.Lock()
+        self._heartbeat: Optional[threading.Thread] = None
+        # Claves pending de requests en curso en este proceso
+        self._in_flight: Set[str] = set()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS idempotency_keys ("
+            " key TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, origin TEXT NOT NULL,"
+            " state TEXT NOT NULL, response TEXT, expires_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idempotency_keys_expires ON idempotency_keys (expires_at)")
+
+    def claim(self, key: str, fingerprint: str) -> Optional[Tuple[str, str, Optional[str]]]:
+        """Toma la clave; si ya la tiene otro request devuelve su (fingerprint, estado, respuesta)."""
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute("DELETE FROM idempotency_keys WHERE expires_at <= ?", (now,))
+                row = self._db.execute(
+                    "SELECT fingerprint, state, response FROM idempotency_keys WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    self._db.execute(
+                        "INSERT INTO idempotency_keys (key, fingerprint, origin, state, expires_at) VALUES (?, ?, ?, 'pending', ?)",
+                        (key, fingerprint, self.origin, now + self.lease_seconds),
+                    )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+            if row is None:
+                self._in_flight.add(key)
+            if row is None and self._heartbeat is None:
+                self._heartbeat = threading.Thread(target=self._renew_leases, name="idempotency-leases", daemon=True)
+                self._heartbeat.start()
+        return row
+
+    def renew(self):
+        """Extiende el lease de las claves pending de los requests en curso en este proceso."""
+        with self._lock:
+            expires_at = time.time() + self.lease_seconds
+            for key in self._in_flight:
+                self._db.execute(
+                    "UPDATE idempotency_keys SET expires_at = ? WHERE key = ? AND origin = ? AND state = 'pending'",
+                    (expires_at, key, self.origin),
+                )
+
+    def _renew_leases(self):
+        while True:
+            time.sleep(self.lease_seconds / 3)
+            try:
+                self.renew()
+            except Exception as e:
+                logger.warning(f"[IDEMPOTENCY] Error renewing idempotency leases: {e}")
+
+    def complete(self, key: str, response: Dict[str, Any], ttl_seconds: float):
+        with self._lock:
+            self._in_flight.discard(key)
+            self._db.execute(
+                "UPDATE idempotency_keys SET state = 'done', response = ?, expires_at = ? WHERE key = ? AND origin = ?",
+                (json.dumps(response), time.time() + ttl_seconds, key, self.origin),
+            )
+
+    def release(self, key: str):
+        with self._lock:
+            self._in_flight.discard(key)
+            self._db.execute("DELETE FROM idempotency_keys WHERE key = ? AND origin = ?", (key, self.origin))
+
+
+class IdempotencyStore:
+    """Guarda la respuesta de cada Idempotency-Key para reproducirla en los reintentos.
+
+    Un duplicado que llega mientras la primera ejecución sigue en curso espera
+    a que termine y recibe la misma respuesta. Solo se guardan respuestas
+    exitosas y errores 4xx; ante un error inesperado la clave se libera para
+    que el cliente pueda reintentar.
+
+    Sin `shared` las claves viven en memoria y solo protegen al propio
+    proceso: un reintento que llega a otro worker de uvicorn se vuelve a
+    ejecutar. Con CACHE_BACKEND=sqlite se coordinan además entre workers.
+    """
+
+    def __init__(self, ttl_seconds: int, wait_seconds: int, shared: Optional[SQLiteIdempotencyBackend] = None, poll_seconds: float = 0.2):
+        self.ttl_seconds = ttl_seconds
+        self.wait_seconds = wait_seconds
+        self.shared = shared
+        self.poll_seconds = poll_seconds
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def run(self, key: Optional[str], scope: str, payload: Any, fn: Callable[[], Any], response: Optional[Response] = None) -> Any:
+        if not key:
+            return fn()
+
+        full_key = f"{scope}:{key}"
+        fingerprint = hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+        while True:
+            with self._lock:
+                self._purge_expired()
+                entry = self._entries.get(full_key)
+                if entry is None:
+                    entry = _Entry(fingerprint, time.monotonic() + self.ttl_seconds)
+                    self._entries[full_key] = entry
+                    break
+
+            if entry.fingerprint != fingerprint:
+                raise HTTPException(status_code=422, detail="Idempotency-Key already used with a different payload")
+
+            if not entry.done.wait(timeout=self.wait_seconds):
+                raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+
+            with self._lock:
+                released = self._entries.get(full_key) is not entry
+            if released:
+                # La primera ejecución falló y liberó la clave: este request la toma
+                continue
+
+            logger.info(f"[IDEMPOTENCY] Replaying stored response for {scope} key {key}")
+            if response is not None:
+                response.headers["Idempotent-Replayed"] = "true"
+            if entry.error is not None:
+                raise entry.error
+            return entry.result
+
+        # Dentro del proceso la clave es nuestra; falta tomarla frente a los demás workers
+        owned = self.shared is None
+        try:
+            if not owned:
+                stored = self._claim_shared(full_key, fingerprint)
+                owned = stored is None
+                if not owned:
+                    logger.info(f"[IDEMPOTENCY] Replaying response stored by another worker for {scope} key {key}")
+                    if response is not None:
+                        response.headers["Idempotent-Replayed"] = "true"
+                    if "error" in stored:
+                        entry.error = HTTPException(**stored["error"])
+                        raise entry.error
+                    entry.result = stored["result"]
+                    return entry.result
+
+            entry.result = fn()
+            self._complete_shared(full_key, {"result": jsonable_encoder(entry.result)})
+            return entry.result
+        except HTTPException as e:
+            if not owned and e is not entry.error:
+                # En curso o con otro payload en otro worker: no hay respuesta propia que guardar
+                self._release(full_key, entry)
+            elif e.status_code >= 500:
+                self._release(full_key, entry, shared=owned)
+            else:
+                entry.error = e
+                if owned:
+                    self._complete_shared(full_key, {"error": {"status_code": e.status_code, "detail": e.detail}})
+            raise
+        except Exception:
+            self._release(full_key, entry, shared=owned)
+            raise
+        finally:
+            entry.done.set()
+
+    def _claim_shared(self, full_key: str, fingerprint: str) -> Optional[Dict[str, Any]]:
+        """None si este proceso tomó la clave; si otro worker ya la completó, su respuesta guardada."""
+        deadline = time.monotonic() + self.wait_seconds
+        while True:
+            try:
+                existing = self.shared.claim(full_key, fingerprint)
+            except Exception as e:
+                # Sin el store compartido se sigue con la protección dentro del proceso
+                logger.warning(f"[IDEMPOTENCY] Error reading shared idempotency store: {e}")
+                return None
+            if existing is None:
+                return None
+            stored_fingerprint, state, stored = existing
+            if stored_fingerprint != fingerprint:
+                raise HTTPException(status_code=422, detail="Idempotency-Key already used with a different payload")
+            if state == "done":
+                return json.loads(stored)
+            if time.monotonic() >= deadline:
+                raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+            time.sleep(self.poll_seconds)
+
+    def _complete_shared(self, full_key: str, stored: Dict[str, Any]):
+        if self.shared is None:
+            return
+        try:
+            self.shared.complete(full_key, stored, self.ttl_seconds)
+        except Exception as e:
+            logger.warning(f"[IDEMPOTENCY] Error writing shared idempotency store: {e}")
+
+    def _release(self, full_key: str, entry: _Entry, shared: bool = False):
+        with self._lock:
+            if self._entries.get(full_key) is entry:
+                del self._entries[full_key]
+        if shared and self.shared is not None:
+            try:
+                self.shared.release(full_key)
+            except Exception as e:
+                logger.warning(f"[IDEMPOTENCY] Error releasing shared idempotency key: {e}")
+
+    def _purge_expired(self):
+        # Todas las entradas tienen el mismo TTL, así que el orden de inserción es el de expiración
+        now = time.monotonic()
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry.expires_at > now or not entry.done.is_set():
+                break
+            del self._entries[key]
+
+
+def build_idempotency_store() -> IdempotencyStore:
+    # Mismo archivo que la caché compartida: si los workers comparten caché, comparten también las claves
+    shared = None
+    if settings.CACHE_BACKEND == "sqlite":
+        shared = SQLiteIdempotencyBackend(settings.CACHE_PATH, lease_seconds=settings.IDEMPOTENCY_LEASE_SECONDS)
+    return IdempotencyStore(
+        ttl_seconds=settings.IDEMPOTENCY_TTL_SECONDS,
+        wait_seconds=settings.IDEMPOTENCY_WAIT_SECONDS,
+        shared=shared,
+    )
+
+
+idempotency_store = build_idempotency_store()
@@ -0,0 +1,94 @@
+import base64
+from typing import Dict, Iterable, Iterator, List, Tuple, Union
+
+LDIF_LINE_WIDTH = 76
+
+Value = Union[str, bytes]
+
+
+def _is_safe(value: bytes) -> bool:
+    # RFC 2849: SAFE-STRING, si no lo es el valor va en base64
+    if not value:
+        return True
+    if value[0] in b" :<" or value[-1:] == b" ":
+        return False
+    return all(0 < byte < 128 and byte not in (10, 13) for byte in value)
+
+
+def _fold(line: str) -> str:
+    if len(line) <= LDIF_LINE_WIDTH:
+        return line + "\n"
+    parts = [line[:LDIF_LINE_WIDTH]]
+    rest = line[LDIF_LINE_WIDTH:]
+    while rest:
+        parts.append(" " + rest[:LDIF_LINE_WIDTH - 1])
+        rest = rest[LDIF_LINE_WIDTH - 1:]
+    return "\n".join(parts) + "\n"
+
+
+def _attr_line(attr: str, value: Value) -> str:
+    raw = value if isinstance(value, bytes) else str(value).encode("utf-8")
+    if _is_safe(raw):
+        return _fold(f"{attr}: {raw.decode('ascii')}")
+    return _fold(f"{attr}:: {base64.b64encode(raw).decode('ascii')}")
+
+
+def format_entry(dn: str, attributes: Dict[str, Iterable[Value]]) -> str:
+    """Serializa una entrada como registro LDIF (objectClass primero), terminado en línea vacía."""
+    lines: List[str] = [_attr_line("dn", dn)]
+    ordered = sorted(attributes.items(), key=lambda item: item[0].lower() != "objectclass")
+    for attr, values in ordered:
+        if isinstance(values, (str, bytes)):
+            values = [values]
+        for value in values:
+            lines.append(_attr_line(attr, value))
+    lines.append("\n")
+    return "".join(lines)
+
+
+def _parse_line(line: str):
+    attr, sep, rest = line.partition(":")
+    if not sep:
+        raise ValueError(f"Invalid LDIF line: {line!r}")
+    if rest.startswith(":"):
+        return attr, base64.b64decode(rest[1:].strip())
+    return attr, rest.lstrip(" ")
+
+
+def parse_ldif(lines: Iterable[str]) -> Iterator[Tuple[str, Dict[str, List[Value]]]]:
+    """Lee un LDIF de contenido línea a línea y produce (dn, atributos) por registro.
+
+    Soporta líneas plegadas, comentarios y valores en base64 (que se devuelven como bytes).
+    """
+    record: List[str] = []
+
+    def build(record_lines: List[str]):
+        dn = None
+        attributes: Dict[str, List[Value]] = {}
+        for record_line in record_lines:
+            attr, value = _parse_line(record_line)
+            if attr.lower() == "dn":
+                dn = value.decode("utf-8") if isinstance(value, bytes) else value
+            elif attr.lower() != "version":
+                attributes.setdefault(attr, []).append(value)
+        return dn, attributes
+
+    for raw_line in lines:
+        line = raw_line.rstrip("\r\n")
+        if line.startswith(" ") and record:
+            record[-1] += line[1:]
+        elif line.startswith("#"):
+            continue
+        elif not line:
+            if record:
+                dn, attributes = build(record)
+                if dn:
+                    yield dn, attributes
+                record = []
+        else:
+            record.append(line)
+
+    if record:
+        dn, attributes = build(record)
+        if dn:
+            yield dn, attributes
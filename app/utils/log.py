@@ -0,0 +1,62 @@
+import random
+import re
+import sys
+from typing import Any
+from loguru import logger
+from app.config import settings
+from app.utils.request_context import request_id_var
+
+
+SENSITIVE_KEYS = {"userpassword", "password", "token"}
+REDACTED = "***"
+
+_SENSITIVE_PATTERN = re.compile(
+    r"""(['"]?(?:userPassword|password)['"]?\s*[:=]\s*)(\[[^\]]*\]|'[^']*'|"[^"]*"|\S+)""",
+    re.IGNORECASE,
+)
+
+TEXT_FORMAT = (
+    "<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | <level>{level: <8}</level> | "
+    "{extra[request_id]} | <cyan>{name}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>"
+)
+
+# Logger para líneas info de alto volumen: se emiten solo con probabilidad LOG_SAMPLE_RATE
+sampled = logger.bind(sampled=True)
+
+
+def redact(value: Any) -> Any:
+    """Copia dicts/listas ocultando los valores de claves sensibles (userPassword, password, token)."""
+    if isinstance(value, dict):
+        return {k: REDACTED if str(k).lower() in SENSITIVE_KEYS else redact(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(v) for v in value]
+    return value
+
+
+def _patch(record):
+    # Siempre el del contexto actual: un valor por defecto en extra lo ocultaría
+    record["extra"]["request_id"] = request_id_var.get() or "-"
+    # Red de seguridad para mensajes que incluyan una contraseña ya formateada
+    if "assword" in record["message"]:
+        record["message"] = _SENSITIVE_PATTERN.sub(rf"\1{REDACTED}", record["message"])
+
+
+def _sample(record) -> bool:
+    if record["extra"].get("sampled"):
+        return random.random() < settings.LOG_SAMPLE_RATE
+    return True
+
+
+def setup_logging():
+    logger.remove()
+    logger.configure(patcher=_patch)
+    logger.add(
+        sys.stderr,
+        level=settings.LOG_LEVEL,
+        format=TEXT_FORMAT,
+        serialize=settings.LOG_JSON,
+        filter=_sample,
+        enqueue=True,  # el formateo y la escritura se hacen en un hilo aparte
+        backtrace=False,
+        diagnose=False,
+    )
@@ -0,0 +1,151 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, Optional, Tuple
+from loguru import logger
+from app.config import settings
+
+# Funciones hoja en las que un hilo está bloqueado esperando, no consumiendo CPU
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("selectors.py", "select"),
+    ("socket.py", "accept"),
+    ("socket.py", "readinto"),
+    ("ssl.py", "read"),
+    ("ssl.py", "recv_into"),
+    ("base_events.py", "_run_once"),
+    ("thread.py", "_worker"),
+}
+
+
+def _short_path(filename: str) -> str:
+    # .../site-packages/ldap3/operation/search.py -> ldap3/operation/search.py
+    for marker in ("site-packages" + os.sep, "dist-packages" + os.sep, os.getcwd() + os.sep):
+        index = filename.rfind(marker)
+        if index >= 0:
+            return filename[index + len(marker):]
+    return os.path.join(os.path.basename(os.path.dirname(filename)), os.path.basename(filename))
+
+
+class SamplingProfiler:
+    """Perfilador por muestreo de todos los hilos del proceso.
+
+    Cada `interval` segundos toma las pilas de todos los hilos con
+    sys._current_frames() y las acumula en formato "collapsed" (una línea
+    "hilo;f1;f2;...;hoja N" por pila, la entrada de flamegraph.pl y speedscope).
+    No instrumenta nada: fuera de una captura el costo es cero. Solo se permite
+    una captura a la vez.
+    """
+
+    def __init__(self, max_seconds: float):
+        self.max_seconds = max_seconds
+        self._lock = threading.Lock()
+        self._labels: Dict[Any, str] = {}
+
+    @property
+    def busy(self) -> bool:
+        return self._lock.locked()
+
+    def run(self, seconds: float, interval: float, include_idle: bool = False, top: int = 30) -> Optional[Dict[str, Any]]:
+        """Muestrea durante `seconds`; devuelve None si ya hay otra captura en curso."""
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            seconds = min(seconds, self.max_seconds)
+            logger.info(f"[PROFILER] Sampling all threads for {seconds}s every {interval * 1000:.0f}ms")
+            stacks, samples, idle, elapsed, spent = self._sample(seconds, interval, include_idle)
+        finally:
+            self._lock.release()
+
+        self_counts: Counter = Counter()
+        total_counts: Counter = Counter()
+        for stack, count in stacks.items():
+            frames = stack.split(";")[1:]
+            if frames:
+                self_counts[frames[-1]] += count
+            # Una función recursiva cuenta una sola vez por pila
+            for frame in set(frames):
+                total_counts[frame] += count
+
+        observed = sum(stacks.values())
+        functions = [
+            {
+                "function": frame,
+                "self": count,
+                "self_pct": round(100 * count / observed, 2),
+                "total": total_counts[frame],
+                "total_pct": round(100 * total_counts[frame] / observed, 2),
+            }
+            for frame, count in self_counts.most_common(top)
+        ]
+        logger.info(f"[PROFILER] {samples} samples, {observed} stacks in {elapsed:.2f}s")
+        return {
+            "duration_seconds": round(elapsed, 3),
+            "interval_ms": round(interval * 1000, 3),
+            "samples": samples,
+            "stacks_observed": observed,
+            "idle_stacks_skipped": idle,
+            # Tiempo de pared del propio muestreo respecto de la duración
+            "overhead_pct": round(100 * spent / elapsed, 2) if elapsed else 0.0,
+            "top_functions": functions,
+            "collapsed": stacks,
+        }
+
+    def _sample(self, seconds: float, interval: float, include_idle: bool) -> Tuple[Counter, int, int, float, float]:
+        stacks: Counter = Counter()
+        samples = idle = 0
+        spent = 0.0
+        own = threading.get_ident()
+        started = time.monotonic()
+        end = started + seconds
+        next_tick = started
+        while True:
+            now = time.monotonic()
+            if now >= end:
+                break
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                if not include_idle and self._is_idle(frame):
+                    idle += 1
+                    continue
+                stacks[self._collapse(names.get(ident, f"thread-{ident}"), frame)] += 1
+            samples += 1
+            spent += time.monotonic() - now
+            # Intervalo fijo sobre el reloj: si una muestra se atrasa no se acumula el retraso
+            next_tick += interval
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_tick = time.monotonic()
+        return stacks, samples, idle, time.monotonic() - started, spent
+
+    def _is_idle(self, frame) -> bool:
+        code = frame.f_code
+        return (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            # ";" separa los frames en el formato collapsed
+            label = f"{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})".replace(";", ":")
+            self._labels[code] = label
+        return label
+
+    def _collapse(self, thread_name: str, frame) -> str:
+        frames = []
+        while frame is not None:
+            frames.append(self._label(frame.f_code))
+            frame = frame.f_back
+        frames.append(thread_name.replace(";", ":"))
+        frames.reverse()
+        return ";".join(frames)
+
+
+sampling_profiler = SamplingProfiler(settings.PROFILER_MAX_SECONDS)
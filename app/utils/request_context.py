@@ -0,0 +1,11 @@
+from contextvars import ContextVar
+from typing import Optional
+
+# ID de correlación del request en curso; "-" fuera de un request (jobs, CLI, arranque)
+request_id_var: ContextVar[str] = ContextVar("request_id", default="-")
+
+# Quién origina la operación (cabecera X-Actor o IP del cliente); los jobs heredan el de quien los encoló
+actor_var: ContextVar[str] = ContextVar("actor", default="-")
+
+# Instante (time.monotonic) en que vence el request en curso; None = sin deadline (jobs, CLI, rutas bulk)
+deadline_var: ContextVar[Optional[float]] = ContextVar("deadline", default=None)
@@ -0,0 +1,103 @@
+import random
+import threading
+import time
+from typing import Dict, Optional
+from loguru import logger
+from app.config import settings
+from app.exceptions import LDAPUnavailableError
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Circuit breaker por servidor LDAP.
+
+    Tras `failure_threshold` fallos de comunicación consecutivos se abre y las
+    llamadas fallan de inmediato durante `reset_seconds`. Después deja pasar una
+    sola llamada de prueba (half-open): si responde se cierra, si falla se vuelve a abrir.
+    """
+
+    def __init__(self, name: str, failure_threshold: int, reset_seconds: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_started_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        return self._state
+
+    @property
+    def is_open(self) -> bool:
+        return self._state == OPEN
+
+    def retry_after(self) -> Optional[float]:
+        if self._state != OPEN:
+            return None
+        return max(0.0, self._opened_at + self.reset_seconds - time.monotonic())
+
+    def before_call(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._state == OPEN:
+                remaining = self._opened_at + self.reset_seconds - now
+                if remaining > 0:
+                    raise LDAPUnavailableError(f"LDAP circuit open for {self.name}", retry_after=remaining)
+                self._state = HALF_OPEN
+                self._trial_started_at = now
+                logger.info("[BREAKER] {} half-open, trying one request", self.name)
+                return
+            if self._state == HALF_OPEN:
+                # Una llamada de prueba abandonada no debe bloquear el breaker para siempre
+                if self._trial_started_at is not None and now - self._trial_started_at < self.reset_seconds:
+                    raise LDAPUnavailableError(f"LDAP circuit half-open for {self.name}", retry_after=1)
+                self._trial_started_at = now
+
+    def record_success(self):
+        with self._lock:
+            if self._state != CLOSED:
+                logger.success("[BREAKER] {} closed, LDAP is responding again", self.name)
+            self._state = CLOSED
+            self._failures = 0
+            self._trial_started_at = None
+
+    def release_trial(self):
+        # La llamada se cortó por el deadline del request: no dice nada del servidor
+        with self._lock:
+            self._trial_started_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_started_at = None
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != OPEN:
+                    logger.error("[BREAKER] {} open after {} consecutive failures", self.name, self._failures)
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+
+
+def backoff_delay(attempt: int, base_seconds: float, max_seconds: float) -> float:
+    # Backoff exponencial con "full jitter" para no sincronizar los reintentos de varios hilos
+    return random.uniform(0, min(max_seconds, base_seconds * (2 ** (attempt - 1))))
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def circuit_breaker(host: str, port: int) -> CircuitBreaker:
+    """Breaker compartido por todas las conexiones al mismo servidor."""
+    name = f"{host}:{port}"
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(name, settings.LDAP_BREAKER_FAILURES, settings.LDAP_BREAKER_RESET_SECONDS)
+            _breakers[name] = breaker
+        return breaker
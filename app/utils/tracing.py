@@ -0,0 +1,183 @@
+import functools
+import json
+import os
+import queue
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional, Dict, Any, List
+from loguru import logger
+from app.config import settings
+
+
+class Span:
+    __slots__ = ("name", "span_id", "start_ns", "duration_ns", "attributes", "error")
+
+    def __init__(self, name: str, attributes: Dict[str, Any]):
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.start_ns = time.time_ns()
+        self.duration_ns = 0
+        self.attributes = attributes
+        self.error: Optional[str] = None
+
+    @property
+    def category(self) -> str:
+        return self.name.split(".", 1)[0]
+
+    def set(self, key: str, value: Any):
+        self.attributes[key] = value
+
+
+class RequestTrace:
+    """Spans registrados durante un request, identificados por su ID de correlación."""
+
+    def __init__(self, request_id: str, name: str):
+        self.request_id = request_id
+        self.trace_id = request_id if _is_hex(request_id, 32) else os.urandom(16).hex()
+        self.root = Span(name, {})
+        self.spans: List[Span] = []
+        self._started = time.perf_counter_ns()
+
+    def finish(self, status_code: int):
+        self.root.duration_ns = time.perf_counter_ns() - self._started
+        self.root.set("http.status_code", status_code)
+
+    def server_timing(self) -> str:
+        """Resumen por categoría (ldap, jwt, validation) para la cabecera Server-Timing."""
+        totals: Dict[str, List[int]] = {}
+        for span in self.spans:
+            total = totals.setdefault(span.category, [0, 0])
+            total[0] += span.duration_ns
+            total[1] += 1
+        parts = [f'{category};dur={ns / 1e6:.2f};desc="{count} calls"' for category, (ns, count) in totals.items()]
+        parts.append(f"total;dur={self.root.duration_ns / 1e6:.2f}")
+        return ", ".join(parts)
+
+
+trace_var: ContextVar[Optional[RequestTrace]] = ContextVar("request_trace", default=None)
+
+
+def _is_hex(value: str, length: int) -> bool:
+    return len(value) == length and all(c in "0123456789abcdef" for c in value.lower())
+
+
+@contextmanager
+def span(name: str, **attributes):
+    current = Span(name, attributes)
+    started = time.perf_counter_ns()
+    try:
+        yield current
+    except Exception as e:
+        current.error = str(e)
+        raise
+    finally:
+        current.duration_ns = time.perf_counter_ns() - started
+        trace = trace_var.get()
+        if trace is not None:
+            trace.spans.append(current)
+
+
+def traced(name: str):
+    """Decorador para métodos de LDAPClient: registra operación, DN base, duración y nº de entradas."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            dn = args[0] if args and isinstance(args[0], str) else kwargs.get("dn") or kwargs.get("base_dn")
+            with span(f"ldap.{name}", **{"ldap.operation": name, "ldap.base_dn": dn}) as current:
+                result = func(self, *args, **kwargs)
+                if isinstance(result, list):
+                    current.set("ldap.entries", len(result))
+                return result
+        return wrapper
+    return decorator
+
+
+def _attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+def _otlp_span(trace: RequestTrace, current: Span, parent_id: str, kind: int) -> Dict[str, Any]:
+    attributes = [_attribute(k, v) for k, v in current.attributes.items() if v is not None]
+    return {
+        "traceId": trace.trace_id,
+        "spanId": current.span_id,
+        "parentSpanId": parent_id,
+        "name": current.name,
+        "kind": kind,
+        "startTimeUnixNano": str(current.start_ns),
+        "endTimeUnixNano": str(current.start_ns + current.duration_ns),
+        "attributes": attributes,
+        "status": {"code": 2, "message": current.error} if current.error else {"code": 1},
+    }
+
+
+def to_otlp(traces: List[RequestTrace]) -> Dict[str, Any]:
+    """Convierte traces al formato JSON de OTLP (ExportTraceServiceRequest)."""
+    spans = []
+    for trace in traces:
+        spans.append(_otlp_span(trace, trace.root, "", kind=2))
+        spans.extend(_otlp_span(trace, child, trace.root.span_id, kind=3) for child in trace.spans)
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [_attribute("service.name", settings.TRACE_SERVICE_NAME)]},
+            "scopeSpans": [{"scope": {"name": "app.utils.tracing"}, "spans": spans}],
+        }]
+    }
+
+
+class SpanExporter:
+    """Exporta traces en segundo plano a un archivo JSON-lines y/o a un collector OTLP/HTTP."""
+
+    def __init__(self, file_path: str, endpoint: str, batch_size: int = 64):
+        self.file_path = file_path
+        self.endpoint = endpoint
+        self.batch_size = batch_size
+        self._queue: "queue.Queue[RequestTrace]" = queue.Queue(maxsize=10000)
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.file_path or self.endpoint)
+
+    def submit(self, trace: RequestTrace):
+        if not self.enabled:
+            return
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+            self._thread.start()
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            logger.warning("Span export queue full, dropping trace {}", trace.trace_id)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            try:
+                self._export(to_otlp(batch))
+            except Exception as e:
+                logger.warning("Error exporting spans: {}", e)
+
+    def _export(self, payload: Dict[str, Any]):
+        body = json.dumps(payload, separators=(",", ":"))
+        if self.file_path:
+            with open(self.file_path, "a", encoding="utf-8") as handle:
+                handle.write(body + "\n")
+        if self.endpoint:
+            request = urllib.request.Request(
+                self.endpoint, data=body.encode("utf-8"), headers={"Content-Type": "application/json"}, method="POST"
+            )
+            with urllib.request.urlopen(request, timeout=5):
+                pass
+
+
+span_exporter = SpanExporter(settings.TRACE_EXPORT_FILE, settings.TRACE_EXPORT_ENDPOINT)
@@ -0,0 +1,116 @@
+"""Compara el costo de decodificar usuarios con ldap3.Entry frente a UserRecord.from_raw.
+
+Usa la estrategia MOCK_SYNC de ldap3, así que no necesita un servidor LDAP:
+
+    python -m benchmarks.bench_user_decode --users 5000 --rounds 5
+"""
+import argparse
+import time
+import tracemalloc
+from ldap3 import Server, Connection, MOCK_SYNC, SUBTREE
+from app.models.user_record import USER_READ_ATTRIBUTES, UserRecord
+
+BASE_DN = "ou=users,dc=bench,dc=local"
+
+
+def build_connection(users: int) -> Connection:
+    conn = Connection(Server("bench"), user="cn=admin,dc=bench,dc=local", password="bench", client_strategy=MOCK_SYNC)
+    conn.strategy.add_entry("cn=admin,dc=bench,dc=local", {"objectClass": ["person"], "sn": "admin", "userPassword": "bench"})
+    conn.strategy.add_entry(BASE_DN, {"objectClass": ["organizationalUnit"], "ou": "users"})
+    for i in range(users):
+        conn.strategy.add_entry(f"uid=user{i}@bench.local,{BASE_DN}", {
+            "objectClass": ["inetOrgPerson", "organizationalPerson", "person", "top"],
+            "uid": f"user{i}@bench.local",
+            "cn": f"Nombre{i} Apellido{i}",
+            "givenName": f"Nombre{i}",
+            "sn": f"Apellido{i}",
+            "mail": f"user{i}@bench.local",
+            "employeeNumber": str(i),
+            "description": "ACTIVE",
+            "postalAddress": f"Calle {i}",
+            "departmentNumber": "Operaciones",
+            "physicalDeliveryOfficeName": "Ventas",
+            "title": "Analista",
+            "telephoneNumber": ["0999999999", "022222222"],
+            "labeledURI": f"https://img.bench.local/{i}.png",
+        })
+    conn.bind()
+    conn.search(BASE_DN, "(uid=*)", search_scope=SUBTREE, attributes=USER_READ_ATTRIBUTES)
+    return conn
+
+
+def decode_with_entries(conn: Connection) -> list:
+    # Réplica del acceso anterior de get_user: hasattr/.value sobre ldap3.Entry
+    users = []
+    for user_entry in conn._get_entries(conn.response, conn.request):
+        description = user_entry.description.value if hasattr(user_entry, 'description') else "ACTIVE"
+        users.append({
+            "email": user_entry.uid.value if hasattr(user_entry, 'uid') else "",
+            "firstName": user_entry.givenName.value if hasattr(user_entry, 'givenName') else "",
+            "lastName": user_entry.sn.value if hasattr(user_entry, 'sn') else "",
+            "id": user_entry.employeeNumber.value if hasattr(user_entry, 'employeeNumber') else "",
+            "active": description == "ACTIVE",
+            "address": user_entry.postalAddress.value if hasattr(user_entry, 'postalAddress') else "",
+            "department": user_entry.departmentNumber.value if hasattr(user_entry, 'departmentNumber') else "",
+            "area": user_entry.physicalDeliveryOfficeName.value if hasattr(user_entry, 'physicalDeliveryOfficeName') else "",
+            "position": user_entry.title.value if hasattr(user_entry, 'title') else "",
+            "phone": user_entry.telephoneNumber.values if hasattr(user_entry, 'telephoneNumber') else [],
+            "imageUrl": user_entry.labeledURI.value if hasattr(user_entry, 'labeledURI') else "",
+            "dn": user_entry.entry_dn
+        })
+    return users
+
+
+def decode_with_records(conn: Connection) -> list:
+    return [
+        UserRecord.from_raw(item["dn"], item["raw_attributes"]).to_dict()
+        for item in conn.response
+        if item["type"] == "searchResEntry"
+    ]
+
+
+def decode_records_only(conn: Connection) -> list:
+    # Registros sin convertir a dict: lo que quedaría en memoria en un índice o caché
+    return [
+        UserRecord.from_raw(item["dn"], item["raw_attributes"])
+        for item in conn.response
+        if item["type"] == "searchResEntry"
+    ]
+
+
+def measure(name: str, decode, conn: Connection, users: int, rounds: int):
+    decode(conn)  # calentamiento
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        decode(conn)
+        timings.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    result = decode(conn)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+
+    best = min(timings)
+    print(
+        f"{name:<22} {best * 1e6 / users:>9.2f} us/user "
+        f"{peak / users:>10.0f} B/user peak {retained / users:>10.0f} B/user retained"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    conn = build_connection(args.users)
+    print(f"{args.users} users, best of {args.rounds} rounds")
+    measure("ldap3.Entry + hasattr", decode_with_entries, conn, args.users, args.rounds)
+    measure("UserRecord -> dict", decode_with_records, conn, args.users, args.rounds)
+    measure("UserRecord (slots)", decode_records_only, conn, args.users, args.rounds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+import asyncio
+
+import pytest
+
+from app.middleware.admission import AdmissionController, AdmissionRejected, classify, parse_limits
+
+
+def controller(limits, max_concurrent=4, auth_reserved=1, queue_timeout=0.2):
+    return AdmissionController(limits, max_concurrent, auth_reserved, queue_timeout)
+
+
+@pytest.mark.parametrize("method, path, expected", [
+    ("POST", "/api/v2/ldap/auth/validate", "auth"),
+    ("POST", "/api/v2/ldap/assign-roles", "bulk"),
+    ("GET", "/api/v2/ldap/export/ldif", "bulk"),
+    ("GET", "/api/v2/ldap/users/a@x.com", "read"),
+    ("PATCH", "/api/v2/ldap/users/a@x.com", "write"),
+    ("GET", "/api/v2/ldap/health/ready", None),
+    ("GET", "/api/v2/ldap/changes/stream", None),
+    ("GET", "/api/v2/ldap/debug/profile", None),
+    ("GET", "/", None),
+])
+def test_classify(method, path, expected):
+    assert classify(method, path) == expected
+
+
+def test_parse_limits_fills_missing_classes():
+    limits = parse_limits("auth=8:20, bulk=2")
+    assert limits["auth"] == (8, 20)
+    assert limits["bulk"] == (2, 0)
+    assert set(limits) >= {"auth", "read", "write", "bulk"}
+
+
+def test_class_limit_and_queue_full():
+    async def scenario():
+        admission = controller({"auth": (4, 4), "bulk": (1, 1)})
+        await admission.acquire("bulk")
+        waiter = asyncio.ensure_future(admission.acquire("bulk"))
+        await asyncio.sleep(0)
+        # La cola de bulk admite un solo waiter
+        with pytest.raises(AdmissionRejected) as rejected:
+            await admission.acquire("bulk")
+        assert rejected.value.retry_after >= 1
+        admission.release("bulk", 0.1)
+        await waiter
+        assert admission.classes["bulk"].active == 1
+
+    asyncio.run(scenario())
+
+
+def test_queue_timeout():
+    async def scenario():
+        admission = controller({"auth": (4, 4), "read": (1, 4)}, queue_timeout=0.05)
+        await admission.acquire("read")
+        with pytest.raises(AdmissionRejected, match="queue timeout"):
+            await admission.acquire("read")
+        assert admission.classes["read"].waiting == 0
+
+    asyncio.run(scenario())
+
+
+def test_reserved_slots_only_for_auth():
+    async def scenario():
+        admission = controller({"auth": (4, 4), "read": (4, 4)}, max_concurrent=3, auth_reserved=1, queue_timeout=0.05)
+        await admission.acquire("read")
+        await admission.acquire("read")
+        # El tercer slot global queda reservado para auth
+        with pytest.raises(AdmissionRejected):
+            await admission.acquire("read")
+        await admission.acquire("auth")
+        assert admission.active == 3
+
+    asyncio.run(scenario())
+
+
+def test_released_slot_goes_to_highest_priority():
+    async def scenario():
+        admission = controller({"auth": (4, 4), "write": (4, 4)}, max_concurrent=1, auth_reserved=0, queue_timeout=1)
+        await admission.acquire("write")
+        order = []
+
+        async def wait_for(admission_class):
+            await admission.acquire(admission_class)
+            order.append(admission_class)
+
+        write_waiter = asyncio.ensure_future(wait_for("write"))
+        await asyncio.sleep(0)
+        auth_waiter = asyncio.ensure_future(wait_for("auth"))
+        await asyncio.sleep(0)
+        admission.release("write", 0.1)
+        await auth_waiter
+        assert order == ["auth"]
+        admission.release("auth", 0.1)
+        await write_waiter
+        assert order == ["auth", "write"]
+
+    asyncio.run(scenario())
+
+
+def test_class_without_queue_runs_while_others_wait():
+    async def scenario():
+        admission = controller({"auth": (4, 4), "bulk": (1, 1), "read": (2, 0)})
+        await admission.acquire("bulk")
+        waiter = asyncio.ensure_future(admission.acquire("bulk"))
+        await asyncio.sleep(0)
+        assert admission.classes["bulk"].waiting == 1
+        # read no tiene cola, pero hay slots libres que el waiter de bulk no puede usar
+        await admission.acquire("read")
+        assert admission.classes["read"].active == 1
+        admission.release("bulk", 0.1)
+        await waiter
+
+    asyncio.run(scenario())
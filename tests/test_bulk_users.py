@@ -0,0 +1,36 @@
+from contextlib import contextmanager
+from unittest.mock import MagicMock, patch
+
+from app.models.user import BulkLifecycleRequest
+from app.services.bulk_user_service import BulkUserService
+from app.utils.audit import AuditWriter
+from app.utils.request_context import actor_var, request_id_var
+
+USERS = [
+    {"dn": f"uid=u{i}@x.com,ou=users,dc=test,dc=local", "raw_attributes": {"uid": [f"u{i}@x.com".encode()], "description": [b"ACTIVE"]}}
+    for i in range(6)
+]
+
+
+def test_bulk_operations_keep_the_request_actor():
+    writer = AuditWriter("audit.jsonl", 0, 0, 100, 100, 1, 1, 10)
+    ldap = MagicMock()
+    ldap.paged_search.return_value = iter(USERS)
+    ldap.modify_entry.side_effect = lambda dn, changes: writer.record({"operation": "modify", "dn": dn})
+    pool = MagicMock()
+    pool.acquire.side_effect = contextmanager(lambda: (yield ldap))
+
+    actor_token = actor_var.set("admin@x.com")
+    request_token = request_id_var.set("req-1")
+    try:
+        with patch("app.services.bulk_user_service.LDAPClientPool", return_value=pool):
+            results = list(BulkUserService(workers=3).run("deactivate", BulkLifecycleRequest(area="Ventas")))
+    finally:
+        actor_var.reset(actor_token)
+        request_id_var.reset(request_token)
+
+    assert [result["status"] for result in results] == ["updated"] * len(USERS)
+    events = [writer._queue.get_nowait() for _ in range(writer._queue.qsize())]
+    assert len(events) == len(USERS)
+    # Los cambios se aplican en los hilos del executor: el actor y el request vienen del contexto copiado
+    assert {(event["actor"], event["request_id"]) for event in events} == {("admin@x.com", "req-1")}
@@ -0,0 +1,53 @@
+import io
+
+from app.utils.ldif import LDIF_LINE_WIDTH, format_entry, parse_ldif
+
+
+def roundtrip(dn, attributes):
+    return list(parse_ldif(io.StringIO(format_entry(dn, attributes))))
+
+
+def test_format_entry_puts_object_class_first():
+    text = format_entry("uid=a@x.com,dc=test", {"sn": ["Diaz"], "objectClass": ["inetOrgPerson", "top"]})
+    assert text.splitlines()[:3] == ["dn: uid=a@x.com,dc=test", "objectClass: inetOrgPerson", "objectClass: top"]
+    assert text.endswith("\n\n")
+
+
+def test_roundtrip_plain_values():
+    attributes = {"objectClass": ["inetOrgPerson"], "uid": ["a@x.com"], "telephoneNumber": ["111", "222"]}
+    assert roundtrip("uid=a@x.com,dc=test", attributes) == [("uid=a@x.com,dc=test", attributes)]
+
+
+def test_roundtrip_unsafe_values_use_base64():
+    attributes = {"cn": ["José Peña"], "description": [" leading space"], "jpegPhoto": [b"\x00\xff"]}
+    text = format_entry("uid=b,dc=test", attributes)
+    assert "cn:: " in text and "description:: " in text
+
+    [(dn, parsed)] = list(parse_ldif(io.StringIO(text)))
+    assert dn == "uid=b,dc=test"
+    # Los valores en base64 vuelven como bytes
+    assert parsed == {"cn": ["José Peña".encode("utf-8")], "description": [b" leading space"], "jpegPhoto": [b"\x00\xff"]}
+
+
+def test_roundtrip_folded_lines():
+    long_value = "x" * (LDIF_LINE_WIDTH * 3)
+    text = format_entry("uid=c,dc=test", {"labeledURI": [long_value]})
+    assert all(len(line) <= LDIF_LINE_WIDTH for line in text.splitlines())
+    assert list(parse_ldif(io.StringIO(text))) == [("uid=c,dc=test", {"labeledURI": [long_value]})]
+
+
+def test_parse_skips_version_comments_and_reads_several_records():
+    text = (
+        "version: 1\n"
+        "\n"
+        "# usuarios\n"
+        "dn: uid=a,dc=test\n"
+        "uid: a\n"
+        "\n"
+        "dn: uid=b,dc=test\n"
+        "uid: b\n"
+    )
+    assert list(parse_ldif(io.StringIO(text))) == [
+        ("uid=a,dc=test", {"uid": ["a"]}),
+        ("uid=b,dc=test", {"uid": ["b"]}),
+    ]
@@ -0,0 +1,80 @@
+from unittest.mock import MagicMock
+
+import pytest
+
+from app.services.user_service import UserService, _values_differ
+
+USER_DN = "uid=ana@x.com,ou=quito,ou=pichincha,ou=ec,ou=users,dc=test,dc=local"
+
+CURRENT = {
+    "givenName": [b"Ana"],
+    "sn": [b"Diaz"],
+    "title": [b"Analyst"],
+    "description": [b"ACTIVE"],
+    "telephoneNumber": [b"111", b"222"],
+    "physicalDeliveryOfficeName": [b"Ventas"],
+}
+
+
+@pytest.fixture
+def service():
+    svc = UserService.__new__(UserService)
+    svc.base_dn = "dc=test,dc=local"
+    svc.ldap = MagicMock()
+    svc.ldap.read_raw.side_effect = lambda dn, attributes: {k: v for k, v in CURRENT.items() if k in attributes}
+    return svc
+
+
+@pytest.mark.parametrize("current, desired, differ", [
+    ("Ana", "Ana", False),
+    ("Ana", "Eva", True),
+    (["111", "222"], ["222", "111"], False),
+    (["111"], ["111", "222"], True),
+    ("", None, False),
+    (True, True, False),
+    (True, False, True),
+])
+def test_values_differ(current, desired, differ):
+    assert _values_differ(current, desired) is differ
+
+
+def test_update_user_without_changes_skips_modify(service):
+    data = {"firstName": "Ana", "position": "Analyst", "active": True, "phone": ["222", "111"]}
+
+    result = service.update_user("ana@x.com", data, user_dn=USER_DN)
+
+    assert result == {"dn": USER_DN, "changed_fields": []}
+    service.ldap.modify_entry.assert_not_called()
+
+
+def test_update_user_writes_only_changed_fields(service):
+    data = {"firstName": "Ana", "position": "Manager", "active": False, "area": None}
+
+    result = service.update_user("ana@x.com", data, user_dn=USER_DN)
+
+    assert result["changed_fields"] == ["active", "position"]
+    service.ldap.modify_entry.assert_called_once_with(USER_DN, {"title": "Manager", "description": "INACTIVE"})
+
+
+def test_update_user_rename_rebuilds_cn(service):
+    result = service.update_user("ana@x.com", {"lastName": "Perez"}, user_dn=USER_DN)
+
+    assert result["changed_fields"] == ["lastName"]
+    service.ldap.modify_entry.assert_called_once_with(USER_DN, {"sn": "Perez", "cn": "Ana Perez"})
+
+
+def test_update_user_always_writes_password(service):
+    result = service.update_user("ana@x.com", {"password": "secret"}, user_dn=USER_DN)
+
+    assert result["changed_fields"] == ["password"]
+    service.ldap.modify_entry.assert_called_once_with(USER_DN, {"userPassword": "secret"})
+    # La contraseña no se lee para compararla
+    assert "userPassword" not in service.ldap.read_raw.call_args[0][1]
+
+
+def test_update_user_not_found(service):
+    service.ldap.read_raw.side_effect = None
+    service.ldap.read_raw.return_value = None
+
+    with pytest.raises(Exception, match="User not found"):
+        service.update_user("ana@x.com", {"position": "Manager"}, user_dn=USER_DN)